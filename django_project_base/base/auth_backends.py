@@ -5,6 +5,7 @@ from django.contrib.auth.backends import ModelBackend
 from django.core.cache import cache
 from django.db.models.signals import post_delete, post_save
 
+from django_project_base.caching.codec import get_cache_codec
 from django_project_base.settings import USER_CACHE_KEY
 
 
@@ -41,9 +42,9 @@ class UsersCachingBackend(UsersBackend):
         post_delete.connect(invalidate_cache, sender=swapper.load_model("django_project_base", "Profile"))
 
     def get_user(self, user_id):
-        user = cache.get(USER_CACHE_KEY.format(id=user_id or 0))
+        user = get_cache_codec().decode(cache.get(USER_CACHE_KEY.format(id=user_id or 0)))
         if not user:
             user = super().get_user(user_id)
             if user_id and user:
-                cache.set(USER_CACHE_KEY.format(id=user_id or 0), user)
+                cache.set(USER_CACHE_KEY.format(id=user_id or 0), get_cache_codec().encode(user))
         return user
@@ -5,6 +5,8 @@ from typing import Optional
 from django.conf import settings
 from django.core.handlers.wsgi import WSGIRequest
 
+from django_project_base.query_tracker.summary import QuerySummary
+
 _threadmap = {}
 _threadmap_cnt = {}
 
@@ -56,7 +58,11 @@ class UrlVarsMiddleware:
         _threadmap[threading_ident] = request
         _threadmap_cnt[threading_ident] = _threadmap_cnt.get(threading_ident, 0) + 1
 
-        response = self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            # query_tracker in summary mode collects queries of the request on it
+            QuerySummary.log_request(request)
 
         _threadmap_cnt[threading_ident] = _threadmap_cnt.get(threading_ident, 0) - 1
         if not _threadmap_cnt[threading_ident]:
@@ -1,65 +1,297 @@
 import hashlib
+import math
 import pickle
+import random
+import time
+import warnings
 
-from typing import Any
+from typing import Any, Callable, Optional
 
 from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.db.models import Model
 
+from django_project_base.caching.codec import CacheCodec, get_cache_codec
+from django_project_base.caching.local_cache import LocalCache
+
 
 class QuerySetWithCache(models.query.QuerySet):
+    """
+    All cache keys of a model contain the model's generation number. Invalidation just increments the generation,
+    which works in O(1) on any cache backend. Entries of old generations are never read again and age out by timeout.
+
+    With local_cache_timeout, values and the generation are also kept in process memory for that many seconds.
+    Values are kept pickled and unpickled on every hit, so callers never share instances. The local tier thus only
+    saves the round trip to the shared cache, not the deserialization cost. Invalidations made by other
+    processes are only seen when the locally cached generation expires, so they may read stale values for up to
+    local_cache_timeout seconds.
+    """
+
     def cache_delete_pattern(self, pattern: str):
-        if getattr(cache, "delete_pattern", None):
-            cache.delete_pattern(pattern)
-        else:
-            # TODO: handle this !!!!!
-            pass
+        warnings.warn(
+            "cache_delete_pattern is deprecated, use invalidate_cache instead", DeprecationWarning, stacklevel=2
+        )
+        self.invalidate_cache()
 
     @property
     def cache_timeout(self) -> int:
         return 300
 
+    @property
+    def cache_stampede_protection(self) -> bool:
+        return False
+
+    @property
+    def cache_stale_timeout(self) -> int:
+        return self.cache_timeout
+
+    @property
+    def cache_stampede_lock_timeout(self) -> int:
+        return 10
+
+    @property
+    def cache_early_expiration_beta(self) -> float:
+        return 0
+
+    @property
+    def local_cache_timeout(self) -> int:
+        return 0
+
+    @property
+    def local_cache_size(self) -> int:
+        return 1000
+
     @property
     def base_cache_key(self) -> str:
         return self.model.__name__.lower()
 
-    def get_base_cache_key_item(self, pk: object) -> str:
-        return "%s__pk__%s" % (self.base_cache_key, str(pk))
+    @property
+    def cache_codec(self) -> CacheCodec:
+        return get_cache_codec()
+
+    @property
+    def local_cache(self) -> Optional[LocalCache]:
+        if not self.local_cache_timeout:
+            return None
+        return LocalCache.get_local_cache(self.base_cache_key, self.local_cache_size, self.local_cache_timeout)
+
+    @property
+    def local_generation_cache(self) -> Optional[LocalCache]:
+        if not self.local_cache_timeout:
+            return None
+        return LocalCache.get_local_cache(self.generation_cache_key, 1, self.local_cache_timeout)
+
+    @staticmethod
+    def local_cache_set(local_cache: LocalCache, ck: str, encoded: Any):
+        # Stored pickled: every hit pays for unpickling, but builds its own instances, so callers can't change each
+        # other's values
+        local_cache.set(ck, pickle.dumps(encoded, pickle.HIGHEST_PROTOCOL))
+
+    def cache_get(self, ck: str) -> Any:
+        local_cache: Optional[LocalCache] = self.local_cache
+        if local_cache:
+            data: Optional[bytes] = local_cache.get(ck)
+            if data is not None:
+                return self.cache_codec.decode(pickle.loads(data))
+        encoded: Any = cache.get(ck)
+        if local_cache and encoded is not None:
+            self.local_cache_set(local_cache, ck, encoded)
+        return self.cache_codec.decode(encoded)
+
+    def cache_set(self, ck: str, value: Any, timeout: Optional[int] = None):
+        encoded: Any = self.cache_codec.encode(value)
+        cache.set(ck, encoded, timeout=self.cache_timeout if timeout is None else timeout)
+        if local_cache := self.local_cache:
+            self.local_cache_set(local_cache, ck, encoded)
+
+    def cache_get_many(self, keys: list) -> dict:
+        local_cache: Optional[LocalCache] = self.local_cache
+        encoded_values: dict = {}
+        if local_cache:
+            for ck in keys:
+                if (data := local_cache.get(ck)) is not None:
+                    encoded_values[ck] = pickle.loads(data)
+        if missing_keys := [ck for ck in keys if ck not in encoded_values]:
+            shared_values: dict = {ck: value for ck, value in cache.get_many(missing_keys).items() if value is not None}
+            if local_cache:
+                for ck, encoded in shared_values.items():
+                    self.local_cache_set(local_cache, ck, encoded)
+            encoded_values.update(shared_values)
+        codec: CacheCodec = self.cache_codec
+        return {
+            ck: value
+            for ck, value in ((ck, codec.decode(encoded)) for ck, encoded in encoded_values.items())
+            if value is not None
+        }
+
+    def cache_set_many(self, data: dict, timeout: Optional[int] = None):
+        codec: CacheCodec = self.cache_codec
+        encoded_data: dict = {ck: codec.encode(value) for ck, value in data.items()}
+        cache.set_many(encoded_data, timeout=self.cache_timeout if timeout is None else timeout)
+        if local_cache := self.local_cache:
+            for ck, encoded in encoded_data.items():
+                self.local_cache_set(local_cache, ck, encoded)
+
+    @staticmethod
+    def get_protected_cache_key(ck: str) -> str:
+        # Stampede protected entries are stored under their own keys: a plain value is never read as an entry
+        return "%s__protected" % ck
+
+    @staticmethod
+    def get_protected_entry(entry: Any) -> Optional[tuple]:
+        """Returns (value, fresh until, time it took to compute value) if entry has that shape, None otherwise"""
+        if (
+            isinstance(entry, tuple)
+            and len(entry) == 3
+            and isinstance(entry[1], (int, float))
+            and isinstance(entry[2], (int, float))
+        ):
+            return entry
+        return None
+
+    def cache_get_or_compute(self, ck: str, compute: Callable[[], Any]) -> Any:
+        if not self.cache_stampede_protection:
+            value: Any = self.cache_get(ck)
+            if value is None:
+                value = compute()
+                self.cache_set(ck, value)
+            return value
+
+        ck = self.get_protected_cache_key(ck)
+        entry: Optional[tuple] = self.get_protected_entry(self.cache_get(ck))
+        if entry is not None:
+            value, fresh_until, compute_time = entry
+            early: float = -compute_time * self.cache_early_expiration_beta * math.log(1 - random.random())
+            if time.time() + early < fresh_until:
+                return value
+
+        lock_key: str = "%s__lock" % ck
+        if cache.add(lock_key, 1, timeout=self.cache_stampede_lock_timeout):
+            try:
+                start: float = time.time()
+                value = compute()
+                now: float = time.time()
+                self.cache_set(
+                    ck, (value, now + self.cache_timeout, now - start), self.cache_timeout + self.cache_stale_timeout
+                )
+                return value
+            finally:
+                cache.delete(lock_key)
+
+        if entry is not None:
+            # Another worker is recomputing the value, so we serve the stale one meanwhile
+            return entry[0]
+
+        # Nothing to serve: wait for the worker that is computing the value
+        wait_until: float = time.time() + self.cache_stampede_lock_timeout
+        while time.time() < wait_until and cache.get(lock_key) is not None:
+            time.sleep(0.05)
+            if (entry := self.get_protected_entry(self.cache_codec.decode(cache.get(ck)))) is not None:
+                return entry[0]
+        return compute()
+
+    @property
+    def generation_cache_key(self) -> str:
+        return "%s__generation" % self.base_cache_key
+
+    def get_generation(self) -> int:
+        local_generation_cache: Optional[LocalCache] = self.local_generation_cache
+        if local_generation_cache and (generation := local_generation_cache.get(self.generation_cache_key)):
+            return generation
+        generation: int = cache.get(self.generation_cache_key)
+        if generation is None:
+            # Generation starts at current time so keys of a generation evicted from cache can't be reused
+            cache.add(self.generation_cache_key, int(time.time() * 1000), timeout=None)
+            generation = cache.get(self.generation_cache_key)
+        if local_generation_cache:
+            local_generation_cache.set(self.generation_cache_key, generation)
+        return generation
+
+    def get_cache_key(self, key: str, generation: Optional[int] = None) -> str:
+        return "%s__%s__%s" % (self.base_cache_key, generation or self.get_generation(), key)
+
+    def get_base_cache_key_item(self, pk: object, generation: Optional[int] = None) -> str:
+        return self.get_cache_key("pk__%s" % str(pk), generation)
+
+    def get_pk_lookup(self, args: tuple, kwargs: dict) -> Optional[object]:
+        """Returns pk if get() arguments are a plain pk lookup on an unfiltered queryset, None otherwise"""
+        if args or len(kwargs) != 1 or self.query.where:
+            return None
+        name, value = next(iter(kwargs.items()))
+        pk_field = self.model._meta.pk
+        if name not in ("pk", pk_field.name, pk_field.attname):
+            return None
+        try:
+            return pk_field.to_python(value)
+        except ValidationError:
+            return None
 
     def hash_args_kwargs(self, *args, **kwargs) -> str:
         return hashlib.md5(pickle.dumps((args, sorted(kwargs.items())))).hexdigest()
 
     def update(self, **kwargs):
         updated: Any = super().update(**kwargs)
-        self.cache_delete_pattern("%s*" % self.base_cache_key)
+        self.invalidate_cache()
         return updated
 
     def get(self, *args, **kwargs):
-        ck: str = self.get_base_cache_key_item(self.hash_args_kwargs(args, kwargs))
-        cached_item: Model = cache.get(ck)
-        if cached_item:
-            return cached_item
-        item: Model = super().get(*args, **kwargs)
-        cache.set(ck, item, timeout=self.cache_timeout)
-        return item
+        # pk lookups are keyed by pk only, so they share cache entries with in_bulk
+        pk: Optional[object] = self.get_pk_lookup(args, kwargs)
+        ck: str = self.get_base_cache_key_item(self.hash_args_kwargs(args, kwargs) if pk is None else pk)
+        return self.cache_get_or_compute(ck, lambda: super(QuerySetWithCache, self).get(*args, **kwargs))
+
+    def in_bulk(self, id_list=None, *, field_name="pk"):
+        if id_list is None or field_name != "pk" or self.query.where or self.query.is_sliced:
+            return super().in_bulk(id_list, field_name=field_name)
+
+        pk_field = self.model._meta.pk
+        generation: int = self.get_generation()
+        protection: bool = self.cache_stampede_protection
+
+        def get_key(pk: object) -> str:
+            ck: str = self.get_base_cache_key_item(pk, generation)
+            return self.get_protected_cache_key(ck) if protection else ck
+
+        keys: dict = {get_key(pk): pk for pk in map(pk_field.to_python, id_list)}
+        result: dict = {}
+        now: float = time.time()
+        for ck, entry in self.cache_get_many(list(keys)).items():
+            if not protection:
+                result[keys[ck]] = entry
+            elif (entry := self.get_protected_entry(entry)) is not None and entry[1] > now:
+                result[keys[ck]] = entry[0]
+
+        if missing := [pk for pk in keys.values() if pk not in result]:
+            start: float = time.time()
+            loaded: dict = super().in_bulk(missing)
+            now = time.time()
+            if protection:
+                entries: dict = {pk: (item, now + self.cache_timeout, now - start) for pk, item in loaded.items()}
+                timeout: Optional[int] = self.cache_timeout + self.cache_stale_timeout
+            else:
+                entries, timeout = loaded, None
+            self.cache_set_many({get_key(pk): e for pk, e in entries.items()}, timeout)
+            result.update(loaded)
+        return result
 
     def create(self, **kwargs):
         item: Model = super().create(**kwargs)
-        self.cache_delete_pattern("%s*" % self.base_cache_key)
+        self.invalidate_cache()
         return item
 
     def filter(self, *args, **kwargs):
         return super().filter(*args, **kwargs)
 
     def list(self, *args, **kwargs):
-        ck: str = "%s_%s_%s" % (self.base_cache_key, "filter", self.hash_args_kwargs(args, kwargs))
-        cached_data: list = cache.get(ck)
-        if cached_data is not None:
-            return cached_data
-        _data: list = list(super().filter(*args, **kwargs))
-        cache.set(ck, _data, timeout=self.cache_timeout)
-        return _data
-
-    def invalidate_cache(self, pk):
-        self.cache_delete_pattern("%s*" % self.base_cache_key)
+        ck: str = self.get_cache_key("filter_%s" % self.hash_args_kwargs(args, kwargs))
+        return self.cache_get_or_compute(ck, lambda: list(super(QuerySetWithCache, self).filter(*args, **kwargs)))
+
+    def invalidate_cache(self, pk=None):
+        try:
+            generation: int = cache.incr(self.generation_cache_key)
+        except ValueError:
+            # No generation yet, so there is nothing cached to invalidate
+            return
+        if local_generation_cache := self.local_generation_cache:
+            local_generation_cache.set(self.generation_cache_key, generation)
@@ -1,12 +1,64 @@
+import atexit
+import os
+import threading
+import time
+
+from typing import Callable, Optional
+
 from django.core.cache import caches
 
 
+class FlushThread:
+    """
+    Daemon thread calling flush every interval milliseconds. start is cheap once the thread runs, so buffering
+    writers call it on every write. Threads don't survive fork: call reset_after_fork in the child.
+    """
+
+    def __init__(self, name: str, flush: Callable, on_error: Optional[Callable] = None):
+        self.name = name
+        self.flush = flush
+        self.on_error = on_error
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, interval: float):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._flush_loop, args=(interval,), name=self.name, daemon=True)
+            self._thread.start()
+
+    def _flush_loop(self, interval: float):
+        while True:
+            time.sleep(interval / 1000)
+            try:
+                self.flush()
+            except Exception as exc:
+                if self.on_error:
+                    self.on_error(exc)
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._thread = None
+
+
+def register_flush(at_exit: Callable, after_fork_in_child: Callable):
+    """Buffered data is flushed on process exit. Child processes drop data buffered by the parent"""
+    atexit.register(at_exit)
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=after_fork_in_child)
+
+
 class CacheCounter:
     cache = None
+    cache_name = None
     key = None
     timeout = None
 
     def __init__(self, key, cache_name="default", timeout=-1):
+        self.cache_name = cache_name
         self.cache = caches[cache_name]
         self.set_timeout(timeout)
         self.key = key
@@ -37,3 +89,44 @@ class CacheCounter:
             except ValueError:  # pragma: no cover
                 # This happens if another thread just deleted the cache entry after our .add and before our .incr
                 pass
+
+
+class BufferedCacheCounter(CacheCounter):
+    """
+    Counter for high-rate increments where the current value isn't needed.
+
+    Increments are accumulated in process memory and sent to cache with one incr per key every flush_interval
+    milliseconds and on process exit. incr therefore returns None: use CacheCounter where the exact value is needed.
+    """
+
+    flush_interval = 1000
+
+    _pending = {}
+    _lock = threading.Lock()
+    # Flush errors are ignored: if cache is temporarily unavailable, increments of that flush are lost
+    _flush_thread = FlushThread("BufferedCacheCounter", lambda: BufferedCacheCounter.flush())
+
+    def incr(self, step=1, start=0):
+        counter_key = (self.cache_name, self.key, self.timeout, start)
+        with self._lock:
+            BufferedCacheCounter._pending[counter_key] = BufferedCacheCounter._pending.get(counter_key, 0) + step
+        self._flush_thread.start(self.flush_interval)
+        return None
+
+    @classmethod
+    def flush(cls):
+        with cls._lock:
+            pending, BufferedCacheCounter._pending = BufferedCacheCounter._pending, {}
+        for (cache_name, key, timeout, start), step in pending.items():
+            if step:
+                CacheCounter(key, cache_name=cache_name, timeout=timeout).incr(step=step, start=start)
+
+    @classmethod
+    def _reset_after_fork(cls):
+        # Increments buffered by parent will be flushed by the parent
+        BufferedCacheCounter._lock = threading.Lock()
+        BufferedCacheCounter._pending = {}
+        BufferedCacheCounter._flush_thread.reset_after_fork()
+
+
+register_flush(BufferedCacheCounter.flush, BufferedCacheCounter._reset_after_fork)
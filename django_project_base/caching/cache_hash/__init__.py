@@ -0,0 +1,70 @@
+from abc import ABC, abstractmethod
+from typing import Dict, List
+
+from django.core.cache import caches
+
+from django_project_base.caching.cache_queue import CacheQueue
+
+
+class CacheHash(ABC):
+    """
+    Hash of integer counters (redis hash with HINCRBY semantics).
+
+    Meant for aggregates updated by many processes, e.g. per-path request counts of a time bucket: every process
+    increments fields of the same hash and readers get all the fields with a single call.
+    """
+
+    key = None
+    cache = None
+    timeout = None
+    django_cache = None
+
+    def __init__(self, key, cache_name, timeout):
+        self.cache_name = cache_name
+        self.django_cache = caches[self.cache_name]
+        self.set_cache()
+        self.key = key
+        self.set_timeout(timeout)
+
+    @abstractmethod
+    def set_cache(self):
+        """Set cache client"""
+
+    @abstractmethod
+    def incr(self, mapping: Dict[str, int]):
+        """Increment fields of the hash by given amounts. Missing fields start at 0"""
+
+    @abstractmethod
+    def get_all(self) -> Dict[str, int]:
+        """Get all fields of the hash"""
+
+    def get_default_timeout(self):
+        return self.django_cache.default_timeout
+
+    def set_timeout(self, timeout):
+        if timeout == -1:
+            timeout = self.get_default_timeout()
+        self.timeout = timeout
+
+    @staticmethod
+    def get_cache_hash(key, cache_name="default", timeout=-1):
+        if CacheQueue.is_redis_cache_backend(cache_name):
+            from django_project_base.caching.cache_hash.cache_hash_redis import CacheHashRedis
+
+            return CacheHashRedis(key, cache_name=cache_name, timeout=timeout)
+        else:
+            from django_project_base.caching.cache_hash.cache_hash_other import CacheHashOther
+
+            return CacheHashOther(key, cache_name=cache_name, timeout=timeout)
+
+    @staticmethod
+    def get_all_many(keys: List[str], cache_name="default") -> Dict[str, Dict[str, int]]:
+        """Get all fields of many hashes in one round trip. Hashes that don't exist are omitted"""
+        if CacheQueue.is_redis_cache_backend(cache_name):
+            from django_project_base.caching.cache_hash.cache_hash_redis import CacheHashRedis
+
+            return CacheHashRedis.get_all_many(keys, cache_name)
+        else:
+            from django_project_base.caching.cache_hash.cache_hash_other import CacheHashOther
+
+            return CacheHashOther.get_all_many(keys, cache_name)
@@ -0,0 +1,29 @@
+from typing import Dict, List
+
+from django.core.cache import caches
+
+from django_project_base.caching.cache_hash import CacheHash
+from django_project_base.serialization import CacheLock
+
+
+class CacheHashOther(CacheHash):
+    """Whole hash is kept as a dict under a single key and updates serialize on a CacheLock"""
+
+    def set_cache(self):
+        self.cache = self.django_cache
+
+    def incr(self, mapping: Dict[str, int]):
+        if not mapping:
+            return
+        with CacheLock(self.key):
+            values = self.cache.get(self.key) or {}
+            for field, amount in mapping.items():
+                values[field] = values.get(field, 0) + amount
+            self.cache.set(self.key, values, timeout=self.timeout)
+
+    def get_all(self) -> Dict[str, int]:
+        return self.cache.get(self.key) or {}
+
+    @staticmethod
+    def get_all_many(keys: List[str], cache_name="default") -> Dict[str, Dict[str, int]]:
+        return caches[cache_name].get_many(keys)
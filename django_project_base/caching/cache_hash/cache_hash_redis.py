@@ -0,0 +1,36 @@
+from typing import Dict, List
+
+from django_redis import get_redis_connection
+
+from django_project_base.caching.cache_hash import CacheHash
+
+
+class CacheHashRedis(CacheHash):
+    def set_cache(self):
+        self.cache = get_redis_connection(self.cache_name)
+
+    def incr(self, mapping: Dict[str, int]):
+        if not mapping:
+            return
+        pipeline = self.cache.pipeline(transaction=True)
+        for field, amount in mapping.items():
+            pipeline.hincrby(self.key, field, amount)
+        if self.timeout is None:
+            pipeline.persist(self.key)
+        else:
+            pipeline.expire(self.key, self.timeout)
+        pipeline.execute()
+
+    @staticmethod
+    def _decode(values) -> Dict[str, int]:
+        return {field.decode("utf-8"): int(value) for field, value in values.items()}
+
+    def get_all(self) -> Dict[str, int]:
+        return self._decode(self.cache.hgetall(self.key))
+
+    @staticmethod
+    def get_all_many(keys: List[str], cache_name="default") -> Dict[str, Dict[str, int]]:
+        pipeline = get_redis_connection(cache_name).pipeline(transaction=False)
+        for key in keys:
+            pipeline.hgetall(key)
+        return {key: CacheHashRedis._decode(values) for key, values in zip(keys, pipeline.execute()) if values}
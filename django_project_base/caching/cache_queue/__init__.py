@@ -1,11 +1,23 @@
+import threading
+import time
+
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import nullcontext
 from typing import Optional
 
 from django.conf import settings
-from django.core.cache import cache, caches
+from django.core.cache import caches
+from django.core.signals import setting_changed
 
 
 class CacheQueue(ABC):
+    POOL_SIZE = 1000
+
+    _redis_cache_backends = {}
+    _pool = threading.local()
+    _pool_generation = 0
+
     key = None
     cache = None
     timeout = None
@@ -38,6 +50,35 @@ class CacheQueue(ABC):
     def rpop(self, count: Optional[int] = None):
         """Get and remove data from end of queue"""
 
+    @abstractmethod
+    def blpop(self, timeout: float = 0, count: Optional[int] = None):
+        """
+        Get and remove data from start of queue. If queue is empty, wait up to timeout seconds (0 means no limit)
+        for data to arrive. Returns None if there was no data in given time
+        """
+
+    def consume(self, batch_size: int = 100, max_wait: float = 1):
+        """
+        Generator yielding lists of items from start of queue. It waits for the first item, then keeps collecting
+        more until batch_size items are collected or max_wait seconds have passed
+        """
+        while True:
+            batch = self._as_list(self.blpop(0, batch_size))
+            wait_until = time.time() + max_wait
+            while len(batch) < batch_size and (remaining := wait_until - time.time()) > 0:
+                items = self._as_list(self.blpop(remaining, batch_size - len(batch)))
+                if not items:
+                    break
+                batch.extend(items)
+            if batch:
+                yield batch
+
+    @staticmethod
+    def _as_list(items):
+        if items is None:
+            return []
+        return items if isinstance(items, list) else [items]
+
     @abstractmethod
     def lrange(self, count=None):
         """Get data from start of queue"""
@@ -60,59 +101,110 @@ class CacheQueue(ABC):
 
     @staticmethod
     def is_redis_cache_backend(cache_name):
-        cache_key = f"redis_cache_backend_{cache_name}"
-        is_redis_backend = cache.get(cache_key, None)
+        # Detection is done once per process, so getting a queue or a lock costs no I/O
+        is_redis_backend = CacheQueue._redis_cache_backends.get(cache_name)
         if is_redis_backend is None:
-            import warnings
+            is_redis_backend = CacheQueue._redis_cache_backends[cache_name] = CacheQueue._detect_redis_cache_backend(
+                cache_name
+            )
+        return is_redis_backend
+
+    @staticmethod
+    def _detect_redis_cache_backend(cache_name):
+        import warnings
+
+        from django.utils.module_loading import import_string
 
-            from django.utils.module_loading import import_string
+        try:
             from django_redis.cache import RedisCache
+        except ImportError:
+            # django-redis is optional: without it, no cache is treated as redis
+            return False
 
-            backend_path = settings.CACHES[cache_name]["BACKEND"]
-            backend_class = import_string(backend_path)
-            is_redis_backend = issubclass(backend_class, RedisCache)
+        backend_path = settings.CACHES[cache_name]["BACKEND"]
+        backend_class = import_string(backend_path)
+        is_redis_backend = issubclass(backend_class, RedisCache)
 
-            if is_redis_backend:
-                try:
-                    from django_redis import get_redis_connection
-                    from packaging import version
+        if is_redis_backend:
+            try:
+                from django_redis import get_redis_connection
+                from packaging import version
 
-                    conn = get_redis_connection(cache_name)
+                conn = get_redis_connection(cache_name)
 
-                    # Execute the INFO command
-                    info = conn.info()
+                # Execute the INFO command
+                info = conn.info()
 
-                    # Get the Redis version
-                    redis_version = info.get("redis_version")
+                # Get the Redis version
+                redis_version = info.get("redis_version")
 
-                    if version.parse(redis_version) < version.parse("6.2"):
-                        # we need django_redis installed and redis server must be greater than 6.2.0
-                        warnings.warn(
-                            "You are using redis cache and have django-redis package installed, "
-                            "but redis server version is older than 6.2.0 which is needed for redis-optimised queue. "
-                            "We will be using a non-optimised queue instead."
-                        )
-                        return False
-                except ModuleNotFoundError:
+                if version.parse(redis_version) < version.parse("6.2"):
+                    # we need django_redis installed and redis server must be greater than 6.2.0
                     warnings.warn(
-                        "You are using redis cache, but django-redis package is not installed. "
-                        "If it were installed, we would be using redis-optimised Queue"
+                        "You are using redis cache and have django-redis package installed, "
+                        "but redis server version is older than 6.2.0 which is needed for redis-optimised queue. "
+                        "We will be using a non-optimised queue instead."
                     )
                     return False
-            else:
-                warnings.warn("Cache backend is not RedisCache. We will be using a non-optimised queue.")
-
-            cache.set(cache_key, is_redis_backend)
+            except ModuleNotFoundError:
+                warnings.warn(
+                    "You are using redis cache, but django-redis package is not installed. "
+                    "If it were installed, we would be using redis-optimised Queue"
+                )
+                return False
+        else:
+            warnings.warn("Cache backend is not RedisCache. We will be using a non-optimised queue.")
 
         return is_redis_backend
 
+    @staticmethod
+    def batch(cache_name="default"):
+        """Context manager that sends all pushes made within it in one round trip (redis only)"""
+        if CacheQueue.is_redis_cache_backend(cache_name):
+            from django_project_base.caching.cache_queue.cache_queue_redis import CacheQueueRedis
+
+            return CacheQueueRedis.batch(cache_name)
+        return nullcontext()
+
     @staticmethod
     def get_cache_queue(key, cache_name="default", timeout=-1):
+        """
+        Queue instances are pooled per thread, so don't change their timeout. Get a queue with desired timeout instead.
+        """
+        if getattr(CacheQueue._pool, "generation", None) != CacheQueue._pool_generation:
+            CacheQueue._pool.generation = CacheQueue._pool_generation
+            CacheQueue._pool.queues = OrderedDict()
+        pool = CacheQueue._pool.queues
+        pool_key = (key, cache_name, timeout)
+        cache_queue = pool.get(pool_key)
+        if cache_queue is not None:
+            return cache_queue
+
         if CacheQueue.is_redis_cache_backend(cache_name):
             from django_project_base.caching.cache_queue.cache_queue_redis import CacheQueueRedis
 
-            return CacheQueueRedis(key, cache_name=cache_name, timeout=timeout)
+            cache_queue = CacheQueueRedis(key, cache_name=cache_name, timeout=timeout)
+        elif getattr(settings, "DJANGO_PROJECT_BASE_CACHE_QUEUE_SEGMENTED", False):
+            from django_project_base.caching.cache_queue.cache_queue_segmented import CacheQueueSegmented
+
+            cache_queue = CacheQueueSegmented(key, cache_name=cache_name, timeout=timeout)
         else:
             from django_project_base.caching.cache_queue.cache_queue_other import CacheQueueOther
 
-            return CacheQueueOther(key, cache_name=cache_name, timeout=timeout)
+            cache_queue = CacheQueueOther(key, cache_name=cache_name, timeout=timeout)
+        pool[pool_key] = cache_queue
+        if len(pool) > CacheQueue.POOL_SIZE:
+            pool.popitem(last=False)
+        return cache_queue
+
+    @staticmethod
+    def reset(**kwargs):
+        """Forgets detected backends and pooled queues. Called when queue settings change (e.g. in tests)"""
+        setting = kwargs.get("setting", "CACHES")
+        if setting == "CACHES":
+            CacheQueue._redis_cache_backends.clear()
+        if setting in ("CACHES", "DJANGO_PROJECT_BASE_CACHE_QUEUE_SEGMENTED"):
+            CacheQueue._pool_generation += 1
+
+
+setting_changed.connect(CacheQueue.reset)
@@ -1,3 +1,6 @@
+import threading
+import time
+
 from typing import Optional
 
 from django_project_base.caching.cache_queue import CacheQueue
@@ -5,9 +8,21 @@ from django_project_base.serialization import CacheLock
 
 
 class CacheQueueOther(CacheQueue):
+    # Wakes up blpop waiters in this process when something is pushed. Pushes from other processes are only noticed
+    # by polling, with a backoff of up to MAX_POLL_INTERVAL seconds
+    MAX_POLL_INTERVAL = 0.5
+    _pushed = threading.Condition()
+    _push_count = 0
+
     def set_cache(self):
         self.cache = self.django_cache
 
+    # noinspection PyMethodMayBeStatic
+    def notify_waiters(self):
+        with CacheQueueOther._pushed:
+            CacheQueueOther._push_count += 1
+            CacheQueueOther._pushed.notify_all()
+
     # noinspection PyPackageRequirements,PyMethodMayBeStatic
     def get_byte_values(self, values):
         def _get_byte_value(_item):
@@ -23,6 +38,7 @@ class CacheQueueOther(CacheQueue):
             cache_list.extend(self.get_byte_values(values))
             self.cache.set(self.key, cache_list)
             self.update_timeout()
+        self.notify_waiters()
 
     def lpush(self, *values):
         with CacheLock(self.key):
@@ -30,6 +46,7 @@ class CacheQueueOther(CacheQueue):
             cache_list[:0] = reversed(self.get_byte_values(values))
             self.cache.set(self.key, cache_list)
             self.update_timeout()
+        self.notify_waiters()
 
     def lpop(self, count: Optional[int] = None):
         if not count or count <= 0:
@@ -47,6 +64,22 @@ class CacheQueueOther(CacheQueue):
         else:
             return ret[0]
 
+    def blpop(self, timeout: float = 0, count: Optional[int] = None):
+        wait_until = time.time() + timeout if timeout else None
+        poll_interval = 0.01
+        while True:
+            push_count = CacheQueueOther._push_count
+            ret = self.lpop(count)
+            if ret is not None:
+                return ret
+            wait = min(poll_interval, wait_until - time.time()) if wait_until else poll_interval
+            if wait <= 0:
+                return None
+            with CacheQueueOther._pushed:
+                if push_count == CacheQueueOther._push_count:
+                    CacheQueueOther._pushed.wait(wait)
+            poll_interval = min(poll_interval * 2, self.MAX_POLL_INTERVAL)
+
     def rpop(self, count: Optional[int] = None):
         if not count or count <= 0:
             count = 1
@@ -1,41 +1,103 @@
+import threading
+
+from contextlib import contextmanager
 from typing import Optional
 
 from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
 
 from django_project_base.caching.cache_queue import CacheQueue
 
 
 class CacheQueueRedis(CacheQueue):
+    """
+    Every data operation is sent together with its TTL refresh in a single MULTI / EXEC pipeline, so each call
+    costs one round trip and the key never exists without its timeout.
+    """
+
+    _batches = threading.local()
+    # BLMPOP needs redis server 7.0. On older servers blpop with count falls back to BLPOP + LPOP
+    _has_blmpop = True
+
     def set_cache(self):
         self.cache = get_redis_connection(self.cache_name)
 
+    @classmethod
+    @contextmanager
+    def batch(cls, cache_name="default"):
+        """
+        Buffers pushes to any number of queues on given cache and sends them in a single pipeline on exit
+
+        with CacheQueue.batch():
+            CacheQueue.get_cache_queue("queue1").rpush(...)
+            CacheQueue.get_cache_queue("queue2").rpush(...)
+        """
+        batches = cls._batches.__dict__
+        if cache_name in batches:
+            # Nested batch: outer one will flush the pipeline
+            yield batches[cache_name]
+            return
+        pipeline = batches[cache_name] = get_redis_connection(cache_name).pipeline(transaction=False)
+        try:
+            yield pipeline
+        finally:
+            del batches[cache_name]
+        pipeline.execute()
+
+    def _execute(self, command, *args, batched=False):
+        pipeline = self._batches.__dict__.get(self.cache_name) if batched else None
+        if pipeline is not None:
+            getattr(pipeline, command)(self.key, *args)
+            self._update_timeout(pipeline)
+            return None
+        pipeline = self.cache.pipeline(transaction=True)
+        getattr(pipeline, command)(self.key, *args)
+        self._update_timeout(pipeline)
+        return pipeline.execute()[0]
+
     def rpush(self, *values):
-        self.cache.rpush(self.key, *values)
-        self.update_timeout()
+        self._execute("rpush", *values, batched=True)
 
     def lpush(self, *values):
-        self.cache.lpush(self.key, *values)
-        self.update_timeout()
+        self._execute("lpush", *values, batched=True)
 
     def rpop(self, count: Optional[int] = None):
-        ret = self.cache.rpop(self.key, count)
-        self.update_timeout()
-        return ret
+        return self._execute("rpop", count)
 
     def lpop(self, count: Optional[int] = None):
-        ret = self.cache.lpop(self.key, count)
-        self.update_timeout()
+        return self._execute("lpop", count)
+
+    def blpop(self, timeout: float = 0, count: Optional[int] = None):
+        if count and count > 1 and CacheQueueRedis._has_blmpop:
+            try:
+                ret = self.cache.blmpop(timeout, 1, self.key, direction="LEFT", count=count)
+                ret = ret[1] if ret else None
+            except ResponseError as e:
+                # Only a server without BLMPOP falls back. Other errors (e.g. WRONGTYPE) are the caller's
+                if "unknown command" not in str(e).lower():
+                    raise
+                CacheQueueRedis._has_blmpop = False
+                return self.blpop(timeout, count)
+        else:
+            ret = self.cache.blpop([self.key], timeout)
+            ret = ret[1] if ret else None
+            if ret is not None and count and count > 1:
+                ret = [ret] + (self.cache.lpop(self.key, count - 1) or [])
+        if ret is not None:
+            self.update_timeout()
         return ret
 
     def lrange(self, count=-1):
         return self.cache.lrange(self.key, 0, count)
 
     def ltrim(self, count=0):
-        self.cache.ltrim(self.key, count, -1)
-        self.update_timeout()
+        self._execute("ltrim", count, -1, batched=True)
 
-    def update_timeout(self):
+    def _update_timeout(self, client):
         if self.timeout is None:
-            self.cache.persist(self.key)
+            client.persist(self.key)
         else:
-            self.cache.expire(self.key, self.timeout)
+            client.expire(self.key, self.timeout)
+
+    def update_timeout(self):
+        self._update_timeout(self.cache)
@@ -0,0 +1,178 @@
+import time
+
+from typing import Optional
+
+from django_project_base.caching.cache_queue.cache_queue_other import CacheQueueOther
+from django_project_base.serialization import CacheLock
+
+
+class CacheQueueSegmented(CacheQueueOther):
+    """
+    Queue for non-redis cache backends that doesn't keep the whole queue under one key.
+
+    Queue boundaries are kept in head / tail counters that are only ever changed with cache.incr and every item is
+    stored in its own slot key. Appending to the queue (rpush) thus touches a constant number of keys and needs no
+    lock. Operations changing the head of the queue (lpush, lpop, rpop, ltrim) still serialize on a CacheLock, but
+    they only read and write the slots they affect. Slots are read one segment (SEGMENT_SIZE slots) per round trip.
+
+    Slots are written with the queue's timeout, which is not refreshed by later operations: refreshing it would touch
+    the whole queue, so items older than the timeout are dropped even from a queue that is in use. Slots missing when
+    read (expired, evicted by the cache or reserved by an rpush that didn't write them within SLOT_WAIT) are skipped:
+    head and tail move past them, so the queue never gets stuck on them.
+
+    Opt in with DJANGO_PROJECT_BASE_CACHE_QUEUE_SEGMENTED = True. Default for non-redis caches is CacheQueueOther.
+    """
+
+    SEGMENT_SIZE = 100
+    # memcached can't decrement below 0, so counters start in the middle of the range
+    COUNTER_START = 1 << 32
+    # how long a reader waits for a slot that was already reserved by a concurrent rpush, but not yet written
+    SLOT_WAIT = 0.1
+    # how long rpop waits for slots reserved by an rpush after it read the queue's bounds before skipping them
+    RESERVED_SLOT_WAIT = 5
+
+    @property
+    def head_key(self):
+        return f"{self.key}.head"
+
+    @property
+    def tail_key(self):
+        return f"{self.key}.tail"
+
+    def slot_key(self, idx):
+        return f"{self.key}.{idx}"
+
+    def _incr(self, key, delta):
+        while True:
+            try:
+                self.cache.add(key, self.COUNTER_START, timeout=self.timeout)
+                return self.cache.incr(key, delta)
+            except ValueError:  # pragma: no cover
+                # Key expired between our .add and .incr
+                pass
+
+    def _bounds(self):
+        counters = self.cache.get_many([self.head_key, self.tail_key])
+        head = counters.get(self.head_key, self.COUNTER_START)
+        tail = counters.get(self.tail_key, self.COUNTER_START)
+        return head, max(head, tail)
+
+    def _read_slots(self, indexes, wait=None) -> list:
+        """
+        Returns (key, value) of slots in order of indexes. Value is None for slots still missing after waiting for wait
+        (SLOT_WAIT if None) seconds per segment
+        """
+        keys = [self.slot_key(idx) for idx in indexes]
+        values = {}
+        for i in range(0, len(keys), self.SEGMENT_SIZE):
+            segment = keys[i : i + self.SEGMENT_SIZE]
+            values.update(self.cache.get_many(segment))
+            wait_until = time.time() + (self.SLOT_WAIT if wait is None else wait)
+            while len(values) < i + len(segment) and time.time() < wait_until:
+                time.sleep(0.001)
+                values.update(self.cache.get_many([key for key in segment if key not in values]))
+        return [(key, values.get(key)) for key in keys]
+
+    @staticmethod
+    def _pop_result(ret, count):
+        if not ret:
+            return None
+        if count > 1:
+            return ret
+        return ret[0]
+
+    def rpush(self, *values):
+        values = self.get_byte_values(values)
+        if not values:
+            return
+        self.cache.add(self.head_key, self.COUNTER_START, timeout=self.timeout)
+        tail = self._incr(self.tail_key, len(values))
+        self.cache.set_many(
+            {self.slot_key(idx): value for idx, value in zip(range(tail - len(values), tail), values)},
+            timeout=self.timeout,
+        )
+        self.update_timeout()
+        self.notify_waiters()
+
+    def lpush(self, *values):
+        values = self.get_byte_values(values)
+        if not values:
+            return
+        with CacheLock(self.key):
+            self.cache.add(self.tail_key, self.COUNTER_START, timeout=self.timeout)
+            head = self._incr(self.head_key, -len(values))
+            self.cache.set_many(
+                {self.slot_key(idx): value for idx, value in zip(range(head, head + len(values)), reversed(values))},
+                timeout=self.timeout,
+            )
+            self.update_timeout()
+        self.notify_waiters()
+
+    def lpop(self, count: Optional[int] = None):
+        if not count or count <= 0:
+            count = 1
+        ret = []
+        with CacheLock(self.key):
+            head, tail = self._bounds()
+            num_items = count
+            while len(ret) < count and head < tail:
+                # Head only moves under the lock, so slots can be read before they are taken off the queue
+                slots = self._read_slots(range(head, min(tail, head + num_items)))
+                taken = 0
+                for _key, value in slots:
+                    if len(ret) == count:
+                        break
+                    taken += 1
+                    if value is not None:
+                        ret.append(value)
+                head = self._incr(self.head_key, taken)
+                self.cache.delete_many([key for key, _value in slots[:taken]])
+                # Some slots were missing: skip past them reading whole segments instead of waiting for each one
+                num_items = self.SEGMENT_SIZE
+            self.update_timeout()
+        return self._pop_result(ret, count)
+
+    def rpop(self, count: Optional[int] = None):
+        if not count or count <= 0:
+            count = 1
+        ret = []
+        with CacheLock(self.key):
+            while len(ret) < count:
+                head, tail = self._bounds()
+                num_items = min(count - len(ret), tail - head)
+                if num_items <= 0:
+                    break
+                # rpush moves the tail without the lock, so slots must be taken off the queue before they are read
+                new_tail = self._incr(self.tail_key, -num_items)
+                indexes = range(new_tail + num_items - 1, new_tail - 1, -1)
+                # Slots past the tail read above were reserved by an rpush just now: give it longer to write them
+                slots = self._read_slots([idx for idx in indexes if idx >= tail], self.RESERVED_SLOT_WAIT)
+                slots += self._read_slots([idx for idx in indexes if idx < tail])
+                self.cache.delete_many([key for key, _value in slots])
+                ret.extend(value for _key, value in slots if value is not None)
+            self.update_timeout()
+        return self._pop_result(ret, count)
+
+    def lrange(self, count=None):
+        head, tail = self._bounds()
+        if count is None:
+            end = tail
+        elif count < 0:
+            end = tail + count + 1
+        else:
+            end = min(tail, head + count + 1)
+        return [value for _key, value in self._read_slots(range(head, end)) if value is not None]
+
+    def ltrim(self, count=None):
+        with CacheLock(self.key):
+            if count:
+                head, tail = self._bounds()
+                num_items = min(count, tail - head) if count > 0 else max(tail - head + count, 0)
+                if num_items > 0:
+                    head = self._incr(self.head_key, num_items)
+                    self.cache.delete_many([self.slot_key(idx) for idx in range(head - num_items, head)])
+            self.update_timeout()
+
+    def update_timeout(self):
+        self.cache.touch(self.head_key, self.timeout)
+        self.cache.touch(self.tail_key, self.timeout)
@@ -0,0 +1,87 @@
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
+
+from django.core.cache import caches
+
+from django_project_base.caching.cache_queue import CacheQueue
+
+
+class CacheStream(ABC):
+    """
+    Durable queue with consumer groups and acknowledgement (redis streams semantics).
+
+    Items read by a consumer stay pending in its group until they are acknowledged. Items of a consumer that died
+    before acknowledging them can be taken over by another consumer with reclaim. Entries are returned as a list of
+    (entry id, value) tuples.
+    """
+
+    key = None
+    cache = None
+    timeout = None
+    max_length = None
+    django_cache = None
+
+    def __init__(self, key, cache_name, timeout, max_length=None):
+        self.cache_name = cache_name
+        self.django_cache = caches[self.cache_name]
+        self.set_cache()
+        self.key = key
+        self.max_length = max_length
+        self.set_timeout(timeout)
+
+    @abstractmethod
+    def set_cache(self):
+        """Set cache client"""
+
+    @abstractmethod
+    def add(self, *values) -> list:
+        """Add data to end of stream. Returns ids of added entries"""
+
+    @abstractmethod
+    def read(self, group: str, consumer: str, count: int = 1, block: Optional[float] = None) -> List[Tuple]:
+        """
+        Get up to count entries not yet delivered to the group. Entries stay pending until acknowledged.
+        If there are none, wait up to block seconds (0 means wait forever) for them to arrive
+        """
+
+    @abstractmethod
+    def ack(self, group: str, *ids) -> int:
+        """Acknowledge processed entries so that they are no longer pending"""
+
+    @abstractmethod
+    def reclaim(self, group: str, consumer: str, min_idle_time: float, count: int = 100) -> List[Tuple]:
+        """Take over entries pending for longer than min_idle_time seconds (their consumer has probably died)"""
+
+    @abstractmethod
+    def pending(self, group: str) -> int:
+        """Number of entries delivered to group, but not acknowledged yet"""
+
+    @abstractmethod
+    def length(self) -> int:
+        """Number of entries in stream"""
+
+    def get_default_timeout(self):
+        return self.django_cache.default_timeout
+
+    def set_timeout(self, timeout):
+        if timeout == -1:
+            timeout = self.get_default_timeout()
+        self.timeout = timeout
+
+    # noinspection PyMethodMayBeStatic
+    def get_byte_values(self, values):
+        return [item if isinstance(item, bytes) else str(item).encode("utf-8") for item in values]
+
+    @staticmethod
+    def get_cache_stream(key, cache_name="default", timeout=None, max_length=None):
+        # Streams don't expire by default: pending entries and consumer groups would disappear with the key.
+        # Pass timeout=-1 for cache's default timeout. Stream on redis needs the same (>= 6.2) server version as the
+        # redis-optimised queue
+        if CacheQueue.is_redis_cache_backend(cache_name):
+            from django_project_base.caching.cache_stream.cache_stream_redis import CacheStreamRedis
+
+            return CacheStreamRedis(key, cache_name=cache_name, timeout=timeout, max_length=max_length)
+        else:
+            from django_project_base.caching.cache_stream.cache_stream_other import CacheStreamOther
+
+            return CacheStreamOther(key, cache_name=cache_name, timeout=timeout, max_length=max_length)
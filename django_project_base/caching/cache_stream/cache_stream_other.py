@@ -0,0 +1,116 @@
+import time
+
+from typing import List, Optional, Tuple
+
+from django_project_base.caching.cache_stream import CacheStream
+from django_project_base.serialization import CacheLock
+
+
+class CacheStreamOther(CacheStream):
+    """
+    Stand-in for CacheStreamRedis on other cache backends (e.g. locmem in tests).
+
+    Whole stream is kept under a single key and every operation serializes on a CacheLock, so it is only meant for
+    low volumes. Entry ids have the same "<milliseconds>-<sequence>" format as redis stream ids.
+    """
+
+    def set_cache(self):
+        self.cache = self.django_cache
+
+    @staticmethod
+    def _format_id(entry_id):
+        return ("%d-%d" % entry_id).encode("utf-8")
+
+    @staticmethod
+    def _parse_id(entry_id):
+        if isinstance(entry_id, bytes):
+            entry_id = entry_id.decode("utf-8")
+        ms, seq = entry_id.split("-")
+        return int(ms), int(seq)
+
+    def _get_stream(self):
+        return self.cache.get(self.key) or dict(last_id=(0, 0), entries=[], groups={})
+
+    def _set_stream(self, stream):
+        self.cache.set(self.key, stream, timeout=self.timeout)
+
+    @staticmethod
+    def _get_group(stream, group):
+        return stream["groups"].setdefault(group, dict(last_id=(0, 0), pending={}))
+
+    def add(self, *values) -> list:
+        ids = []
+        with CacheLock(self.key):
+            stream = self._get_stream()
+            for value in self.get_byte_values(values):
+                ms, seq = int(time.time() * 1000), 0
+                if ms <= stream["last_id"][0]:
+                    ms, seq = stream["last_id"][0], stream["last_id"][1] + 1
+                stream["last_id"] = (ms, seq)
+                stream["entries"].append((stream["last_id"], value))
+                ids.append(self._format_id(stream["last_id"]))
+            if self.max_length:
+                stream["entries"] = stream["entries"][-self.max_length :]
+            self._set_stream(stream)
+        return ids
+
+    def _read(self, group: str, consumer: str, count: int) -> List[Tuple]:
+        with CacheLock(self.key):
+            stream = self._get_stream()
+            stream_group = self._get_group(stream, group)
+            entries = [entry for entry in stream["entries"] if entry[0] > stream_group["last_id"]][:count]
+            if entries:
+                stream_group["last_id"] = entries[-1][0]
+                now = time.time()
+                for entry_id, _value in entries:
+                    stream_group["pending"][entry_id] = [consumer, now]
+            self._set_stream(stream)
+        return [(self._format_id(entry_id), value) for entry_id, value in entries]
+
+    def read(self, group: str, consumer: str, count: int = 1, block: Optional[float] = None) -> List[Tuple]:
+        wait_until = None if not block else time.time() + block
+        sleep = 0.01
+        while True:
+            entries = self._read(group, consumer, count)
+            if entries or block is None or (wait_until and time.time() >= wait_until):
+                return entries
+            time.sleep(max(min(sleep, wait_until - time.time()), 0) if wait_until else sleep)
+            sleep = min(sleep * 2, 0.5)
+
+    def ack(self, group: str, *ids) -> int:
+        acknowledged = 0
+        with CacheLock(self.key):
+            stream = self._get_stream()
+            stream_group = self._get_group(stream, group)
+            for entry_id in ids:
+                if stream_group["pending"].pop(self._parse_id(entry_id), None):
+                    acknowledged += 1
+            self._set_stream(stream)
+        return acknowledged
+
+    def reclaim(self, group: str, consumer: str, min_idle_time: float, count: int = 100) -> List[Tuple]:
+        ret = []
+        with CacheLock(self.key):
+            stream = self._get_stream()
+            stream_group = self._get_group(stream, group)
+            entries = dict(stream["entries"])
+            now = time.time()
+            for entry_id, pending in sorted(stream_group["pending"].items()):
+                if len(ret) >= count:
+                    break
+                if now - pending[1] < min_idle_time:
+                    continue
+                if entry_id not in entries:
+                    # Entry was trimmed from the stream while pending: there is nothing to process anymore
+                    del stream_group["pending"][entry_id]
+                    continue
+                stream_group["pending"][entry_id] = [consumer, now]
+                ret.append((self._format_id(entry_id), entries[entry_id]))
+            self._set_stream(stream)
+        return ret
+
+    def pending(self, group: str) -> int:
+        return len(self._get_group(self._get_stream(), group)["pending"])
+
+    def length(self) -> int:
+        return len(self._get_stream()["entries"])
@@ -0,0 +1,98 @@
+from typing import List, Optional, Tuple
+
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+
+from django_project_base.caching.cache_stream import CacheStream
+
+VALUE_FIELD = b"v"
+
+
+class CacheStreamRedis(CacheStream):
+    _groups = None
+
+    def set_cache(self):
+        self.cache = get_redis_connection(self.cache_name)
+        self._groups = set()
+
+    def _ensure_group(self, group):
+        if group in self._groups:
+            return
+        try:
+            self.cache.xgroup_create(self.key, group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._groups.add(group)
+
+    def _with_group(self, group, method, *args, **kwargs):
+        self._ensure_group(group)
+        try:
+            return method(*args, **kwargs)
+        except ResponseError as e:
+            if "NOGROUP" not in str(e):
+                raise
+        # Stream was deleted (or expired) together with its groups since the group was created here: recreate it
+        self._groups.discard(group)
+        self._ensure_group(group)
+        return method(*args, **kwargs)
+
+    @staticmethod
+    def _entries(entries):
+        # Entries trimmed away while pending are returned without fields
+        return [(entry_id, fields[VALUE_FIELD]) for entry_id, fields in entries if entry_id and fields]
+
+    def add(self, *values) -> list:
+        pipeline = self.cache.pipeline(transaction=True)
+        for value in self.get_byte_values(values):
+            if self.max_length:
+                pipeline.xadd(self.key, {VALUE_FIELD: value}, maxlen=self.max_length, approximate=True)
+            else:
+                pipeline.xadd(self.key, {VALUE_FIELD: value})
+        if self.timeout is None:
+            pipeline.persist(self.key)
+        else:
+            pipeline.expire(self.key, self.timeout)
+        return pipeline.execute()[:-1]
+
+    def read(self, group: str, consumer: str, count: int = 1, block: Optional[float] = None) -> List[Tuple]:
+        response = self._with_group(
+            group,
+            self.cache.xreadgroup,
+            group,
+            consumer,
+            {self.key: ">"},
+            count=count,
+            block=None if block is None else int(block * 1000),
+        )
+        return self._entries(response[0][1]) if response else []
+
+    def ack(self, group: str, *ids) -> int:
+        if not ids:
+            return 0
+        try:
+            return self.cache.xack(self.key, group, *ids)
+        except ResponseError as e:
+            if "NOGROUP" not in str(e):
+                raise
+            # Group is gone together with its pending entries
+            self._groups.discard(group)
+            return 0
+
+    def reclaim(self, group: str, consumer: str, min_idle_time: float, count: int = 100) -> List[Tuple]:
+        _next_id, entries, *deleted = self._with_group(
+            group, self.cache.xautoclaim, self.key, group, consumer, int(min_idle_time * 1000), count=count
+        )
+        # Acknowledge entries that were trimmed from the stream while pending: there is nothing to process anymore
+        trimmed = [entry_id for entry_id, fields in entries if entry_id and not fields] + (
+            deleted[0] if deleted else []
+        )
+        if trimmed:
+            self.cache.xack(self.key, group, *trimmed)
+        return self._entries(entries)
+
+    def pending(self, group: str) -> int:
+        return self._with_group(group, self.cache.xpending, self.key, group)["pending"]
+
+    def length(self) -> int:
+        return self.cache.xlen(self.key)
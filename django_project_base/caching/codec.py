@@ -0,0 +1,145 @@
+import pickle
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models import Model
+from django.utils.module_loading import import_string
+
+DEFAULT_CACHE_CODEC = "django_project_base.caching.codec.CacheCodec"
+DEFAULT_COMPRESS_THRESHOLD = 4096
+
+
+class CacheCodec:
+    """Stores values as they are: django cache pickles them"""
+
+    def encode(self, value):
+        return value
+
+    def decode(self, value):
+        return value
+
+
+class _ModelData:
+    """Model instance stored as tuple of its loaded concrete field values"""
+
+    __slots__ = ("model", "db", "field_names", "values")
+
+    def __init__(self, model, db, field_names, values):
+        self.model, self.db, self.field_names, self.values = model, db, field_names, values
+
+    def __getstate__(self):
+        return self.model, self.db, self.field_names, self.values
+
+    def __setstate__(self, state):
+        self.model, self.db, self.field_names, self.values = state
+
+
+class _ModelListData(_ModelData):
+    """List of instances of the same model: model and field names are stored only once"""
+
+
+class ModelCacheCodec(CacheCodec):
+    """
+    Stores model instances (also in lists, tuples and dicts) as tuples of their field values and rebuilds them with
+    Model.from_db. _state, prefetched objects and other instance caches are thus not stored. Neither are annotations,
+    extra() values or other attributes that are not concrete model fields, so only use it for values without them.
+
+    Payloads larger than compress_threshold bytes are compressed with zstd or lz4, whichever is installed.
+    """
+
+    RAW = b"r"
+    ZSTD = b"z"
+    LZ4 = b"l"
+
+    def __init__(self, compress_threshold=DEFAULT_COMPRESS_THRESHOLD):
+        self.compress_threshold = compress_threshold
+        self.compressor = None
+        self.decompressors = {}
+        try:
+            import zstandard
+
+            self.decompressors[self.ZSTD] = lambda data: zstandard.ZstdDecompressor().decompress(data)
+            self.compressor = (self.ZSTD, lambda data: zstandard.ZstdCompressor().compress(data))
+        except ModuleNotFoundError:
+            pass
+        try:
+            import lz4.frame
+
+            self.decompressors[self.LZ4] = lz4.frame.decompress
+            self.compressor = self.compressor or (self.LZ4, lz4.frame.compress)
+        except ModuleNotFoundError:
+            pass
+
+    @staticmethod
+    def _get_field_names(instance):
+        return tuple(f.attname for f in instance._meta.concrete_fields if f.attname in instance.__dict__)
+
+    def _compact(self, value):
+        if isinstance(value, Model):
+            field_names = self._get_field_names(value)
+            return _ModelData(
+                value._meta.label, value._state.db, field_names, tuple(getattr(value, f) for f in field_names)
+            )
+        if isinstance(value, list):
+            if value and all(type(item) is type(value[0]) and isinstance(item, Model) for item in value):
+                field_names = self._get_field_names(value[0])
+                if all(self._get_field_names(item) == field_names for item in value):
+                    return _ModelListData(
+                        value[0]._meta.label,
+                        value[0]._state.db,
+                        field_names,
+                        [tuple(getattr(item, f) for f in field_names) for item in value],
+                    )
+            return [self._compact(item) for item in value]
+        if isinstance(value, tuple):
+            return tuple(self._compact(item) for item in value)
+        if isinstance(value, dict):
+            return {key: self._compact(item) for key, item in value.items()}
+        return value
+
+    def _expand(self, value):
+        if isinstance(value, _ModelListData):
+            model = apps.get_model(value.model)
+            return [model.from_db(value.db, value.field_names, values) for values in value.values]
+        if isinstance(value, _ModelData):
+            return apps.get_model(value.model).from_db(value.db, value.field_names, value.values)
+        if isinstance(value, list):
+            return [self._expand(item) for item in value]
+        if isinstance(value, tuple):
+            return tuple(self._expand(item) for item in value)
+        if isinstance(value, dict):
+            return {key: self._expand(item) for key, item in value.items()}
+        return value
+
+    def encode(self, value):
+        if value is None:
+            return None
+        data = pickle.dumps(self._compact(value), pickle.HIGHEST_PROTOCOL)
+        if self.compressor and len(data) > self.compress_threshold:
+            return self.compressor[0] + self.compressor[1](data)
+        return self.RAW + data
+
+    def decode(self, value):
+        if not isinstance(value, bytes) or value[:1] not in (self.RAW, *self.decompressors):
+            # Not encoded by us (e.g. stored before codec was changed). Treat it as a miss
+            return None
+        data = value[1:] if value[:1] == self.RAW else self.decompressors[value[:1]](value[1:])
+        return self._expand(pickle.loads(data))
+
+
+_codec = None
+
+
+def get_cache_codec() -> CacheCodec:
+    """
+    Returns codec set in DJANGO_PROJECT_BASE_CACHE_CODEC setting. Codecs accepting compress_threshold get
+    DJANGO_PROJECT_BASE_CACHE_COMPRESS_THRESHOLD
+    """
+    global _codec
+    codec_path = getattr(settings, "DJANGO_PROJECT_BASE_CACHE_CODEC", DEFAULT_CACHE_CODEC)
+    compress_threshold = getattr(settings, "DJANGO_PROJECT_BASE_CACHE_COMPRESS_THRESHOLD", DEFAULT_COMPRESS_THRESHOLD)
+    if _codec is None or _codec[0] != (codec_path, compress_threshold):
+        codec_class = import_string(codec_path)
+        codec = codec_class(compress_threshold) if issubclass(codec_class, ModelCacheCodec) else codec_class()
+        _codec = ((codec_path, compress_threshold), codec)
+    return _codec[1]
@@ -0,0 +1,119 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class LocalCache:
+    """
+    Bounded, per-process LRU cache with a per-entry timeout.
+
+    Meant as a tier in front of the shared django cache for values that are read very often. Values are returned as
+    stored (not copied), so callers must not modify them.
+    """
+
+    # Hits, misses and evictions of all processes, see publish_stats
+    SHARED_STATS_KEY = "LocalCache.stats"
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+    _missing = object()
+
+    def __init__(self, name, max_size=1000, timeout=5):
+        self.name = name
+        self.max_size = max_size
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._published = (0, 0, 0)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_local_cache(cls, name, max_size=1000, timeout=5):
+        local_cache = cls._instances.get(name)
+        if local_cache is None:
+            with cls._instances_lock:
+                local_cache = cls._instances.setdefault(name, cls(name, max_size, timeout))
+        return local_cache
+
+    @classmethod
+    def all_stats(cls):
+        return [local_cache.stats() for local_cache in list(cls._instances.values())]
+
+    @classmethod
+    def publish_stats(cls):
+        """Adds hits, misses and evictions since the previous call to counters shared by all processes"""
+        from django_project_base.caching.cache_hash import CacheHash
+
+        fields = {}
+        for local_cache in list(cls._instances.values()):
+            current = (local_cache.hits, local_cache.misses, local_cache.evictions)
+            for name, value, published in zip(("hits", "misses", "evictions"), current, local_cache._published):
+                if value != published:
+                    fields["%s:%s" % (name, local_cache.name)] = value - published
+            local_cache._published = current
+        CacheHash.get_cache_hash(cls.SHARED_STATS_KEY, timeout=None).incr(fields)
+
+    @classmethod
+    def shared_stats(cls):
+        """Returns name -> dict(hits, misses, evictions) of all processes"""
+        from django_project_base.caching.cache_hash import CacheHash
+
+        stats = {}
+        for field, value in CacheHash.get_cache_hash(cls.SHARED_STATS_KEY, timeout=None).get_all().items():
+            name, local_cache_name = field.split(":", 1)
+            stats.setdefault(local_cache_name, dict(hits=0, misses=0, evictions=0))[name] = value
+        return stats
+
+    @classmethod
+    def clear_all(cls):
+        for local_cache in list(cls._instances.values()):
+            local_cache.clear()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, self._missing)
+            if item is not self._missing and item[0] < time.monotonic():
+                del self._data[key]
+                item = self._missing
+            if item is self._missing:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, timeout=None):
+        expires = time.monotonic() + (self.timeout if timeout is None else timeout)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return dict(
+            name=self.name,
+            size=len(self._data),
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            hit_ratio=self.hit_ratio,
+        )
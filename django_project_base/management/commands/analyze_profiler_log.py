@@ -0,0 +1,196 @@
+import csv
+import io
+import json
+
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management import CommandError
+
+from django_project_base.profiling.latency_histogram import LatencyHistogram, PERCENTILES
+from django_project_base.profiling.performance_base_command import PerformanceCommand
+from django_project_base.profiling.request_log import get_request_log_files
+from django_project_base.profiling.request_ring import get_request_ring_file, RequestRing
+
+
+def parse_time(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise CommandError("Invalid time: %s. Use unix timestamp or ISO format (2024-01-31T12:00)" % value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def parse_window(value: str) -> tuple:
+    if "/" not in value:
+        raise CommandError("Invalid time window: %s. Use START/END" % value)
+    start, end = value.split("/", 1)
+    return parse_time(start), parse_time(end)
+
+
+class _Totals:
+    __slots__ = ("count", "errors", "wall_time", "cpu_time", "histogram")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.wall_time = 0
+        self.cpu_time = 0
+        self.histogram = LatencyHistogram()
+
+    def add(self, duration, cpu_time, code):
+        self.count += 1
+        self.errors += code >= 500
+        self.wall_time += duration
+        self.cpu_time += cpu_time
+        self.histogram.record(int(duration))
+
+    def as_dict(self) -> dict:
+        ret = dict(
+            count=self.count,
+            errors=self.errors,
+            wall_avg=round(self.wall_time / self.count, 1),
+            cpu_avg=round(self.cpu_time / self.count, 1),
+        )
+        ret.update({"p%s" % str(p).replace(".", ""): v for p, v in self.histogram.percentiles(PERCENTILES).items()})
+        return ret
+
+
+class Command(PerformanceCommand):
+    help = (
+        "Analyzes profiler request log (rotated /tmp/wsgi_performance.txt.N files or binary ring). Prints per-path "
+        "and per-hour counts and latency percentiles or, with --baseline and --compare, paths whose latency regressed "
+        "between two time windows. Example: python manage.py analyze_profiler_log --format csv "
+        "--baseline 2024-01-30T00:00/2024-01-31T00:00 --compare 2024-01-31T00:00/2024-02-01T00:00"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--source",
+            choices=("json", "binary"),
+            default=None,
+            help="Log format to read. Defaults to PROFILER_REQUEST_LOG_FORMAT",
+        )
+        parser.add_argument("--file", action="append", dest="files", help="Log file(s) to read instead of default")
+        parser.add_argument("--since", type=str, help="Skip records before this time (unix timestamp or ISO, UTC)")
+        parser.add_argument("--until", type=str, help="Skip records after this time (unix timestamp or ISO, UTC)")
+        parser.add_argument("--baseline", type=str, help="Baseline time window START/END for regression report")
+        parser.add_argument("--compare", type=str, help="Time window START/END compared to baseline")
+        parser.add_argument(
+            "--min-count", type=int, default=10, help="Paths with fewer requests in a window are not compared"
+        )
+        parser.add_argument(
+            "--min-ratio", type=float, default=1.2, help="Report paths whose p90 grew at least this many times"
+        )
+        parser.add_argument("--format", choices=("csv", "json"), default="csv", dest="output_format")
+        parser.add_argument("--output", type=str, help="Output file. Defaults to standard output")
+
+    def read_records(self, source, files, since, until):
+        """Yields (timestamp, path, duration, cpu time, status code) of records, one at a time"""
+        if source == "binary":
+            for file_name in files or [get_request_ring_file()]:
+                try:
+                    ring = RequestRing(file_name)
+                except (FileNotFoundError, ValueError) as e:
+                    raise CommandError("Cannot read request ring %s: %s" % (file_name, e))
+                with ring:
+                    for timestamp, duration, user_time, sys_time, _pid, path_id, code, _method in ring.iter_raw(since):
+                        if until is None or timestamp <= until:
+                            yield timestamp, ring.get_path(path_id), duration, user_time + sys_time, code
+            return
+        for file_name in files or get_request_log_files():
+            try:
+                f = open(file_name)
+            except FileNotFoundError:
+                # Removed by rotation of a running worker after files were listed
+                continue
+            with f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        timestamp = record["timestamp"]
+                    except (ValueError, KeyError):
+                        # Line cut short by rotation or crash
+                        continue
+                    if (since is None or timestamp >= since) and (until is None or timestamp <= until):
+                        yield (
+                            timestamp,
+                            record["path_info"],
+                            record["duration"],
+                            (record.get("user_time") or 0) + (record.get("sys_time") or 0),
+                            record.get("code") or 0,
+                        )
+
+    def handle(self, *args, **options):
+        source = options["source"] or getattr(settings, "PROFILER_REQUEST_LOG_FORMAT", "json")
+        since = parse_time(options["since"]) if options["since"] else None
+        until = parse_time(options["until"]) if options["until"] else None
+        if bool(options["baseline"]) != bool(options["compare"]):
+            raise CommandError("--baseline and --compare must be given together")
+        windows = (parse_window(options["baseline"]), parse_window(options["compare"])) if options["baseline"] else ()
+
+        hourly = {}
+        compared = ({}, {})
+        for timestamp, path, duration, cpu_time, code in self.read_records(source, options["files"], since, until):
+            hour = int(timestamp) // 3600
+            totals = hourly.get((path, hour))
+            if totals is None:
+                totals = hourly[path, hour] = _Totals()
+            totals.add(duration, cpu_time, code)
+            for window, window_totals in zip(windows, compared):
+                if window[0] <= timestamp < window[1]:
+                    if path not in window_totals:
+                        window_totals[path] = _Totals()
+                    window_totals[path].add(duration, cpu_time, code)
+
+        if windows:
+            rows = self.get_regressions(*compared, options["min_count"], options["min_ratio"])
+        else:
+            rows = [
+                dict(
+                    path=path,
+                    hour=datetime.fromtimestamp(hour * 3600, timezone.utc).strftime("%Y-%m-%d %H:00"),
+                    **totals.as_dict(),
+                )
+                for (path, hour), totals in sorted(hourly.items(), key=lambda item: (item[0][1], item[0][0]))
+            ]
+
+        output = self.format(rows, options["output_format"])
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output, ending="")
+
+    @staticmethod
+    def get_regressions(baseline, compare, min_count, min_ratio) -> list:
+        rows = []
+        for path, compare_totals in compare.items():
+            baseline_totals = baseline.get(path)
+            if not baseline_totals or min(baseline_totals.count, compare_totals.count) < min_count:
+                continue
+            before, after = baseline_totals.as_dict(), compare_totals.as_dict()
+            ratio = after["p90"] / max(before["p90"], 1)
+            if ratio >= min_ratio:
+                row = dict(path=path, p90_ratio=round(ratio, 2))
+                row.update({"baseline_%s" % key: value for key, value in before.items()})
+                row.update({"compare_%s" % key: value for key, value in after.items()})
+                rows.append(row)
+        return sorted(rows, key=lambda row: row["p90_ratio"], reverse=True)
+
+    @staticmethod
+    def format(rows, output_format) -> str:
+        if output_format == "json":
+            return json.dumps(rows, indent=2) + "\n"
+        output = io.StringIO()
+        if rows:
+            writer = csv.DictWriter(output, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        return output.getvalue()
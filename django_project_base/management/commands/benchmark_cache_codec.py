@@ -0,0 +1,51 @@
+import pickle
+import time
+
+from django.apps import apps
+
+from django_project_base.caching.codec import get_cache_codec, ModelCacheCodec
+from django_project_base.profiling.performance_base_command import PerformanceCommand
+
+
+class Command(PerformanceCommand):
+    help = (
+        "Compares cached payload size and decode time of default pickle against cache codecs. Example: "
+        "python manage.py benchmark_cache_codec notifications.DjangoProjectBaseNotification --count 100"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", type=str, help="Model label (app_label.ModelName) of instances to cache")
+        parser.add_argument("--count", type=int, default=100, help="Number of instances in cached list")
+        parser.add_argument("--repeat", type=int, default=100, help="Number of decodes to average")
+
+    def handle(self, *args, **options):
+        value = list(apps.get_model(options["model"]).objects.all()[: options["count"]])
+        if not value:
+            self.stdout.write("No instances to benchmark")
+            return
+
+        codecs = [("model codec", ModelCacheCodec(compress_threshold=float("inf")))]
+        if ModelCacheCodec().compressor:
+            codecs.append(("model codec, compressed", ModelCacheCodec(compress_threshold=0)))
+        codecs.append(("configured codec", get_cache_codec()))
+
+        # Payload as stored by django cache (it pickles whatever it gets), encode and decode functions
+        benchmarks = [("pickle", lambda v: pickle.dumps(v, pickle.HIGHEST_PROTOCOL), pickle.loads)] + [
+            (
+                name,
+                lambda v, c=codec: pickle.dumps(c.encode(v), pickle.HIGHEST_PROTOCOL),
+                lambda p, c=codec: c.decode(pickle.loads(p)),
+            )
+            for name, codec in codecs
+        ]
+
+        self.stdout.write(f"{len(value)} instances of {options['model']}")
+        self.stdout.write(f"{'codec':<25}{'bytes':>12}{'decode µs':>14}")
+        for name, encode, decode in benchmarks:
+            payload = encode(value)
+            size = len(payload)
+            start = time.perf_counter()
+            for _i in range(options["repeat"]):
+                decode(payload)
+            decode_time = (time.perf_counter() - start) / options["repeat"] * 1000000
+            self.stdout.write(f"{name:<25}{size:>12}{decode_time:>14.1f}")
@@ -4,6 +4,11 @@ NOTIFICATIONS_SETTINGS = (
         "default": 30,
         "description": "Cache timeout for maintenance type notifications in UsersMaintenanceNotificationViewset",
     },
+    {
+        "name": "MAINTENANCE_NOTIFICATIONS_LOCAL_CACHE_TIMEOUT",
+        "default": 5,
+        "description": "Seconds notifications are additionally cached in process memory. 0 disables local cache.",
+    },
     {
         "name": "MAINTENANCE_NOTIFICATIONS_CACHE_KEY",
         "default": "current_maintenance_notifications",
@@ -1,2 +1,2 @@
 from .middleware import profile_middleware #noqa
-from .views import app_debug_view #noqa
+from .views import app_debug_latency_view, app_debug_view, app_metrics_view #noqa
@@ -0,0 +1,67 @@
+from typing import Dict, Iterable, Optional
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram:
+    """
+    Log-linear (HDR style) histogram of durations in milliseconds.
+
+    Values below 2 ** SUB_BUCKET_BITS are counted exactly. Above that, every power of two range is split into
+    2 ** (SUB_BUCKET_BITS - 1) linear buckets, so a bucket is never wider than ~3% of the values it holds. Buckets are
+    plain integer indexes: histograms of different processes and time buckets merge by adding counts of the same
+    index, which lets them be kept in CacheHash fields.
+    """
+
+    SUB_BUCKET_BITS = 6
+    SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+    EXACT_LIMIT = 1 << SUB_BUCKET_BITS
+
+    def __init__(self, counts: Optional[Dict[int, int]] = None):
+        self.counts = dict(counts or {})
+
+    @classmethod
+    def index(cls, value: int) -> int:
+        value = max(int(value), 0)
+        if value < cls.EXACT_LIMIT:
+            return value
+        shift = value.bit_length() - cls.SUB_BUCKET_BITS
+        return shift * cls.SUB_BUCKET_HALF + (value >> shift)
+
+    @classmethod
+    def bucket_bounds(cls, index: int) -> tuple:
+        """Lowest and highest value counted in bucket"""
+        if index < cls.EXACT_LIMIT:
+            return index, index
+        shift = index // cls.SUB_BUCKET_HALF - 1
+        sub_bucket = index - shift * cls.SUB_BUCKET_HALF
+        return sub_bucket << shift, ((sub_bucket + 1) << shift) - 1
+
+    def record(self, value: int, count: int = 1):
+        index = self.index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+
+    def merge(self, other: "LatencyHistogram"):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        return self
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def percentile(self, percentile: float) -> int:
+        """Highest value of the bucket holding given percentile. 0 for empty histogram"""
+        total = self.total
+        if not total:
+            return 0
+        rank = max(total * percentile / 100, 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return self.bucket_bounds(index)[1]
+        return self.bucket_bounds(max(self.counts))[1]  # pragma: no cover
+
+    def percentiles(self, percentiles: Iterable[float] = PERCENTILES) -> Dict[float, int]:
+        return {percentile: self.percentile(percentile) for percentile in percentiles}
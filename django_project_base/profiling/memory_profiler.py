@@ -0,0 +1,73 @@
+import os
+import threading
+import tracemalloc
+
+# Number of top allocating lines recorded per profiled request
+TOP_LINES = 5
+
+
+class MemoryProfiler:
+    """
+    Measures memory allocated while a profiled request runs, using tracemalloc. Create one per request.
+
+    tracemalloc traces the whole process: tracing starts with the first profiled request and stops when the last one
+    finishes. Allocations of other threads running at the same time are therefore counted too. Peak is the highest
+    amount of traced memory since the request (or a concurrently profiled one, on Python < 3.9 since tracing) started.
+    Top lines are the ones whose traced memory grew the most between start and end of the request (e.g. response
+    content, cached data): memory allocated and already freed by then only shows in peak.
+    """
+
+    _lock = threading.Lock()
+    _active = 0
+
+    def __init__(self):
+        self._start_snapshot = None
+
+    @staticmethod
+    def _take_snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__))
+        )
+
+    def start(self) -> bool:
+        cls = type(self)
+        with cls._lock:
+            if not cls._active:
+                if tracemalloc.is_tracing():
+                    # Traced by someone else: don't take it over
+                    return False
+                tracemalloc.start()
+            cls._active += 1
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+        self._start_snapshot = self._take_snapshot()
+        return True
+
+    def stop(self) -> tuple:
+        """Returns peak traced bytes and [(file@line, bytes)] of lines whose memory grew the most since start"""
+        snapshot = self._take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        cls = type(self)
+        with cls._lock:
+            cls._active -= 1
+            if not cls._active:
+                tracemalloc.stop()
+        top_lines = [
+            ("%s@%d" % (stat.traceback[0].filename, stat.traceback[0].lineno), stat.size_diff)
+            for stat in snapshot.compare_to(self._start_snapshot, "lineno")
+            if stat.size_diff > 0
+        ][:TOP_LINES]
+        self._start_snapshot = None
+        return peak, top_lines
+
+    @classmethod
+    def _reset_after_fork(cls):
+        if MemoryProfiler._active:
+            # Requests traced by parent don't exist in the child
+            tracemalloc.stop()
+        MemoryProfiler._lock = threading.Lock()
+        MemoryProfiler._active = 0
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=MemoryProfiler._reset_after_fork)
@@ -0,0 +1,109 @@
+from django.core.cache import cache
+
+from django_project_base.caching.cache_queue import CacheQueue
+from django_project_base.caching.local_cache import LocalCache
+from django_project_base.profiling.latency_histogram import LatencyHistogram
+from django_project_base.profiling.request_stats import RequestStats
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PREFIX = "django_project_base"
+# Histogram bucket bounds (ms) exposed. Profiler histograms are much finer, these are summed from them
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+# metric name, attribute of RequestStats totals, help
+PATH_COUNTERS = (
+    ("cpu_user_milliseconds", "user_time", "User CPU time"),
+    ("cpu_system_milliseconds", "sys_time", "System CPU time"),
+    ("db_queries", "query_count", "Executed database queries"),
+    ("db_query_milliseconds", "query_time", "Time spent in database queries"),
+    ("n_plus_one", "n_plus_one", "Runs with N+1 query candidates"),
+    ("queued_runs", "queued", "Celery task runs with known queue wait time"),
+    ("queue_wait_milliseconds", "queue_wait", "Time celery tasks waited in queue before they started"),
+    ("retries", "retries", "Celery task runs that were retries"),
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{%s}" % ",".join('%s="%s"' % (name, _escape(value)) for name, value in labels.items())
+
+
+def _family(lines: list, name: str, metric_type: str, help_text: str):
+    lines.append("# TYPE %s_%s %s" % (PREFIX, name, metric_type))
+    lines.append("# HELP %s_%s %s" % (PREFIX, name, help_text))
+
+
+def _histogram_buckets(histogram: LatencyHistogram) -> list:
+    """Cumulative counts per LATENCY_BUCKETS bound. Profiler buckets are assigned by their highest value"""
+    counts = [0] * len(LATENCY_BUCKETS)
+    for index, count in histogram.counts.items():
+        high = LatencyHistogram.bucket_bounds(index)[1]
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if high <= bound:
+                counts[i] += count
+                break
+    for i in range(1, len(counts)):
+        counts[i] += counts[i - 1]
+    return counts
+
+
+def get_metrics() -> str:
+    """
+    Returns profiler and cache statistics in OpenMetrics text format.
+
+    All values come from the shared cache where every worker process adds its own data, so any worker can serve the
+    complete metrics.
+    """
+    lines = []
+    totals = sorted(RequestStats.get_totals(), key=lambda t: (t.kind, t.path))
+
+    _family(lines, "runs", "counter", "Profiled requests, functions (celery tasks) and management commands")
+    for total in totals:
+        lines.append("%s_runs_total%s %d" % (PREFIX, _labels(kind=total.kind, path=total.path), total.count))
+
+    _family(lines, "duration_milliseconds", "histogram", "Wall time of profiled runs")
+    for total in totals:
+        labels = dict(kind=total.kind, path=total.path)
+        for bound, count in zip(LATENCY_BUCKETS, _histogram_buckets(total.histogram)):
+            lines.append("%s_duration_milliseconds_bucket%s %d" % (PREFIX, _labels(**labels, le="%.1f" % bound), count))
+        lines.append("%s_duration_milliseconds_bucket%s %d" % (PREFIX, _labels(**labels, le="+Inf"), total.count))
+        lines.append("%s_duration_milliseconds_count%s %d" % (PREFIX, _labels(**labels), total.count))
+        lines.append("%s_duration_milliseconds_sum%s %d" % (PREFIX, _labels(**labels), total.wall_time))
+
+    for name, attribute, help_text in PATH_COUNTERS:
+        _family(lines, name, "counter", help_text)
+        for total in totals:
+            lines.append(
+                "%s_%s_total%s %d"
+                % (PREFIX, name, _labels(kind=total.kind, path=total.path), getattr(total, attribute))
+            )
+
+    waiting_keys = sorted(
+        {
+            key.decode("utf-8") if isinstance(key, bytes) else key
+            for key in CacheQueue.get_cache_queue("CacheLockKeys", timeout=None).lrange()
+        }
+    )
+    waiting = cache.get_many(waiting_keys) if waiting_keys else {}
+    _family(lines, "cache_lock_waiting", "gauge", "Processes currently waiting for CacheLock")
+    for key in waiting_keys:
+        lines.append(
+            "%s_cache_lock_waiting%s %d" % (PREFIX, _labels(lock=key[len("Waiting.") :]), waiting.get(key) or 0)
+        )
+
+    local_cache_stats = sorted(LocalCache.shared_stats().items())
+    for name, help_text in (("hits", "Local cache hits"), ("misses", "Local cache misses")):
+        _family(lines, "local_cache_%s" % name, "counter", help_text)
+        for cache_name, stats in local_cache_stats:
+            lines.append("%s_local_cache_%s_total%s %d" % (PREFIX, name, _labels(cache=cache_name), stats[name]))
+    _family(lines, "local_cache_hit_ratio", "gauge", "Local cache hit ratio since cache statistics were cleared")
+    for cache_name, stats in local_cache_stats:
+        requests = stats["hits"] + stats["misses"]
+        ratio = stats["hits"] / requests if requests else 0
+        lines.append("%s_local_cache_hit_ratio%s %.4f" % (PREFIX, _labels(cache=cache_name), ratio))
+
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
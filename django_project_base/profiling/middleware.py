@@ -1,23 +1,32 @@
-import glob
 import importlib
-import json
 import os
+import random
 import re
 import socket
 import threading
 import time
 
+from collections import Counter
 from typing import Optional
 
 from django.conf import settings
 from django.core.cache import cache
-from django.db import connections
+from django.utils.functional import lazystr
 
 from django_project_base.caching import CacheCounter
-from django_project_base.caching.cache_queue import CacheQueue
+from django_project_base.profiling.memory_profiler import MemoryProfiler
+from django_project_base.profiling.request_log import (  # noqa: F401
+    log_profiler_error,
+    MAX_DATA_LOGGING_FILE_SIZE,
+    RequestLogWriter,
+)
+from django_project_base.profiling.request_stats import RequestStats
+from django_project_base.profiling.sql_collector import SqlCollector
+from django_project_base.profiling.stack_sampler import StackSampler
 
 DEFAULT_MAX_LOG_FILE_SIZE = 10000000
-MAX_DATA_LOGGING_FILE_SIZE = 3000000
+# Number of distinct folded stacks stored for a long-running request
+MAX_STORED_STACKS = 500
 
 MATCH_DETAIL_QUERIES = re.compile(
     r"(rest/\w+)/((?:[0-9a-f]{8}(?:-[0-9a-f]{4}){3}-[0-9a-f]{12})|" r"(?:(?:[0-9a-f]{2}:){5}[0-9a-f]{2})|\d+)(/.*)?"
@@ -33,6 +42,11 @@ class ProfileRequest(object):
     _process_function_kwargs: dict
     _settings: dict
     _profile_path: str
+    _sampling: bool
+    _stacks: Optional[Counter]
+    _sql_collector: Optional[SqlCollector]
+    _memory_profiler: Optional[MemoryProfiler]
+    _memory: Optional[tuple]
 
     def __init__(
         self,
@@ -56,8 +70,15 @@ class ProfileRequest(object):
         tms = os.times()
         self._start_time = (int(time.time() * 1000), int(tms.user * 1000), int(tms.system * 1000))
         self._set_profiling_path(None, None)
+        self._stacks = None
+        self._memory = None
+        self._start_collecting()
         # # Get the response itself
-        self.response = self._process_function(*self._process_function_args, **self._process_function_kwargs)
+        try:
+            self.response = self._process_function(*self._process_function_args, **self._process_function_kwargs)
+        except BaseException:
+            self._stop_collecting()
+            raise
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -65,15 +86,73 @@ class ProfileRequest(object):
         # # the view is called.
         tms = os.times()
         self._end_time = (int(time.time() * 1000), int(tms.user * 1000), int(tms.system * 1000))
+        self._stop_collecting()
         self._do_profile(self.response, self._start_time, self._end_time)
 
+    def _start_collecting(self):
+        # Profiler failures must never fail the request: whatever could not be started is left out of the record
+        self._sampling = False
+        self._memory_profiler = None
+        self._sql_collector = None
+        try:
+            self._sampling = self._start_sampling()
+            self._memory_profiler = self._start_memory_profiling()
+            self._sql_collector = SqlCollector().__enter__()
+        except Exception as exc:
+            log_profiler_error(exc)
+
+    def _stop_collecting(self):
+        if self._sql_collector is not None:
+            try:
+                self._sql_collector.__exit__(None, None, None)
+            except Exception as exc:
+                self._sql_collector = None
+                log_profiler_error(exc)
+        if self._sampling:
+            try:
+                self._stacks = StackSampler.stop()
+            except Exception as exc:
+                log_profiler_error(exc)
+        if self._memory_profiler:
+            try:
+                self._memory = self._memory_profiler.stop()
+            except Exception as exc:
+                log_profiler_error(exc)
+
+    def _get_kind(self) -> str:
+        method = self._settings["REQUEST_METHOD"]
+        if method == "FUNCTION":
+            return "function"
+        if method == "MANAGEMENT_COMMAND":
+            return "command"
+        return "request"
+
+    @staticmethod
+    def _start_sampling() -> bool:
+        sampling_rate = getattr(settings, "PROFILER_SAMPLING_RATE", 0)
+        if not sampling_rate or random.random() >= sampling_rate:
+            return False
+        return StackSampler.start(getattr(settings, "PROFILER_SAMPLING_HZ", 100))
+
+    @staticmethod
+    def _start_memory_profiling() -> Optional[MemoryProfiler]:
+        sampling_rate = getattr(settings, "PROFILER_MEMORY_SAMPLING_RATE", 0)
+        if not sampling_rate or random.random() >= sampling_rate:
+            return None
+        profiler = MemoryProfiler()
+        return profiler if profiler.start() else None
+
     def _set_profiling_path(self, path_info, query_string):
         threading.current_thread().profiling_path = (path_info, query_string)
 
     def _get_profiling_path(self) -> tuple:
         return threading.current_thread().profiling_path
 
-    def _get_path_info(self, path: str, params: Optional[str] = None):
+    def _get_path_info(self, path: str, params=None):
+        """
+        params: query string or an object that formats it when converted to str (see FunctionParams). Such objects are
+        passed to PROFILER_PATH_TRANSFORM as a lazy string
+        """
         original_path = path
         path = path.strip("/")
         if "robots.txt" in path:
@@ -84,7 +163,8 @@ class ProfileRequest(object):
         if MATCH_DETAIL_QUERIES.match(path):
             return MATCH_DETAIL_QUERIES.sub("\\1\\3", path)
 
-        if path.startswith("configure_site") and "&type=" in (params or ""):
+        if path.startswith("configure_site") and "&type=" in str(params or ""):
+            params = str(params)
             pos = params.find("&type=")
             return path + "/" + params[pos + 6 : pos + 9]
 
@@ -92,6 +172,9 @@ class ProfileRequest(object):
             split_module_path: list = settings.PROFILER_PATH_TRANSFORM.split(".")
             module: str = ".".join(split_module_path[: (len(split_module_path) - 1)])
             method: str = split_module_path[-1]
+            if params is not None and not isinstance(params, str):
+                # Formatted only if the transform uses it
+                params = lazystr(params)
             path = getattr(importlib.import_module(module), method)(
                 path, {"original_path": original_path, "params": params}
             )
@@ -99,14 +182,10 @@ class ProfileRequest(object):
         return path
 
     def _get_queries(self, response):
+        if self._sql_collector is None:
+            return []
         try:
-            query_list = []
-            for c in connections:
-                con = connections[c]
-                con.force_debug_cursor = True
-                query_list.append(con.queries)
-            _queries = filter(lambda x: x, query_list)
-            return [q for sublist in _queries for q in sublist]
+            return self._sql_collector.get_summary()
         except Exception as e:
             return ["exception getting queries: " + str(e)]
 
@@ -116,10 +195,13 @@ class ProfileRequest(object):
             if "PATH_INFO" in self._settings:
                 _profiling_path: tuple = next(iter(self._get_profiling_path()), None)
                 path_info = _profiling_path or self._get_path_info(
-                    str(self._settings["PATH_INFO"]), str(self._settings["QUERY_STRING"])
+                    str(self._settings["PATH_INFO"]), self._settings["QUERY_STRING"]
                 )
                 if path_info:
                     duration = (end_time[0] - start_time[0], end_time[1] - start_time[1], end_time[2] - start_time[2])
+                    # Celery tasks (PerformanceCeleryTask): ms between sending and start, number of retries
+                    queue_wait = self._settings.get("QUEUE_WAIT")
+                    retries = self._settings.get("RETRIES") or 0
                     if hasattr(settings, "PROFILER_LONG_RUNNING_TASK_THRESHOLD"):
                         if duration[0] > settings.PROFILER_LONG_RUNNING_TASK_THRESHOLD:
                             queries = self._get_queries(response)
@@ -132,64 +214,53 @@ class ProfileRequest(object):
                             r_data.update(
                                 {i: str(self._settings[i]) for i in ("HTTP_HOST", "REQUEST_METHOD", "QUERY_STRING")}
                             )
+                            if queue_wait is not None:
+                                r_data["queue_wait"] = queue_wait
+                            if retries:
+                                r_data["retries"] = retries
+                            if self._memory:
+                                r_data["memory_peak"] = self._memory[0]
+                                r_data["memory_top_lines"] = self._memory[1]
+                            if self._stacks:
+                                r_data["stacks"] = [
+                                    "%s %d" % stack for stack in self._stacks.most_common(MAX_STORED_STACKS)
+                                ]
                             cache_ptr = CacheCounter("long_running_cmds_pointer", timeout=86400).incr(start=-1) % 50
 
                             cache.set("long_running_cmds_data%d" % cache_ptr, r_data, timeout=86400)
 
-                        r_data = [path_info, duration[0], duration[1], duration[2]]
-                        last_hour_running_cmds_key = f"last_hour_running_cmds{int(time.time()) // 10}"
-                        last_hour_running_cmds_queue = CacheQueue.get_cache_queue(
-                            last_hour_running_cmds_key, timeout=3600
+                        collector = self._sql_collector
+                        RequestStats.add(
+                            path_info,
+                            end_time[0] / 1000,
+                            *duration,
+                            query_count=collector.count if collector else 0,
+                            query_time=int(collector.time) if collector else 0,
+                            n_plus_one=1 if collector and collector.n_plus_one else 0,
+                            memory=self._memory,
+                            queue_wait=queue_wait,
+                            retries=retries,
+                            kind=self._get_kind(),
                         )
-                        last_hour_running_cmds_queue.rpush(json.dumps(r_data))
 
                     req_data = dict(
                         code=getattr(response, "status_code", None),
                         method=self._settings["REQUEST_METHOD"],
                         duration=duration[0],
+                        user_time=duration[1],
+                        sys_time=duration[2],
                         timestamp=end_time[0] / 1000,
                         path_info=path_info,
                         pid=os.getpid(),
                         raw_path_info=self._settings.get("PATH_INFO", None),
                     )
-                    files = glob.glob("/tmp/wsgi_performance.txt.*")
-                    if not files:
-                        with open("/tmp/wsgi_performance.txt.1", "a") as f:
-                            f.write(json.dumps(req_data) + "\n")
-                        files = ["/tmp/wsgi_performance.txt.1"]
-                    file_num_array = list(map(lambda r: int(r.split(".")[-1]), files))
-                    max_file = max(file_num_array)
-                    min_file = min(file_num_array)
-                    if max_file > 3:
-                        if os.path.exists("/tmp/wsgi_performance.txt.1"):
-                            os.remove("/tmp/wsgi_performance.txt.1")
-                        if os.path.exists("/tmp/wsgi_performance.txt.2"):
-                            os.remove("/tmp/wsgi_performance.txt.2")
-                        os.rename("/tmp/wsgi_performance.txt.%d" % max_file, "/tmp/wsgi_performance.txt.1")
-                        os.rename("/tmp/wsgi_performance.txt.%d" % (max_file - 1), "/tmp/wsgi_performance.txt.2")
-                        for ff in filter(lambda f: f and int(f.split(".")[-1]) not in [1, 2], files):
-                            if os.path.exists(ff):
-                                os.remove(ff)
-                        files = glob.glob("/tmp/wsgi_performance.txt.*")
-                    if not files:
-                        with open("/tmp/wsgi_performance.txt.1", "a") as f:
-                            f.write(json.dumps(req_data) + "\n")
-                    else:
-                        if os.path.getsize("/tmp/wsgi_performance.txt.%d" % max_file) > MAX_DATA_LOGGING_FILE_SIZE:
-                            with open("/tmp/wsgi_performance.txt.%d" % (max_file + 1), "a") as f:
-                                f.write(json.dumps(req_data) + "\n")
-                        else:
-                            with open("/tmp/wsgi_performance.txt.%d" % max_file, "a") as f:
-                                f.write(json.dumps(req_data) + "\n")
+                    if queue_wait is not None:
+                        req_data["queue_wait"] = queue_wait
+                    if retries:
+                        req_data["retries"] = retries
+                    RequestLogWriter.get_writer().write(req_data)
         except Exception as exc:
-            try:
-                error_file = "/tmp/wsgi_performance_error.txt"
-                if os.path.exists(error_file) and os.path.getsize(error_file) > MAX_DATA_LOGGING_FILE_SIZE:
-                    os.remove(error_file)
-                with open(error_file, "a") as fe:
-                    fe.write(str(exc) + "\n")
-            except Exception:
-                pass
+            log_profiler_error(exc)
 
 
 def profile_middleware(get_response):
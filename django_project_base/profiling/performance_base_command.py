@@ -3,6 +3,7 @@ from typing import List
 from django.core.management import BaseCommand
 
 from django_project_base.profiling.middleware import ProfileRequest
+from django_project_base.query_tracker.summary import QuerySummary
 
 
 class PerformanceCommand(BaseCommand):
@@ -24,7 +25,7 @@ class PerformanceCommand(BaseCommand):
         for param in param_names:
             params += f"{param}={options.get(param)} "
 
-        with ProfileRequest(
+        with QuerySummary(name), ProfileRequest(
             {"REQUEST_METHOD": "MANAGEMENT_COMMAND", "HTTP_HOST": "", "QUERY_STRING": params, "PATH_INFO": name},
             super().execute,
             args,
@@ -2,13 +2,19 @@ import functools
 
 from celery import shared_task
 
+from django_project_base.profiling.performance_celery_task_class import PerformanceCeleryTask
 from django_project_base.profiling.performance_function_decorator import function_profiler
 
 
 def shared_task_profiler(*args, **kwargs):
     profiler_name = kwargs.pop("profiler_name", None)
+    base = kwargs.setdefault("base", PerformanceCeleryTask)
 
     def decorator(func):
+        if issubclass(base, PerformanceCeleryTask):
+            # Task class profiles runs itself, with queue wait time and retries
+            return shared_task(*args, profiler_params=dict(name=profiler_name), **kwargs)(func)
+
         profiled_func = function_profiler(name=profiler_name)(func)
 
         # Then, define a new function that applies shared_task to the wrapped function
@@ -1,17 +1,59 @@
+import time
+
+from datetime import datetime
+
 import celery
 
-from django_project_base.profiling.performance_function_decorator import function_profiler
+from django_project_base.profiling.performance_function_decorator import profile_function
+from django_project_base.query_tracker.summary import QuerySummary
+
+# Message header with unix timestamp of when the task was sent, for measuring queue wait time
+ENQUEUED_AT_HEADER = "profiler_enqueued_at"
 
 
 class PerformanceCeleryTask(celery.Task):
+    """
+    Celery task profiled with ProfileRequest. Besides the usual profiler data, time the task waited in queue (from
+    sending, or from ETA if given, to start) and number of retries are recorded.
+    """
+
+    # Default for get_profiler_params. Tasks created with shared_task_profiler get their profiler_name here
+    profiler_params = None
+    # Profiler path of tasks of this class. Set on first run from get_profiler_params
+    _profiler_path_info = None
+
     def get_profiler_params(self):
-        return dict()
+        return dict(self.profiler_params or {})
+
+    def apply_async(self, *args, headers=None, **options):
+        return super().apply_async(*args, headers={**(headers or {}), ENQUEUED_AT_HEADER: time.time()}, **options)
 
-    def __getattribute__(self, name):
-        # Get the original attribute
-        attr = super().__getattribute__(name)
+    def _get_queue_wait(self):
+        """Milliseconds the running task waited in queue or None if it wasn't sent with apply_async"""
+        request = self.request
+        enqueued_at = getattr(request, ENQUEUED_AT_HEADER, None) or (request.headers or {}).get(ENQUEUED_AT_HEADER)
+        if not enqueued_at:
+            return None
+        if request.eta:
+            try:
+                enqueued_at = max(enqueued_at, datetime.fromisoformat(request.eta).timestamp())
+            except (TypeError, ValueError):
+                pass
+        return max(int((time.time() - enqueued_at) * 1000), 0)
 
-        # If the attribute is a callable (i.e., a method), wrap it with the custom behavior
-        if name == "run" and callable(attr):
-            return function_profiler(**self.get_profiler_params())(attr)
-        return attr
+    def __call__(self, *args, **kwargs):
+        # Worker calls task's __call__ for every run, with task request already pushed
+        path_info = self.__class__.__dict__.get("_profiler_path_info")
+        if path_info is None:
+            run = self.run
+            path_info = self.get_profiler_params().get("name") or f"{run.__module__}.{run.__qualname__}"
+            self.__class__._profiler_path_info = path_info
+        with QuerySummary(path_info):
+            return profile_function(
+                path_info,
+                super().__call__,
+                args,
+                kwargs,
+                QUEUE_WAIT=self._get_queue_wait(),
+                RETRIES=self.request.retries or 0,
+            )
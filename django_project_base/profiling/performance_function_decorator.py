@@ -3,23 +3,54 @@ import functools
 from django_project_base.profiling.middleware import ProfileRequest
 
 
+class FunctionParams:
+    """
+    Function arguments as profiler's QUERY_STRING. They are only formatted when converted to string, which profiler
+    does just for slow runs: formatting e.g. model instances on every call would cost more than the profiling itself.
+    """
+
+    __slots__ = ("args", "kwargs", "_formatted")
+
+    def __init__(self, args: tuple, kwargs: dict):
+        self.args = args
+        self.kwargs = kwargs
+        self._formatted = None
+
+    def __str__(self):
+        if self._formatted is None:
+            params = ""
+            if self.args:
+                params += f"args={self.args} "
+            for key, value in self.kwargs.items():
+                params += f"{key}={value} "
+            self._formatted = params
+        return self._formatted
+
+
+def profile_function(path_info: str, func, args: tuple, kwargs: dict, **extra_settings):
+    """Calls func(*args, **kwargs) profiled under path_info. extra_settings are added to ProfileRequest settings"""
+    with ProfileRequest(
+        {
+            "REQUEST_METHOD": "FUNCTION",
+            "HTTP_HOST": "",
+            "QUERY_STRING": FunctionParams(args, kwargs),
+            "PATH_INFO": path_info,
+            **extra_settings,
+        },
+        func,
+        args,
+        kwargs,
+    ) as pr:
+        return pr.response
+
+
 def function_profiler(name=None):
     def decorator(func):
+        path_info = name or f"{func.__module__}.{func.__qualname__}"
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            path_info = name or f"{func.__module__}.{func.__qualname__}"
-            params = ""
-            if args:
-                params += f"args={args} "
-            for key, value in kwargs.items():
-                params += f"{key}={value} "
-            with ProfileRequest(
-                {"REQUEST_METHOD": "FUNCTION", "HTTP_HOST": "", "QUERY_STRING": params, "PATH_INFO": path_info},
-                func,
-                args,
-                kwargs,
-            ) as pr:
-                return pr.response
+            return profile_function(path_info, func, args, kwargs)
 
         return wrapper
 
@@ -0,0 +1,139 @@
+import glob
+import json
+import os
+import threading
+
+from django.conf import settings
+
+from django_project_base.caching import BufferedCacheCounter, FlushThread, register_flush
+from django_project_base.profiling.request_ring import RequestRing
+
+try:
+    import fcntl
+except ModuleNotFoundError:  # pragma: no cover
+    fcntl = None
+
+REQUEST_LOG_FILE = "/tmp/wsgi_performance.txt"
+REQUEST_LOG_LOCK_FILE = "/tmp/wsgi_performance.lock"
+ERROR_LOG_FILE = "/tmp/wsgi_performance_error.txt"
+MAX_DATA_LOGGING_FILE_SIZE = 3000000
+# Number of rotated files kept besides the one being written
+KEEP_LOG_FILES = 2
+DROPPED_COUNTER_KEY = "profiler_request_log_dropped"
+
+
+def log_profiler_error(exc):
+    try:
+        if os.path.exists(ERROR_LOG_FILE) and os.path.getsize(ERROR_LOG_FILE) > MAX_DATA_LOGGING_FILE_SIZE:
+            os.remove(ERROR_LOG_FILE)
+        with open(ERROR_LOG_FILE, "a") as fe:
+            fe.write(str(exc) + "\n")
+    except Exception:
+        pass
+
+
+def get_request_log_files() -> list:
+    """Returns request log files, oldest first"""
+    return sorted(glob.glob(REQUEST_LOG_FILE + ".*"), key=lambda f: int(f.split(".")[-1]))
+
+
+class RequestLogWriter:
+    """
+    Per-process writer of request log records: /tmp/wsgi_performance.txt.N JSON lines or, with
+    PROFILER_REQUEST_LOG_FORMAT = "binary", records in RequestRing file.
+
+    Requests only append records to a bounded in-memory buffer. A background thread writes the buffer every
+    flush_interval milliseconds in one batch. Batches of all processes are written under an exclusive file lock, so
+    the process holding it is the only one rotating files at that time. When the buffer is full (the writer can't keep
+    up), new records are dropped and counted in DROPPED_COUNTER_KEY cache counter instead of blocking the request.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, buffer_size=None, flush_interval=None):
+        self.buffer_size = buffer_size or getattr(settings, "PROFILER_REQUEST_LOG_BUFFER_SIZE", 10000)
+        self.flush_interval = flush_interval or getattr(settings, "PROFILER_REQUEST_LOG_FLUSH_INTERVAL", 1000)
+        self.log_format = getattr(settings, "PROFILER_REQUEST_LOG_FORMAT", "json")
+        self.dropped = 0
+        self._ring = None
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_thread = FlushThread("RequestLogWriter", self.flush, log_profiler_error)
+
+    @classmethod
+    def get_writer(cls) -> "RequestLogWriter":
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def write(self, record: dict):
+        with self._lock:
+            if len(self._buffer) >= self.buffer_size:
+                self.dropped += 1
+                return
+            self._buffer.append(record)
+        self._flush_thread.start(self.flush_interval)
+
+    def flush(self):
+        with self._lock:
+            records, self._buffer = self._buffer, []
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            BufferedCacheCounter(DROPPED_COUNTER_KEY, timeout=86400).incr(dropped)
+        if not records:
+            return
+        data = None if self.log_format == "binary" else "".join(json.dumps(record) + "\n" for record in records)
+        with self._flush_lock, open(REQUEST_LOG_LOCK_FILE, "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if data is None:
+                    if self._ring is None:
+                        self._ring = RequestRing(writable=True)
+                    self._ring.append(records)
+                else:
+                    with open(self._get_current_file(len(data)), "a") as f:
+                        f.write(data)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _get_current_file(data_size: int) -> str:
+        """Returns file the next batch should be appended to, rotating files if needed. Call under file lock only"""
+        files = get_request_log_files()
+        if not files:
+            return REQUEST_LOG_FILE + ".1"
+        current_num = int(files[-1].split(".")[-1])
+        if os.path.getsize(files[-1]) + data_size <= MAX_DATA_LOGGING_FILE_SIZE:
+            return files[-1]
+        if current_num <= KEEP_LOG_FILES:
+            return "%s.%d" % (REQUEST_LOG_FILE, current_num + 1)
+        # Renumber the newest files to 1..KEEP_LOG_FILES and start a new file after them
+        for f in files[:-KEEP_LOG_FILES]:
+            os.remove(f)
+        for num, f in enumerate(files[-KEEP_LOG_FILES:], start=1):
+            os.rename(f, "%s.%d" % (REQUEST_LOG_FILE, num))
+        return "%s.%d" % (REQUEST_LOG_FILE, KEEP_LOG_FILES + 1)
+
+    @classmethod
+    def flush_all(cls):
+        if cls._instance is not None:
+            try:
+                cls._instance.flush()
+            except Exception as exc:
+                log_profiler_error(exc)
+
+    @classmethod
+    def _reset_after_fork(cls):
+        # Flush thread doesn't survive fork and records buffered by parent will be written by the parent
+        cls._instance = None
+        cls._instance_lock = threading.Lock()
+
+
+# Flushed before BufferedCacheCounter's atexit handler (handlers run in reverse order), so drops get counted
+register_flush(RequestLogWriter.flush_all, RequestLogWriter._reset_after_fork)
@@ -0,0 +1,222 @@
+import mmap
+import os
+import struct
+
+from collections import namedtuple
+from typing import Iterator, Optional
+
+from django.conf import settings
+
+REQUEST_RING_FILE = "/tmp/wsgi_performance.ring"
+DEFAULT_REQUEST_RING_SIZE = 262144
+
+# magic, version, record size, capacity (records), number of records ever written
+HEADER = struct.Struct("<4sHHIQ")
+HEADER_SIZE = 64
+MAGIC = b"DPBR"
+VERSION = 1
+# sequence number, timestamp, duration, user time, sys time (ms), pid, path id, status code, method id
+RECORD = struct.Struct("<QdIIIIIHBx")
+
+METHODS = ("", "GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS")
+METHOD_IDS = {method: method_id for method_id, method in enumerate(METHODS)}
+
+RequestRecord = namedtuple(
+    "RequestRecord", ["timestamp", "duration", "user_time", "sys_time", "pid", "path_info", "code", "method"]
+)
+
+
+def get_request_ring_file() -> str:
+    return getattr(settings, "PROFILER_REQUEST_RING_FILE", REQUEST_RING_FILE)
+
+
+class RequestRing:
+    """
+    Fixed size ring of binary request records in a memory mapped file shared by all worker processes.
+
+    Header holds number of records ever written. Record with sequence number n is stored in slot n % capacity and
+    also holds n, so readers can tell overwritten (or partially written) slots from the ones they expect without
+    taking any lock. Paths are interned: records hold path id and paths are appended, one per line, to a
+    "<file>.paths" table.
+
+    RequestRing doesn't lock anything itself: writers must be serialized by the caller (RequestLogWriter writes under
+    its file lock).
+    """
+
+    def __init__(self, file_name: Optional[str] = None, capacity: Optional[int] = None, writable: bool = False):
+        self.file_name = file_name or get_request_ring_file()
+        self.paths_file_name = self.file_name + ".paths"
+        self.writable = writable
+        self.capacity = capacity or getattr(settings, "PROFILER_REQUEST_RING_SIZE", DEFAULT_REQUEST_RING_SIZE)
+        self._mmap = None
+        self._paths = []
+        self._path_ids = {}
+        self._paths_offset = 0
+        self._open()
+
+    def _open(self):
+        size = HEADER_SIZE + self.capacity * RECORD.size
+        if self.writable:
+            fd = None
+            try:
+                try:
+                    fd = os.open(self.file_name, os.O_RDWR)
+                    header = os.pread(fd, HEADER.size, 0)
+                except FileNotFoundError:
+                    header = b""
+                if len(header) < HEADER.size or HEADER.unpack(header)[:4] != (
+                    MAGIC,
+                    VERSION,
+                    RECORD.size,
+                    self.capacity,
+                ):
+                    # New file or one written with different layout: start over
+                    if fd is not None:
+                        os.close(fd)
+                        fd = None
+                    fd = self._create(size)
+                self._mmap = mmap.mmap(fd, size)
+            finally:
+                if fd is not None:
+                    os.close(fd)
+            return
+        with open(self.file_name, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, self.capacity, _count = HEADER.unpack_from(self._mmap, 0)
+        if (magic, version, record_size) != (MAGIC, VERSION, RECORD.size):
+            raise ValueError("%s is not a request ring file" % self.file_name)
+
+    def _create(self, size: int) -> int:
+        """
+        Creates empty ring (and paths table) in new files and moves them over the existing ones. Resizing the existing
+        file would kill processes that have it mapped with SIGBUS: they keep their mapping of the old file instead
+        """
+        tmp_name = "%s.%d.tmp" % (self.file_name, os.getpid())
+        fd = os.open(tmp_name, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            os.pwrite(fd, HEADER.pack(MAGIC, VERSION, RECORD.size, self.capacity, 0), 0)
+            with open(tmp_name + ".paths", "w"):
+                pass
+            os.replace(tmp_name + ".paths", self.paths_file_name)
+            os.replace(tmp_name, self.file_name)
+        except BaseException:
+            os.close(fd)
+            for name in (tmp_name, tmp_name + ".paths"):
+                if os.path.exists(name):
+                    os.remove(name)
+            raise
+        return fd
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def count(self) -> int:
+        """Number of records ever written"""
+        return HEADER.unpack_from(self._mmap, 0)[4]
+
+    def _load_paths(self):
+        try:
+            with open(self.paths_file_name, "rb") as f:
+                f.seek(self._paths_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # Only complete lines: a writer may be in the middle of appending one
+        data = data[: data.rfind(b"\n") + 1]
+        self._paths_offset += len(data)
+        for path in data.decode("utf-8").splitlines():
+            self._path_ids[path] = len(self._paths)
+            self._paths.append(path)
+
+    def get_path(self, path_id: int) -> Optional[str]:
+        if path_id >= len(self._paths):
+            self._load_paths()
+        return self._paths[path_id] if path_id < len(self._paths) else None
+
+    def get_path_id(self, path: str) -> int:
+        path = path.replace("\n", " ")
+        if path not in self._path_ids:
+            self._load_paths()
+            if path not in self._path_ids:
+                with open(self.paths_file_name, "ab") as f:
+                    f.write(path.encode("utf-8") + b"\n")
+                self._load_paths()
+        return self._path_ids[path]
+
+    def append(self, records: list):
+        """Appends request log records (dicts with ProfileRequest request log fields)"""
+        count = self.count
+        for record in records[-self.capacity :]:
+            RECORD.pack_into(
+                self._mmap,
+                HEADER_SIZE + (count % self.capacity) * RECORD.size,
+                count,
+                record["timestamp"],
+                max(record["duration"], 0),
+                max(record.get("user_time") or 0, 0),
+                max(record.get("sys_time") or 0, 0),
+                record["pid"],
+                self.get_path_id(record["path_info"]),
+                record.get("code") or 0,
+                METHOD_IDS.get(record.get("method"), 0),
+            )
+            count += 1
+        HEADER.pack_into(self._mmap, 0, MAGIC, VERSION, RECORD.size, self.capacity, count)
+
+    def iter_raw(self, since: Optional[float] = None) -> Iterator[tuple]:
+        """
+        Yields raw record tuples (timestamp, duration, user time, sys time, pid, path id, status code, method id),
+        oldest first. Records older than since (unix timestamp) are skipped. This is the fast path for scanning large
+        rings: records are unpacked straight from the mapping without building any objects but tuples.
+        """
+        count = self.count
+        first = max(count - self.capacity, 0)
+        first_slot = first % self.capacity
+        last_slot = (count - 1) % self.capacity + 1 if count else 0
+        if count and first_slot >= last_slot:
+            ranges = ((first_slot, self.capacity, first), (0, last_slot, first + self.capacity - first_slot))
+        else:
+            ranges = ((first_slot, last_slot, first),)
+        for start_slot, end_slot, seq in ranges:
+            data = memoryview(self._mmap)[HEADER_SIZE + start_slot * RECORD.size : HEADER_SIZE + end_slot * RECORD.size]
+            try:
+                for record in RECORD.iter_unpack(data):
+                    # Slots that were overwritten since we read the header have a newer sequence number
+                    if record[0] == seq and (since is None or record[1] >= since):
+                        yield record[1:]
+                    seq += 1
+            finally:
+                data.release()
+
+    def iter_records(self, since: Optional[float] = None) -> Iterator[RequestRecord]:
+        for timestamp, duration, user_time, sys_time, pid, path_id, code, method_id in self.iter_raw(since):
+            yield RequestRecord(
+                timestamp,
+                duration,
+                user_time,
+                sys_time,
+                pid,
+                self.get_path(path_id),
+                code,
+                METHODS[method_id] if method_id < len(METHODS) else "",
+            )
+
+
+def read_request_ring(file_name: Optional[str] = None, since: Optional[float] = None) -> Iterator[RequestRecord]:
+    """Yields records from request ring file, oldest first. Yields nothing if the file doesn't exist"""
+    try:
+        ring = RequestRing(file_name)
+    except (FileNotFoundError, ValueError):
+        return
+    with ring:
+        yield from ring.iter_records(since)
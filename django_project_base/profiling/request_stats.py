@@ -0,0 +1,197 @@
+import threading
+import time
+
+from collections import Counter
+
+from dynamicforms.struct import Struct
+
+from django_project_base.caching import FlushThread, register_flush
+from django_project_base.caching.cache_hash import CacheHash
+from django_project_base.caching.local_cache import LocalCache
+from django_project_base.profiling.latency_histogram import LatencyHistogram
+
+BUCKET_KEY = "last_hour_requests%d"
+MINUTE_BUCKET_KEY = "last_hour_requests_min%d"
+BUCKET_SECONDS = 10
+MINUTE_BUCKET_SECONDS = 60
+# Last hour is read from 10-second buckets for the most recent minutes and from minute buckets before that
+RECENT_MINUTES = 10
+METRICS = (
+    "count",
+    "wall_time",
+    "user_time",
+    "sys_time",
+    "query_count",
+    "query_time",
+    "n_plus_one",
+    "memory_samples",
+    "memory_peak",
+    "queued",
+    "queue_wait",
+    "retries",
+)
+# Hash fields "h<bucket index>:<path>" hold LatencyHistogram counts of wall time
+HISTOGRAM_METRIC = "h%d"
+# Hash fields "m<file>@<line>:<path>" hold bytes allocated by line in memory profiled requests
+MEMORY_LINE_METRIC = "m%s"
+# Hash of totals since cache was cleared (for metrics exposition), fields "<metric>:<kind>:<path>"
+TOTALS_KEY = "profiler_totals"
+KINDS = ("request", "function", "command")
+
+
+class RequestStats:
+    """
+    Per-path request totals and latency histograms of the last hour, aggregated when written.
+
+    Every process sums its requests in memory per 10-second bucket and path. A background thread adds the sums
+    every flush_interval milliseconds to a CacheHash per 10-second bucket and to a CacheHash per minute (the rollup
+    used for older parts of the hour), one round trip per bucket. Readers thus fetch ~120 small hashes instead of a
+    row for every request.
+    """
+
+    flush_interval = 1000
+
+    _pending = {}
+    _kinds = {}
+    _lock = threading.Lock()
+    # Flush errors are ignored: if cache is temporarily unavailable, requests of that flush are lost
+    _flush_thread = FlushThread("RequestStats", lambda: RequestStats.flush())
+
+    @classmethod
+    def add(
+        cls,
+        path_info: str,
+        timestamp: float,
+        wall_time: int,
+        user_time: int,
+        sys_time: int,
+        query_count: int = 0,
+        query_time: int = 0,
+        n_plus_one: int = 0,
+        memory: tuple = None,
+        queue_wait: int = None,
+        retries: int = 0,
+        kind: str = "request",
+    ):
+        """
+        kind: one of KINDS. Functions include celery tasks
+        n_plus_one: 1 if request executed N+1 query candidates (see SqlCollector)
+        memory: (peak bytes, top lines) if request was memory profiled (see MemoryProfiler)
+        queue_wait: ms a celery task waited in queue, None if not known. Runs where it is known are counted as queued
+        retries: retry number of a celery task run. Runs that are retries are counted in retries metric
+        """
+        memory_peak, memory_lines = memory or (0, ())
+        values = (
+            1,
+            wall_time,
+            user_time,
+            sys_time,
+            query_count,
+            query_time,
+            n_plus_one,
+            int(bool(memory)),
+            memory_peak,
+            int(queue_wait is not None),
+            queue_wait or 0,
+            int(bool(retries)),
+        )
+        metrics = [(metric, value) for metric, value in zip(METRICS, values) if value]
+        metrics.append((HISTOGRAM_METRIC % LatencyHistogram.index(wall_time), 1))
+        metrics.extend((MEMORY_LINE_METRIC % line, size) for line, size in memory_lines)
+        with cls._lock:
+            cls._kinds[path_info] = kind
+            totals = cls._pending.setdefault(int(timestamp) // BUCKET_SECONDS, {}).setdefault(path_info, {})
+            for metric, value in metrics:
+                totals[metric] = totals.get(metric, 0) + value
+        cls._flush_thread.start(cls.flush_interval)
+
+    @staticmethod
+    def _fields(paths: dict) -> dict:
+        return {"%s:%s" % (metric, path): value for path, totals in paths.items() for metric, value in totals.items()}
+
+    @classmethod
+    def flush(cls):
+        with cls._lock:
+            pending, RequestStats._pending = RequestStats._pending, {}
+        minutes = {}
+        for bucket, paths in pending.items():
+            CacheHash.get_cache_hash(BUCKET_KEY % bucket, timeout=(RECENT_MINUTES + 5) * 60).incr(cls._fields(paths))
+            minute_paths = minutes.setdefault(bucket * BUCKET_SECONDS // MINUTE_BUCKET_SECONDS, {})
+            for path, totals in paths.items():
+                minute_totals = minute_paths.setdefault(path, {})
+                for metric, value in totals.items():
+                    minute_totals[metric] = minute_totals.get(metric, 0) + value
+        for minute, paths in minutes.items():
+            CacheHash.get_cache_hash(MINUTE_BUCKET_KEY % minute, timeout=3900).incr(cls._fields(paths))
+
+        totals_fields = {}
+        for paths in minutes.values():
+            for path, totals in paths.items():
+                for metric, value in totals.items():
+                    # Memory lines are left out: there is no bound on their number without expiry
+                    if metric[0] != "m" or metric in METRICS:
+                        field = "%s:%s:%s" % (metric, cls._kinds.get(path, "request"), path)
+                        totals_fields[field] = totals_fields.get(field, 0) + value
+        CacheHash.get_cache_hash(TOTALS_KEY, timeout=None).incr(totals_fields)
+        # Local cache stats are published along, so that metrics of all processes can be exposed
+        LocalCache.publish_stats()
+
+    @classmethod
+    def _reset_after_fork(cls):
+        RequestStats._lock = threading.Lock()
+        RequestStats._pending = {}
+        RequestStats._kinds = {}
+        RequestStats._flush_thread.reset_after_fork()
+
+    @staticmethod
+    def get_totals() -> list:
+        """
+        Returns Struct(path, kind, histogram and METRICS as attributes) per path with totals since cache was cleared
+        """
+        totals = {}
+        for field, value in CacheHash.get_cache_hash(TOTALS_KEY, timeout=None).get_all().items():
+            metric, kind, path = field.split(":", 2)
+            total = totals.get((kind, path))
+            if total is None:
+                total = totals[kind, path] = Struct(
+                    path=path, kind=kind, histogram=LatencyHistogram(), **{m: 0 for m in METRICS}
+                )
+            if metric in METRICS:
+                setattr(total, metric, getattr(total, metric) + value)
+            else:
+                total.histogram.record(LatencyHistogram.bucket_bounds(int(metric[1:]))[0], value)
+        return list(totals.values())
+
+    @staticmethod
+    def get_last_hour_keys(now: float) -> list:
+        split = (int(now) // MINUTE_BUCKET_SECONDS - RECENT_MINUTES) * MINUTE_BUCKET_SECONDS
+        minutes = range(int(now - 3600) // MINUTE_BUCKET_SECONDS, split // MINUTE_BUCKET_SECONDS)
+        buckets = range(split // BUCKET_SECONDS, int(now) // BUCKET_SECONDS + 1)
+        return [MINUTE_BUCKET_KEY % minute for minute in minutes] + [BUCKET_KEY % bucket for bucket in buckets]
+
+    @staticmethod
+    def get_last_hour_totals(now: float = None) -> dict:
+        """
+        Returns path -> Struct(path, histogram, memory_lines, cpu_time and METRICS as attributes) for the last hour
+        """
+        totals = {}
+        for values in CacheHash.get_all_many(RequestStats.get_last_hour_keys(now or time.time())).values():
+            for field, value in values.items():
+                metric, path = field.split(":", 1)
+                total = totals.get(path)
+                if total is None:
+                    total = totals[path] = Struct(path=path, histogram=LatencyHistogram(), **{m: 0 for m in METRICS})
+                    # Struct would convert a dict passed to constructor into another Struct
+                    total.memory_lines = Counter()
+                if metric in METRICS:
+                    setattr(total, metric, getattr(total, metric) + value)
+                elif metric[0] == "m":
+                    total.memory_lines[metric[1:]] += value
+                else:
+                    total.histogram.record(LatencyHistogram.bucket_bounds(int(metric[1:]))[0], value)
+        for total in totals.values():
+            total.cpu_time = total.user_time + total.sys_time
+        return totals
+
+
+register_flush(RequestStats.flush, RequestStats._reset_after_fork)
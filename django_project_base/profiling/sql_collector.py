@@ -0,0 +1,119 @@
+import functools
+import os
+import re
+import sys
+import time
+
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from django_project_base.query_tracker.base import get_call_site
+from django_project_base.query_tracker.explain import get_plan
+
+DEFAULT_FILTER_STACK = (
+    "site-packages",
+    "query_tracker",
+    os.path.join("django_project_base", "profiling"),
+    "/python3",
+    "<frozen",
+    "JetBrains",
+)
+# Fingerprints with this many executions from the same call site within one request are N+1 candidates
+DEFAULT_N_PLUS_ONE_THRESHOLD = 5
+# Fingerprints collected per request. Further distinct queries only count into totals
+MAX_FINGERPRINTS = 1000
+
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r"(?<![\w\"])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", re.IGNORECASE)
+_PLACEHOLDER_LISTS = re.compile(r"\(\s*(?:(?:\?|%s)\s*,\s*)+(?:\?|%s)\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=4096)
+def fingerprint_sql(sql: str) -> str:
+    """
+    Returns SQL with literals replaced by ?, lists of placeholders (IN (%s, %s, ...)) collapsed to (...) and whitespace
+    normalized, so that executions of the same query with different parameters share the fingerprint
+    """
+    sql = _STRINGS.sub("?", sql)
+    sql = _NUMBERS.sub("?", sql)
+    sql = _PLACEHOLDER_LISTS.sub("(...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+class SqlCollector:
+    """
+    Database execute wrapper (see connection.execute_wrapper) counting and timing queries of one request per
+    fingerprint and call site. Only fingerprints are kept, no query parameters.
+
+    Call site is the innermost frame whose file isn't matched by PROFILER_SQL_FILTER_STACK. Whether a frame is
+    filtered is decided once per code object.
+    """
+
+    def __init__(self):
+        self.filter_stack = tuple(getattr(settings, "PROFILER_SQL_FILTER_STACK", DEFAULT_FILTER_STACK))
+        self.n_plus_one_threshold = getattr(settings, "PROFILER_N_PLUS_ONE_THRESHOLD", DEFAULT_N_PLUS_ONE_THRESHOLD)
+        self.count = 0
+        self.time = 0.0
+        # fingerprint -> [count, time in ms, {call site: count}]
+        self.queries = {}
+        self._exit_stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            self.count += 1
+            self.time += duration
+            fingerprint = fingerprint_sql(sql)
+            stats = self.queries.get(fingerprint)
+            if stats is None and len(self.queries) < MAX_FINGERPRINTS:
+                stats = self.queries[fingerprint] = [0, 0.0, {}]
+            if stats is not None:
+                stats[0] += 1
+                stats[1] += duration
+                call_site = self._get_call_site()
+                stats[2][call_site] = stats[2].get(call_site, 0) + 1
+
+    def _get_call_site(self):
+        return get_call_site(sys._getframe(2), self.filter_stack)
+
+    def __enter__(self):
+        self._exit_stack = ExitStack()
+        for connection in connections.all():
+            self._exit_stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._exit_stack.close()
+
+    @property
+    def n_plus_one(self) -> list:
+        """Fingerprints executed at least n_plus_one_threshold times from the same call site"""
+        return [
+            fingerprint
+            for fingerprint, (_count, _time, call_sites) in self.queries.items()
+            if max(call_sites.values()) >= self.n_plus_one_threshold
+        ]
+
+    def get_summary(self) -> list:
+        """Per-fingerprint stats, most time consuming first"""
+        n_plus_one = set(self.n_plus_one)
+        return [
+            dict(
+                sql=fingerprint,
+                count=count,
+                time="%.3f" % (duration / 1000),
+                call_sites=sorted(call_sites.items(), key=lambda c: c[1], reverse=True)[:5],
+                n_plus_one=fingerprint in n_plus_one,
+                # Explained by query_tracker (TRACKER_EXPLAIN_THRESHOLD)
+                plan=get_plan(fingerprint),
+            )
+            for fingerprint, (count, duration, call_sites) in sorted(
+                self.queries.items(), key=lambda q: q[1][1], reverse=True
+            )
+        ]
@@ -0,0 +1,90 @@
+import os
+import sys
+import threading
+import time
+
+from collections import Counter
+
+MAX_STACK_DEPTH = 100
+
+
+class StackSampler:
+    """
+    Statistical profiler: a single thread per process takes a snapshot of stacks of registered threads HZ times per
+    second and counts them as folded stacks ("outer;inner;innermost" -> number of samples).
+
+    Sampler thread only runs while some thread is registered, so it costs nothing when profiling is not sampled.
+    """
+
+    hz = 100
+
+    _lock = threading.Lock()
+    _threads = {}
+    _active = threading.Event()
+    _sampler_thread = None
+    _labels = {}
+
+    @classmethod
+    def start(cls, hz=None) -> bool:
+        """Starts sampling stacks of current thread. Returns False if the thread is already being sampled"""
+        with cls._lock:
+            if threading.get_ident() in cls._threads:
+                return False
+            if hz:
+                StackSampler.hz = hz
+            cls._threads[threading.get_ident()] = Counter()
+            cls._active.set()
+            if StackSampler._sampler_thread is None:
+                StackSampler._sampler_thread = threading.Thread(
+                    target=cls._sample_loop, name="StackSampler", daemon=True
+                )
+                StackSampler._sampler_thread.start()
+        return True
+
+    @classmethod
+    def stop(cls) -> Counter:
+        """Stops sampling current thread and returns its folded stacks"""
+        with cls._lock:
+            stacks = cls._threads.pop(threading.get_ident(), Counter())
+            if not cls._threads:
+                cls._active.clear()
+        return stacks
+
+    @classmethod
+    def _label(cls, code) -> str:
+        label = cls._labels.get(code)
+        if label is None:
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            label = cls._labels[code] = "%s.%s" % (module, getattr(code, "co_qualname", code.co_name))
+        return label
+
+    @classmethod
+    def _fold(cls, frame) -> str:
+        labels = []
+        while frame is not None and len(labels) < MAX_STACK_DEPTH:
+            labels.append(cls._label(frame.f_code))
+            frame = frame.f_back
+        return ";".join(reversed(labels))
+
+    @classmethod
+    def _sample_loop(cls):
+        while True:
+            cls._active.wait()
+            time.sleep(1 / cls.hz)
+            frames = sys._current_frames()
+            with cls._lock:
+                for thread_id, stacks in cls._threads.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[cls._fold(frame)] += 1
+
+    @classmethod
+    def _reset_after_fork(cls):
+        StackSampler._lock = threading.Lock()
+        StackSampler._threads = {}
+        StackSampler._active = threading.Event()
+        StackSampler._sampler_thread = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=StackSampler._reset_after_fork)
@@ -1,13 +1,21 @@
-import json
 import random
+import zlib
 
 from datetime import datetime
 
+from django.conf import settings
 from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
 from dynamicforms.struct import Struct
 
-from django_project_base.caching.cache_queue import CacheQueue
+from django_project_base.caching.local_cache import LocalCache
+from django_project_base.profiling.latency_histogram import PERCENTILES
+from django_project_base.profiling.metrics import CONTENT_TYPE, get_metrics
+from django_project_base.profiling.request_log import DROPPED_COUNTER_KEY
+from django_project_base.profiling.request_ring import read_request_ring
+from django_project_base.profiling.request_stats import RequestStats
 from django_project_base.settings import PROFILER_LOG_LONG_REQUESTS_COUNT
 
 
@@ -18,6 +26,88 @@ def app_debug_view(request):
     return render(request, "app-debug/main.html", __get_debug_data())
 
 
+def app_debug_latency_view(request):
+    """Last hour latency percentiles (ms) per profiled path: requests, celery tasks and management commands"""
+    user = getattr(request, "user", None)
+    if not (user and user.is_authenticated and (user.is_staff or user.is_superuser)):
+        raise PermissionDenied
+    return JsonResponse(
+        [
+            dict(path=total.path, count=total.count, percentiles={str(p): v for p, v in total.percentiles.items()})
+            for total in __get_last_hour_totals()
+        ],
+        safe=False,
+    )
+
+
+def app_metrics_view(request):
+    """Profiler and cache statistics of all workers in OpenMetrics (Prometheus) text format"""
+    token = getattr(settings, "PROFILER_METRICS_TOKEN", None)
+    if token:
+        if request.headers.get("Authorization") != "Bearer %s" % token:
+            raise PermissionDenied
+    else:
+        user = getattr(request, "user", None)
+        if not (user and user.is_authenticated and user.is_staff):
+            raise PermissionDenied
+    return HttpResponse(get_metrics(), content_type=CONTENT_TYPE)
+
+
+def __get_last_hour_totals():
+    totals = RequestStats.get_last_hour_totals()
+    for total in totals.values():
+        total.wall_avg = int(total.wall_time / total.count)
+        total.cpu_avg = int(total.cpu_time / total.count)
+        total.core_usage = int(total.cpu_time / 3600.0) / 1000.0
+        total.queries_avg = round(total.query_count / total.count, 1)
+        total.memory_peak_avg = int(total.memory_peak / total.memory_samples / 1024) if total.memory_samples else None
+        total.queue_wait_avg = int(total.queue_wait / total.queued) if total.queued else None
+        total.memory_top_lines = [
+            dict(line=line, size=int(size / 1024)) for line, size in total.memory_lines.most_common(5)
+        ]
+        total.percentiles = total.histogram.percentiles(PERCENTILES)
+        total.p50, total.p90, total.p99, total.p999 = (total.percentiles[p] for p in PERCENTILES)
+
+    return list(sorted(totals.values(), key=lambda x: x.wall_time, reverse=True))
+
+
+def __get_flame_graph(stacks):
+    """Lays out folded stacks ("outer;inner count") as flame graph boxes with left / width in percent"""
+    if not stacks:
+        return None
+    root = dict(children={}, samples=0)
+    for line in stacks:
+        stack, samples = line.rsplit(" ", 1)
+        root["samples"] += int(samples)
+        node = root
+        for name in stack.split(";"):
+            node = node["children"].setdefault(name, dict(children={}, samples=0))
+            node["samples"] += int(samples)
+
+    boxes = []
+
+    def layout(node, depth, left):
+        for name, child in node["children"].items():
+            width = child["samples"] * 100 / root["samples"]
+            if width >= 0.1:
+                hue = 10 + zlib.crc32(name.encode()) % 50
+                boxes.append(
+                    dict(
+                        name=name,
+                        samples=child["samples"],
+                        top=depth * 18,
+                        left=round(left, 3),
+                        width=round(width, 3),
+                        color="hsl(%d, 80%%, 60%%)" % hue,
+                    )
+                )
+                layout(child, depth + 1, left)
+            left += width
+
+    layout(root, 0, 0)
+    return dict(boxes=boxes, samples=root["samples"], height=max(box["top"] for box in boxes) + 18 if boxes else 0)
+
+
 def __get_debug_data():
     import time
 
@@ -35,7 +125,8 @@ def __get_debug_data():
     for req in requests:
         queries_executed: list = req.get("queries", []) or []
 
-        num_of_queries: int = len(queries_executed)
+        # Queries are stored per fingerprint with their execution count
+        num_of_queries: int = sum(q.get("count", 1) if isinstance(q, dict) else 1 for q in queries_executed)
         num_of_distinct_queries: int = len(
             set(map(lambda d: d["sql"], filter(lambda e: isinstance(e, dict), queries_executed)))
         )
@@ -44,6 +135,9 @@ def __get_debug_data():
             r_data=dict(
                 num_of_duplicate_queries=num_of_queries - num_of_distinct_queries,
                 num_of_queries=num_of_queries,
+                num_of_n_plus_one_queries=sum(
+                    1 for q in queries_executed if isinstance(q, dict) and q.get("n_plus_one")
+                ),
                 duration=req.get("duration"),
                 path_info=req.get("PATH_INFO"),
                 host=req.get("HTTP_HOST"),
@@ -54,8 +148,12 @@ def __get_debug_data():
                 query_string=req.get("QUERY_STRING"),
             ),
             db_queries=queries_executed,
+            flame_graph=__get_flame_graph(req.get("stacks")),
             color="rgba(%d, %d, %d, 0.3)" % (r(), r(), r()),
         )
+        if req.get("memory_peak"):
+            item["r_data"]["memory_peak"] = req["memory_peak"]
+            item["r_data"]["memory_top_lines"] = req.get("memory_top_lines")
         item_data = item["r_data"]
         totals.setdefault(item_data["path_info"], Struct(count=0, time=0, path=""))
         total = totals[item_data["path_info"]]
@@ -68,31 +166,27 @@ def __get_debug_data():
     result_data.sort(key=lambda f: f.get("r_data", {}).get("duration", 0) or 0, reverse=True)
     spenders = list(sorted(totals.values(), key=lambda x: x.time, reverse=True))
 
-    totals = {}
-    for interval in range(int((time.time()) - 3600) // 10, int(time.time()) // 10 + 1):
-        last_hour_running_cmds_key = f"last_hour_running_cmds{interval}"
-        last_hour_running_cmds_queue = CacheQueue.get_cache_queue(last_hour_running_cmds_key, timeout=3600)
-
-        cache_ptr = last_hour_running_cmds_queue.lrange()
-        for item in [json.loads(item) for item in cache_ptr]:
-            totals.setdefault(item[0], Struct(count=0, wall_time=0, path="", user_time=0, sys_time=0, cpu_time=0))
-            total = totals[item[0]]
-            total.count += 1
-            total.wall_time += item[1]
-            total.user_time += item[2]
-            total.sys_time += item[3]
-            total.cpu_time += item[2] + item[3]
-            total.path = item[0]
-    for total in totals.values():
-        total.wall_avg = int(total.wall_time / total.count)
-        total.cpu_avg = int(total.cpu_time / total.count)
-        total.core_usage = int(total.cpu_time / 3600.0) / 1000.0
+    all_requests = __get_last_hour_totals()
+    memory_heavy = sorted(
+        (total for total in all_requests if total.memory_samples), key=lambda x: x.memory_peak_avg, reverse=True
+    )
 
-    all_requests = list(sorted(totals.values(), key=lambda x: x.wall_time, reverse=True))
+    request_log = {}
+    if getattr(settings, "PROFILER_REQUEST_LOG_FORMAT", "json") == "binary":
+        for rec in read_request_ring(since=time.time() - 3600):
+            request_log.setdefault(rec.path_info, Struct(path=rec.path_info, count=0, errors=0, max_duration=0))
+            total = request_log[rec.path_info]
+            total.count += 1
+            total.errors += rec.code >= 500
+            total.max_duration = max(total.max_duration, rec.duration)
 
     return dict(
         debug_data=result_data,
         spenders=spenders,
         long_running_time=int(time.time() - min_timestamp),
         all_requests=all_requests,
+        memory_heavy=memory_heavy,
+        local_caches=LocalCache.all_stats(),
+        request_log=list(sorted(request_log.values(), key=lambda x: x.count, reverse=True)),
+        dropped_request_log_records=cache.get(DROPPED_COUNTER_KEY, 0),
     )
@@ -20,6 +20,29 @@ it will also check for these additional parameters:
   Whether we should filter the stack to only show "relevant" stack code points, i.e. "our own" code.
   set to empty tuple to NOT filter the stack or specify a tuple of strings that should not be in code path
 
+"TRACKER_SAMPLE_RATE": default 1. Fraction (0 - 1) of queries that are tracked. Others run without any overhead.
+  Doesn't apply to summary mode
+
+"TRACKER_MODE": default "query". "query" logs a record per query. "summary" logs one record per request (requires
+  UrlVarsMiddleware), celery task (PerformanceCeleryTask) and management command (PerformanceCommand) with query count,
+  total time, fingerprints executed more than once and the slowest queries with their call sites. The record carries
+  the data as its query_summary attribute too. Queries outside of those are still logged one by one
+
+"TRACKER_EXPLAIN_THRESHOLD": default None (disabled). SELECT queries taking at least this many ms are explained on a
+  separate cursor and the plan is added to their log record. Plans are also shown with slow requests' queries on the
+  app-debug page (django_project_base.profiling). Independent of logger level
+
+"TRACKER_EXPLAIN_ANALYZE": default False. Use EXPLAIN ANALYZE where database supports it. Note that it runs the query
+  once more
+
+"TRACKER_EXPLAIN_TTL": default 3600. Each query fingerprint is explained at most once per this many seconds (per
+  process)
+
+"TRACKER_SLOW_QUERY_THRESHOLD": default 0. Queries taking at least this many ms are logged with the whole (filtered)
+  stack trace. Faster ones are only logged with their call site: the innermost stack entry that isn't filtered
+
+Nothing is formatted when the logger wouldn't output records of TRACKER_LOGGER_LEVEL.
+
 
 Example DATABASES configuration from settings.py:
 DATABASES = {
@@ -28,47 +51,83 @@ DATABASES = {
         "TRACKED_ENGINE": "django.db.backends.sqlite3",
         "TRACKER_LOGGER_LEVEL": logging.INFO,
         "TRACKER_FILTER_STACK", ("site-packages", "query_tracker", "/python3", "JetBrains"),
+        "TRACKER_SAMPLE_RATE": 0.1,
+        "TRACKER_SLOW_QUERY_THRESHOLD": 100,
+        "TRACKER_MODE": "query",
+        "TRACKER_EXPLAIN_THRESHOLD": 500,
         "NAME": os.path.join(BASE_DIR, "db.sqlite3"),
     }
 }
 
 Output for each query consists of:
 * request path (if it could be found, requires "django_project_base.base.UrlVarsMiddleware" to be installed
+* stack trace that led to the query (or just its call site, see TRACKER_SLOW_QUERY_THRESHOLD)
 * query itself, prefixed by execution time in ms
-* stack trace that led to the query
 """
 
 import importlib
+import linecache
 import logging
+import random
 import sys
 import time
-import traceback
 
 from typing import Optional, Tuple
 
 from django.db.backends.base.base import BaseDatabaseWrapper
 from django.db.backends.utils import CursorWrapper
 
-from django_project_base.base.middleware import get_current_request
+from django_project_base.base.middleware import get_current_request, has_current_request
+from django_project_base.query_tracker.explain import DEFAULT_EXPLAIN_TTL, explain
+from django_project_base.query_tracker.summary import QuerySummary
 
+# filter_stack -> {code object: whether its frames are filtered out}
+_filtered_code = {}
 
-def filter_stack(filter_stack: Tuple[str] = tuple()):
-    # Get the current stack trace
-    stack = traceback.extract_stack()
 
-    # Filter out the entries containing ".venv"
-    if filter_stack:
-        filtered_stack = filter(
-            lambda entry: not any(s in entry.filename for s in filter_stack),
-            stack,
-        )
-    else:
-        filtered_stack = stack
+def get_stack_frames(frame, filter_stack: Tuple[str] = tuple(), innermost_only: bool = False) -> list:
+    """
+    Walks the stack from frame outwards and returns (code, line number) of frames whose file isn't matched by
+    filter_stack, outermost first. Whether frames of a code object are filtered is decided once per code object.
+    """
+    filtered_code = _filtered_code.get(filter_stack)
+    if filtered_code is None:
+        filtered_code = _filtered_code[filter_stack] = {}
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        filtered = filtered_code.get(code)
+        if filtered is None:
+            filtered = filtered_code[code] = any(s in code.co_filename for s in filter_stack)
+        if not filtered:
+            frames.append((code, frame.f_lineno))
+            if innermost_only:
+                break
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def get_call_site(frame, filter_stack: Tuple[str] = tuple()) -> Optional[str]:
+    """Returns "file:line function" of the innermost frame from frame outwards not matched by filter_stack"""
+    frames = get_stack_frames(frame, filter_stack, innermost_only=True)
+    return "%s:%d %s" % (frames[0][0].co_filename, frames[0][1], frames[0][0].co_name) if frames else None
 
-    # Format the filtered stack trace
-    formatted_stack = traceback.format_list(filtered_stack)
 
-    return "".join(formatted_stack)
+def format_stack_frames(frames: list) -> str:
+    """Formats frames returned by get_stack_frames like traceback.format_list does"""
+    lines = []
+    for code, lineno in frames:
+        lines.append('  File "%s", line %d, in %s\n' % (code.co_filename, lineno, code.co_name))
+        source = linecache.getline(code.co_filename, lineno).strip()
+        if source:
+            lines.append("    %s\n" % source)
+    return "".join(lines)
+
+
+def filter_stack(filter_stack: Tuple[str] = tuple()) -> str:
+    """Formatted stack trace of the caller without frames whose file is matched by filter_stack"""
+    return format_stack_frames(get_stack_frames(sys._getframe(1), filter_stack))
 
 
 def quote_strings(val):
@@ -78,39 +137,90 @@ def quote_strings(val):
 
 
 class StackTraceCursorWrapper(CursorWrapper):
-    def __init__(self, logger_name: Optional[str], logger_level: int, filter_stack: Tuple[str], *args, **kwds):
+    def __init__(
+        self,
+        logger_name: Optional[str],
+        logger_level: int,
+        filter_stack: Tuple[str],
+        *args,
+        sample_rate: float = 1,
+        slow_query_threshold: float = 0,
+        summary: bool = False,
+        explain_threshold: Optional[float] = None,
+        explain_analyze: bool = False,
+        explain_ttl: int = DEFAULT_EXPLAIN_TTL,
+    ):
         self.logger = logging.getLogger(logger_name)
         self.logger_level = logger_level
         self.filter_stack = filter_stack
-        super().__init__(*args, **kwds)
+        self.sample_rate = sample_rate
+        self.slow_query_threshold = slow_query_threshold
+        self.summary = summary
+        self.explain_threshold = explain_threshold
+        self.explain_analyze = explain_analyze
+        self.explain_ttl = explain_ttl
+        super().__init__(*args)
+
+    def _is_tracked(self) -> bool:
+        if not self.logger.isEnabledFor(self.logger_level):
+            return False
+        # Summaries need all queries. Sampling them would only make counts lower
+        return self.summary or self.sample_rate >= 1 or random.random() < self.sample_rate
 
     def execute(self, sql, params=None):
-        log_lines = []
+        tracked = self._is_tracked()
+        if not tracked and self.explain_threshold is None:
+            return self._execute(sql, params)
+        tim = time.perf_counter()
         try:
-            request = get_current_request()
-            log_lines.append(" ".join(["request path", request.path]))
-        except:
-            pass
-        log_lines.append(" ".join(["sql", sql % tuple(map(quote_strings, params)) if params else sql]))
-        log_lines.append(filter_stack(self.filter_stack))
-        tim = time.time()
-        res = super().execute(sql, params)
-        tim = (time.time() - tim) * 1000
-        log_lines.append(" ".join(["sql", f"{tim:.2f}ms", sql % tuple(map(quote_strings, params)) if params else sql]))
-        self.logger.log(self.logger_level, "\n".join(log_lines))
+            # Django wraps this cursor in its own CursorWrapper which already ran connection's execute wrappers
+            res = self._execute(sql, params)
+        except BaseException:
+            if tracked:
+                self._track(sql, params, (time.perf_counter() - tim) * 1000)
+            raise
+        tim = (time.perf_counter() - tim) * 1000
+        plan = None
+        if self.explain_threshold is not None and tim >= self.explain_threshold:
+            # Imported here: profiling package imports models, database engine may be loaded before apps
+            from django_project_base.profiling.sql_collector import fingerprint_sql
+
+            plan = explain(
+                self.db, sql, params, fingerprint_sql(sql), analyze=self.explain_analyze, ttl=self.explain_ttl
+            )
+        if tracked:
+            self._track(sql, params, tim, plan)
         return res
 
     def executemany(self, sql, param_list):
-        log_lines = []
+        if not self._is_tracked():
+            return self._executemany(sql, param_list)
+        tim = time.perf_counter()
         try:
-            request = get_current_request()
+            return self._executemany(sql, param_list)
+        finally:
+            self._track(sql, None, (time.perf_counter() - tim) * 1000)
+
+    def _get_call_site(self) -> Optional[str]:
+        return get_call_site(sys._getframe(4), self.filter_stack)
+
+    def _track(self, sql, params, tim: float, plan: Optional[str] = None):
+        request = get_current_request() if has_current_request() else None
+        if self.summary:
+            summary = QuerySummary.get_current(request)
+            if summary is not None:
+                summary.add(sql, tim, self._get_call_site, self.logger, self.logger_level, plan)
+                return
+
+        log_lines = []
+        if request is not None:
             log_lines.append(" ".join(["request path", request.path]))
-        except:
-            pass
-        log_lines.append(" ".join(["sql", sql]))
-        log_lines.append(filter_stack())
+        frames = get_stack_frames(sys._getframe(2), self.filter_stack, tim < self.slow_query_threshold)
+        log_lines.append(format_stack_frames(frames))
+        log_lines.append(" ".join(["sql", f"{tim:.2f}ms", sql % tuple(map(quote_strings, params)) if params else sql]))
+        if plan:
+            log_lines.append(" ".join(["plan", plan]))
         self.logger.log(self.logger_level, "\n".join(log_lines))
-        return super().executemany(sql, param_list)
 
 
 class DatabaseWrapper(BaseDatabaseWrapper):
@@ -122,9 +232,16 @@ class DatabaseWrapper(BaseDatabaseWrapper):
         tracked_engine = settings_dict["TRACKED_ENGINE"] + ".base"
         logger_name = settings_dict.get("TRACKER_LOGGER_NAME", None)
         logger_level = settings_dict.get("TRACKER_LOGGER_LEVEL", default_level) or logging.DEBUG
-        filter_stack = settings_dict.get(
-            "TRACKER_FILTER_STACK", ("site-packages", "query_tracker", "/python3", "JetBrains")
+        filter_stack = tuple(
+            settings_dict.get("TRACKER_FILTER_STACK", ("site-packages", "query_tracker", "/python3", "JetBrains"))
         )
+        sample_rate = settings_dict.get("TRACKER_SAMPLE_RATE", 1)
+        slow_query_threshold = settings_dict.get("TRACKER_SLOW_QUERY_THRESHOLD", 0)
+        mode = settings_dict.get("TRACKER_MODE", "query")
+        explain_threshold = settings_dict.get("TRACKER_EXPLAIN_THRESHOLD", None)
+        explain_analyze = settings_dict.get("TRACKER_EXPLAIN_ANALYZE", False)
+        explain_ttl = settings_dict.get("TRACKER_EXPLAIN_TTL", DEFAULT_EXPLAIN_TTL)
+        assert mode in ("query", "summary")
         assert isinstance(logger_level, int)
 
         module = importlib.import_module(tracked_engine)
@@ -133,6 +250,22 @@ class DatabaseWrapper(BaseDatabaseWrapper):
         class CDBW(DBW):
             def create_cursor(self, name=None):
                 cursor = super().create_cursor(name)
-                return StackTraceCursorWrapper(logger_name, logger_level, filter_stack, cursor, self)
+                return StackTraceCursorWrapper(
+                    logger_name,
+                    logger_level,
+                    filter_stack,
+                    cursor,
+                    self,
+                    sample_rate=sample_rate,
+                    slow_query_threshold=slow_query_threshold,
+                    summary=mode == "summary",
+                    explain_threshold=explain_threshold,
+                    explain_analyze=explain_analyze,
+                    explain_ttl=explain_ttl,
+                )
+
+            def create_untracked_cursor(self, name=None):
+                """Cursor of the tracked engine, used e.g. for EXPLAIN of slow queries"""
+                return super().create_cursor(name)
 
         return CDBW(settings_dict, *args, **kwargs)
@@ -0,0 +1,71 @@
+import logging
+import re
+
+from typing import Optional
+
+from django.db import DatabaseError
+
+from django_project_base.caching.local_cache import LocalCache
+
+EXPLAIN_CACHE_NAME = "query_tracker.explain"
+DEFAULT_EXPLAIN_TTL = 3600
+# Plans kept per process
+MAX_PLANS = 1000
+
+# Only queries without side effects are explained: EXPLAIN ANALYZE executes the statement. Queries with CTEs (WITH)
+# are left out too, as they may contain INSERT, UPDATE or DELETE
+_EXPLAINABLE = re.compile(r"\s*SELECT\b", re.IGNORECASE)
+
+
+def _get_explain_cache(ttl: int = DEFAULT_EXPLAIN_TTL) -> LocalCache:
+    return LocalCache.get_local_cache(EXPLAIN_CACHE_NAME, max_size=MAX_PLANS, timeout=ttl)
+
+
+def get_plan(fingerprint: str) -> Optional[str]:
+    """Plan of the query fingerprint if it was explained (in this process) within the TTL"""
+    return _get_explain_cache().get(fingerprint)
+
+
+def explain(db, sql: str, params, fingerprint: str, analyze: bool = False, ttl: int = DEFAULT_EXPLAIN_TTL):
+    """
+    Runs EXPLAIN (EXPLAIN ANALYZE if analyze and the database supports it) of sql on a separate, untracked cursor and
+    returns the plan. Each fingerprint is explained at most once per ttl seconds, the cached plan is returned meanwhile.
+
+    db is the query_tracker database wrapper. Returns None for statements other than SELECT.
+    """
+    if not _EXPLAINABLE.match(sql) or db.needs_rollback:
+        return None
+    explain_cache = _get_explain_cache(ttl)
+    plan = explain_cache.get(fingerprint)
+    if plan is not None:
+        return plan
+    savepoint = None
+    cursor = None
+    try:
+        try:
+            prefix = db.ops.explain_query_prefix(analyze=True) if analyze else db.ops.explain_query_prefix()
+        except ValueError:
+            # Database doesn't support ANALYZE
+            prefix = db.ops.explain_query_prefix()
+        # In a transaction, a failing EXPLAIN must not break the statements that follow
+        if db.in_atomic_block:
+            savepoint = db.savepoint()
+        cursor = db.create_untracked_cursor()
+        cursor.execute("%s %s" % (prefix, sql), params)
+        plan = "\n".join(" ".join(str(column) for column in row) for row in cursor.fetchall())
+        if savepoint:
+            db.savepoint_commit(savepoint)
+    except Exception as e:
+        # Includes NotSupportedError of databases without EXPLAIN: the tracked query must never fail because of it
+        logging.getLogger(__name__).warning("EXPLAIN failed: %s", e)
+        plan = "EXPLAIN failed: %s" % e
+        if savepoint:
+            try:
+                db.savepoint_rollback(savepoint)
+            except DatabaseError as rollback_error:
+                logging.getLogger(__name__).warning("EXPLAIN savepoint rollback failed: %s", rollback_error)
+    finally:
+        if cursor is not None:
+            cursor.close()
+    explain_cache.set(fingerprint, plan, timeout=ttl)
+    return plan
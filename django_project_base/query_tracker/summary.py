@@ -0,0 +1,124 @@
+import heapq
+import logging
+import threading
+
+from typing import Optional
+
+# Distinct fingerprints kept per summary. Further distinct queries only count into totals
+MAX_FINGERPRINTS = 1000
+# Attribute of request (see UrlVarsMiddleware) holding its summary
+REQUEST_ATTRIBUTE = "query_tracker_summary"
+
+_local = threading.local()
+
+
+class QuerySummary:
+    """
+    Queries of one request, celery task or management command, logged by query_tracker as a single record when it
+    ends (TRACKER_MODE = "summary").
+
+    Summary of a request is kept on the request object that UrlVarsMiddleware makes current and is logged by the
+    middleware. Celery tasks (PerformanceCeleryTask) and management commands (PerformanceCommand) run in a QuerySummary
+    context.
+    """
+
+    def __init__(self, name: str, slowest: int = 5):
+        self.name = name
+        self.slowest_count = slowest
+        self.count = 0
+        self.time = 0.0
+        # fingerprint -> [count, time in ms]
+        self.fingerprints = {}
+        # heap of (time in ms, sequence, fingerprint, call site, plan)
+        self.slowest = []
+        self.logger = None
+        self.logger_level = logging.DEBUG
+
+    @classmethod
+    def get_current(cls, request=None) -> Optional["QuerySummary"]:
+        """Summary of the given (current) request, created on first query, or of the innermost QuerySummary context"""
+        if request is not None:
+            summary = getattr(request, REQUEST_ATTRIBUTE, None)
+            if summary is None:
+                summary = cls(request.path)
+                setattr(request, REQUEST_ATTRIBUTE, summary)
+            return summary
+        stack = getattr(_local, "stack", None)
+        return stack[-1] if stack else None
+
+    def __enter__(self):
+        if not hasattr(_local, "stack"):
+            _local.stack = []
+        _local.stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _local.stack.remove(self)
+        self.log()
+
+    @staticmethod
+    def log_request(request):
+        """Logs summary of request's queries, if any were tracked"""
+        summary = getattr(request, REQUEST_ATTRIBUTE, None)
+        if summary is not None:
+            delattr(request, REQUEST_ATTRIBUTE)
+            summary.log()
+
+    def add(
+        self,
+        sql: str,
+        duration: float,
+        get_call_site: callable,
+        logger: logging.Logger,
+        logger_level: int,
+        plan: Optional[str] = None,
+    ):
+        """get_call_site is only called for queries that make it among the slowest. plan: EXPLAIN output, if any"""
+        from django_project_base.profiling.sql_collector import fingerprint_sql
+
+        self.logger, self.logger_level = logger, logger_level
+        self.count += 1
+        self.time += duration
+        fingerprint = fingerprint_sql(sql)
+        stats = self.fingerprints.get(fingerprint)
+        if stats is None and len(self.fingerprints) < MAX_FINGERPRINTS:
+            stats = self.fingerprints[fingerprint] = [0, 0.0]
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += duration
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, (duration, self.count, fingerprint, get_call_site(), plan))
+        elif self.slowest_count and duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration, self.count, fingerprint, get_call_site(), plan))
+
+    def get_data(self) -> dict:
+        duplicates = sorted(
+            ((fingerprint, count, time) for fingerprint, (count, time) in self.fingerprints.items() if count > 1),
+            key=lambda d: d[1],
+            reverse=True,
+        )
+        return dict(
+            name=self.name,
+            count=self.count,
+            time=round(self.time, 2),
+            duplicates=[dict(sql=sql, count=count, time=round(time, 2)) for sql, count, time in duplicates],
+            slowest=[
+                dict(sql=sql, time=round(time, 2), call_site=call_site, plan=plan)
+                for time, _seq, sql, call_site, plan in sorted(self.slowest, reverse=True)
+            ],
+        )
+
+    def log(self):
+        if not self.count or self.logger is None:
+            return
+        data = self.get_data()
+        log_lines = [" ".join(["sql summary", self.name, f"{data['count']} queries", f"{data['time']:.2f}ms"])]
+        for duplicate in data["duplicates"][: self.slowest_count]:
+            log_lines.append(
+                " ".join(["duplicate", f"{duplicate['count']}x", f"{duplicate['time']:.2f}ms", duplicate["sql"]])
+            )
+        for query in data["slowest"]:
+            log_lines.append(" ".join(["slow", f"{query['time']:.2f}ms", query["sql"], "at", str(query["call_site"])]))
+            if query["plan"]:
+                log_lines.append(" ".join(["plan", query["plan"]]))
+        self.logger.log(self.logger_level, "\n".join(log_lines), extra=dict(query_summary=data))
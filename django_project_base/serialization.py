@@ -1,8 +1,9 @@
 import time
+import uuid
 
 from django.core.cache import cache
 
-from django_project_base.caching import CacheCounter
+from django_project_base.caching import BufferedCacheCounter, CacheCounter
 
 
 class ObjectLockTimeout(Exception):
@@ -64,25 +65,44 @@ class CacheLock(object):
             if not self.is_waiting:
                 self.is_waiting = True
                 key = f"Waiting.{self.stats_name}"
-                self.waiting_counter = CacheCounter(key, timeout=None)
+                self.waiting_counter = BufferedCacheCounter(key, timeout=None)
                 self.waiting_counter.incr()
                 self.append_waiting_key(key)
         elif self.is_waiting and not is_waiting:
             self.waiting_counter.incr(step=-1)
 
+    def __new__(cls, *args, **kwargs):
+        if cls is CacheLock:
+            from django_project_base.caching.cache_queue import CacheQueue
+
+            if CacheQueue.is_redis_cache_backend("default"):
+                cls = CacheLockRedis
+        return super().__new__(cls)
+
+    def acquire(self):
+        """Tries to acquire the lock once. Returns True if lock was acquired"""
+        return CacheCounter(self.name, timeout=None).incr() == 1
+
+    # noinspection PyMethodMayBeStatic
+    def wait(self, remaining):
+        """Waits until lock might be free again. Remaining is max time to wait in seconds (None for no limit)"""
+        time.sleep(0.1)
+
+    def release(self):
+        cache.delete(self.name)
+
     def __enter__(self):
         try:
             start_time = time.time()
             while True:
-                res = CacheCounter(self.name, timeout=None).incr()
-                if res == 1:
+                if self.acquire():
                     self.set_waiting(False)
                     break
                 elif self.timeout == -1:
                     self.raise_timeout_exception = True
                     break
                 self.set_waiting(True)
-                time.sleep(0.1)
+                self.wait(self.timeout - (time.time() - start_time) if self.timeout > 0 else None)
                 if 0 < self.timeout < time.time() - start_time:
                     self.raise_timeout_exception = True
                     self.set_waiting(False)
@@ -94,14 +114,60 @@ class CacheLock(object):
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.timeout != 0 and not self.timeout_checked:
-            cache.delete(self.name)
+            if not self.raise_timeout_exception:
+                self.release()
             raise NoTimeoutCheck()
 
         if exc_type is ObjectLockTimeout:
             return self.silence_object_lock_timeout
-        cache.delete(self.name)
+        self.release()
 
     def __call__(self, *args, **kwargs):
         self.timeout_checked = True
         if self.raise_timeout_exception:
             raise ObjectLockTimeout()
+
+
+class CacheLockRedis(CacheLock):
+    """
+    CacheLock for redis caches. Lock is held with SET NX PX and an owner token, so only the owner can release it.
+    Waiters block on a notification list that release pushes to, instead of polling.
+    """
+
+    # Lock expires if owner doesn't release it in this many seconds (e.g. because the process was killed)
+    lease_time = 3600
+    # Waiters re-check the lock at least this often in case it expired without a release
+    max_wait_time = 1
+    # Release notification is kept this long, so a waiter that is just about to block still sees it
+    notify_time = 10
+
+    RELEASE_SCRIPT = """
+        if redis.call("get", KEYS[1]) == ARGV[1] then
+            redis.call("del", KEYS[1], KEYS[2])
+            redis.call("rpush", KEYS[2], 1)
+            redis.call("pexpire", KEYS[2], ARGV[2])
+            return 1
+        end
+        return 0
+    """
+
+    def __init__(self, name, timeout=0, silence_object_lock_timeout=False, stats_name=None):
+        from django_redis import get_redis_connection
+
+        super().__init__(name, timeout, silence_object_lock_timeout, stats_name)
+        self.connection = get_redis_connection("default")
+        self.token = uuid.uuid4().hex
+        # Raw redis keys, built like the cache builds its own, so KEY_PREFIX and VERSION apply
+        self.key = cache.make_key(self.name)
+        self.notify_key = cache.make_key(self.name + ".notify")
+        self.release_script = self.connection.register_script(self.RELEASE_SCRIPT)
+
+    def acquire(self):
+        return bool(self.connection.set(self.key, self.token, nx=True, px=int(self.lease_time * 1000)))
+
+    def wait(self, remaining):
+        wait_time = self.max_wait_time if remaining is None else max(min(remaining, self.max_wait_time), 0.01)
+        self.connection.blpop([self.notify_key], timeout=wait_time)
+
+    def release(self):
+        self.release_script(keys=[self.key, self.notify_key], args=[self.token, int(self.notify_time * 1000)])
@@ -21,7 +21,7 @@ from django.views.i18n import JavaScriptCatalog
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
 from django_project_base.notifications.rest.router import notifications_router
-from django_project_base.profiling import app_debug_view
+from django_project_base.profiling import app_debug_latency_view, app_debug_view, app_metrics_view
 from django_project_base.settings import DOCUMENTATION_DIRECTORY
 from django_project_base.views import documentation_view
 from example.demo_django_base.views import index_view, page1_view
@@ -43,6 +43,8 @@ urlpatterns = [
     path("", include(notifications_router.urls)),
     path("", include("django_project_base.urls")),
     path("app-debug/", app_debug_view, name="app-debug"),
+    path("app-debug/latency/", app_debug_latency_view, name="app-debug-latency"),
+    path("app-debug/metrics/", app_metrics_view, name="app-debug-metrics"),
     re_path(
         r"^docs-files/(?P<path>.*)$", documentation_view, {"document_root": DOCUMENTATION_DIRECTORY}, name="docs-files"
     ),
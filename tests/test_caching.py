@@ -1,11 +1,19 @@
+import sys
 import threading
 import time
 
+from unittest import mock
+
 from django.core.cache import cache, caches
 from django.test import override_settings, SimpleTestCase
 
-from django_project_base.caching import CacheCounter
+from django_project_base.caching import BufferedCacheCounter, CacheCounter, FlushThread
+from django_project_base.caching.cache_hash import CacheHash
 from django_project_base.caching.cache_queue import CacheQueue
+from django_project_base.caching.cache_queue.cache_queue_other import CacheQueueOther
+from django_project_base.caching.cache_queue.cache_queue_segmented import CacheQueueSegmented
+from django_project_base.caching.cache_stream import CacheStream
+from django_project_base.serialization import CacheLock, CacheLockRedis
 
 
 def get_redis_cache_backend_name():
@@ -85,6 +93,58 @@ class TestCaching(SimpleTestCase):
         duration = time.time() - start
         self.assertTrue(3 < duration < 4)
 
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "",
+            }
+        }
+    )
+    def test_buffered_cache_counter(self):
+        caches["default"].clear()
+
+        def _increase_counter(step):
+            counter = BufferedCacheCounter("buffered", timeout=None)
+            for _i in range(100):
+                counter.incr(step=step, start=10)
+
+        threads = [threading.Thread(target=_increase_counter, args=(step,)) for step in (1, 2, -1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        BufferedCacheCounter.flush()
+        self.assertEqual(cache.get("buffered"), 210)
+
+        # Buffered increments get flushed by background thread
+        BufferedCacheCounter("buffered", timeout=None).incr()
+        start = time.time()
+        while cache.get("buffered") == 210 and time.time() - start < 3:
+            time.sleep(0.1)
+        self.assertEqual(cache.get("buffered"), 211)
+
+    def test_flush_thread(self):
+        flushed = threading.Event()
+        errors = []
+
+        def flush():
+            if not errors:
+                raise ValueError("cache unavailable")
+            flushed.set()
+
+        flush_thread = FlushThread("test", flush, errors.append)
+        flush_thread.start(10)
+        thread = flush_thread._thread
+        flush_thread.start(10)
+        self.assertIs(flush_thread._thread, thread)
+        # Flush errors don't stop the thread
+        self.assertTrue(flushed.wait(3))
+        self.assertEqual([str(error) for error in errors], ["cache unavailable"])
+
+        flush_thread.reset_after_fork()
+        self.assertIsNone(flush_thread._thread)
+
     # noinspection PyMethodMayBeStatic
     def _change_counters(self, increase=True, start=0):
         def _increase_counter(key, value):
@@ -131,6 +191,8 @@ class TestCaching(SimpleTestCase):
     def test_cache_queue_redis_cache(self):
         # Calling cache queue test for redis cache backend
         self._test_cache_queue()
+        self._test_cache_queue_batch()
+        self._test_cache_queue_blocking()
 
     @override_settings(
         CACHES={
@@ -143,10 +205,167 @@ class TestCaching(SimpleTestCase):
     def test_cache_queue_loc_mem_cache(self):
         # Calling cache queue test for locmem cache backend
         self._test_cache_queue()
+        self._test_cache_queue_blocking()
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "",
+            }
+        }
+    )
+    def test_cache_queue_other_loc_mem_cache(self):
+        # Calling cache queue test for the single-key (list) queue implementation
+        self._test_cache_queue(lambda key, timeout=-1: CacheQueueOther(key, cache_name="default", timeout=timeout))
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "",
+            }
+        }
+    )
+    def test_cache_queue_segmented_loc_mem_cache(self):
+        # Calling cache queue test for the segmented queue implementation
+        self._test_cache_queue(lambda key, timeout=-1: CacheQueueSegmented(key, cache_name="default", timeout=timeout))
 
-    def _test_cache_queue(self):
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "",
+            }
+        },
+        DJANGO_PROJECT_BASE_CACHE_QUEUE_SEGMENTED=True,
+    )
+    def test_cache_queue_segmented_concurrent_rpush(self):
         caches["default"].clear()
+        self.assertIsInstance(CacheQueue.get_cache_queue("test"), CacheQueueSegmented)
+
+        def _push(thread_no):
+            cache_queue = CacheQueue.get_cache_queue("test", timeout=None)
+            for i in range(50):
+                cache_queue.rpush(f"{thread_no}.{i}")
+
+        threads = [threading.Thread(target=_push, args=(t,)) for t in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
         cache_queue = CacheQueue.get_cache_queue("test", timeout=None)
+        whole_list = cache_queue.lrange()
+        self.assertEqual(len(whole_list), 250)
+        # No item is lost and items pushed by one thread keep their order
+        for t in range(5):
+            thread_items = [item.decode("utf-8") for item in whole_list if item.decode("utf-8").startswith(f"{t}.")]
+            self.assertEqual(thread_items, [f"{t}.{i}" for i in range(50)])
+
+        # lrange(count) returns count + 1 items, same as redis LRANGE 0 count
+        self.assertEqual(len(cache_queue.lrange(150)), 151)
+        self.assertEqual(len(cache_queue.lpop(200)), 200)
+        self.assertEqual(len(cache_queue.lrange()), 50)
+        cache_queue.ltrim(-10)
+        self.assertEqual(cache_queue.lrange(), whole_list[-10:])
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "",
+            }
+        },
+        DJANGO_PROJECT_BASE_CACHE_QUEUE_SEGMENTED=True,
+    )
+    def test_cache_queue_segmented_timeout(self):
+        caches["default"].clear()
+        cache_queue = CacheQueue.get_cache_queue("expiring", timeout=1)
+        cache_queue.rpush("A")
+        time.sleep(0.7)
+        cache_queue.rpush("B")
+        time.sleep(0.5)
+        # Items expire with queue's timeout counted from their push. Expired ones are skipped
+        self.assertEqual(cache_queue.lrange(), [b"B"])
+        self.assertEqual(cache_queue.lpop(), b"B")
+        self.assertIsNone(cache_queue.lpop())
+
+        # Slot reserved by an rpush that didn't write it within SLOT_WAIT: head moves past it
+        cache_queue = CacheQueue.get_cache_queue("reserved", timeout=None)
+        cache_queue.rpush("A")
+        cache_queue._incr(cache_queue.tail_key, 1)
+        cache_queue.rpush("B")
+        self.assertEqual(cache_queue.lpop(2), [b"A", b"B"])
+        self.assertIsNone(cache_queue.lpop())
+        head, tail = cache_queue._bounds()
+        self.assertEqual(head, tail)
+
+        cache_queue.rpush("C")
+        cache_queue._incr(cache_queue.tail_key, 1)
+        self.assertEqual(cache_queue.rpop(), b"C")
+        self.assertEqual(cache_queue.lrange(), [])
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "",
+                "OPTIONS": {"MAX_ENTRIES": 300},
+            }
+        },
+        DJANGO_PROJECT_BASE_CACHE_QUEUE_SEGMENTED=True,
+    )
+    def test_cache_queue_segmented_evicted_slots(self):
+        caches["default"].clear()
+        cache_queue = CacheQueue.get_cache_queue("evicted", timeout=None)
+        for i in range(400):
+            cache_queue.rpush(str(i))
+        # Cache culled some of the slots: the rest are still served in order
+        items = cache_queue.lrange()
+        self.assertTrue(0 < len(items) < 400)
+        self.assertEqual(items, sorted(items, key=int))
+        self.assertEqual(cache_queue.lpop(), items[0])
+        self.assertEqual(cache_queue.lpop(400), items[1:])
+        self.assertIsNone(cache_queue.lpop())
+
+    def _test_cache_queue_blocking(self):
+        caches["default"].clear()
+        cache_queue = CacheQueue.get_cache_queue("blocking", timeout=None)
+
+        # Timeout with no data
+        start = time.time()
+        self.assertIsNone(cache_queue.blpop(0.3))
+        self.assertGreaterEqual(time.time() - start, 0.3)
+
+        # Waiter gets data as soon as it is pushed
+        threading.Timer(0.2, lambda: CacheQueue.get_cache_queue("blocking", timeout=None).rpush("1", "2", "3")).start()
+        start = time.time()
+        self.assertEqual(cache_queue.blpop(5), b"1")
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(cache_queue.blpop(5, 10), [b"2", b"3"])
+
+        # Consumer gets data in batches
+        cache_queue.rpush(*range(25))
+        consumer = cache_queue.consume(batch_size=10, max_wait=0.1)
+        batches = [next(consumer) for _i in range(3)]
+        self.assertEqual([len(batch) for batch in batches], [10, 10, 5])
+        self.assertEqual([item for batch in batches for item in batch], [str(i).encode("utf-8") for i in range(25)])
+
+    def _test_cache_queue_batch(self):
+        caches["default"].clear()
+        with CacheQueue.batch():
+            for i in range(3):
+                CacheQueue.get_cache_queue(f"batch{i}", timeout=None).rpush(f"{i}.1", f"{i}.2")
+            CacheQueue.get_cache_queue("batch0", timeout=None).lpush("0.0")
+        for i in range(3):
+            expected = [f"{i}.1", f"{i}.2"] if i else ["0.0", "0.1", "0.2"]
+            whole_list = CacheQueue.get_cache_queue(f"batch{i}", timeout=None).lrange()
+            self.assertEqual([item.decode("utf-8") for item in whole_list], expected)
+
+    def _test_cache_queue(self, get_cache_queue=CacheQueue.get_cache_queue):
+        caches["default"].clear()
+        cache_queue = get_cache_queue("test", timeout=None)
 
         # inserting data to end of queue
         cache_queue.rpush("1")
@@ -185,7 +404,7 @@ class TestCaching(SimpleTestCase):
         self.assertTrue(isinstance(whole_list, list))
         self.assertEqual(len(whole_list), 0)
 
-        cache_queue = CacheQueue.get_cache_queue("test1")
+        cache_queue = get_cache_queue("test1")
         # inserting data to start of queue
         cache_queue.lpush("1")
         cache_queue.lpush("2", "3", "4")
@@ -241,3 +460,169 @@ class TestCaching(SimpleTestCase):
             time.sleep(0.1)
         duration = time.time() - start
         self.assertTrue(2 < duration < 3)
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "",
+            }
+        }
+    )
+    def test_without_django_redis(self):
+        CacheQueue.reset()
+        self.addCleanup(CacheQueue.reset)
+        with mock.patch.dict(sys.modules, {"django_redis": None, "django_redis.cache": None}):
+            self.assertFalse(CacheQueue.is_redis_cache_backend("default"))
+            lock = CacheLock("no_redis")
+            self.assertNotIsInstance(lock, CacheLockRedis)
+            with lock:
+                pass
+
+    def test_redis_blpop_fallback(self):
+        from redis.exceptions import ResponseError
+
+        from django_project_base.caching.cache_queue.cache_queue_redis import CacheQueueRedis
+
+        self.addCleanup(setattr, CacheQueueRedis, "_has_blmpop", True)
+        with mock.patch("django_project_base.caching.cache_queue.cache_queue_redis.get_redis_connection") as conn:
+            queue = CacheQueueRedis("queue", cache_name="default", timeout=None)
+            client = conn.return_value
+            # Errors other than a missing BLMPOP command are raised and don't switch to the fallback
+            client.blmpop.side_effect = ResponseError("WRONGTYPE Operation against a key holding the wrong kind")
+            with self.assertRaises(ResponseError):
+                queue.blpop(1, count=2)
+            self.assertTrue(CacheQueueRedis._has_blmpop)
+
+            client.blmpop.side_effect = ResponseError("ERR unknown command 'BLMPOP', with args beginning with: ")
+            client.blpop.return_value = (b"queue", b"1")
+            client.lpop.return_value = [b"2"]
+            self.assertEqual(queue.blpop(1, count=2), [b"1", b"2"])
+            self.assertFalse(CacheQueueRedis._has_blmpop)
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "",
+            }
+        }
+    )
+    def test_cache_queue_pool(self):
+        cache_queue = CacheQueue.get_cache_queue("pooled", timeout=10)
+        self.assertIs(CacheQueue.get_cache_queue("pooled", timeout=10), cache_queue)
+        self.assertIsNot(CacheQueue.get_cache_queue("pooled", timeout=20), cache_queue)
+
+        # Getting a queue handle doesn't touch the cache
+        caches["default"].clear()
+        with mock.patch.object(caches["default"], "get") as cache_get:
+            CacheQueue.get_cache_queue("pooled1", timeout=10)
+            self.assertFalse(cache_get.called)
+
+        # Changing cache settings resets the pool
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            self.assertIsNot(CacheQueue.get_cache_queue("pooled", timeout=10), cache_queue)
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": get_redis_cache_backend_name(),
+                "LOCATION": "redis://127.0.0.1:6379?db=1",
+                "OPTIONS": {
+                    "CLIENT_CLASS": "django_redis.client.DefaultClient",
+                },
+            },
+        }
+    )
+    def test_cache_stream_redis_cache(self):
+        self._test_cache_stream()
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "",
+            }
+        }
+    )
+    def test_cache_stream_loc_mem_cache(self):
+        self._test_cache_stream()
+
+    def _test_cache_stream(self):
+        caches["default"].clear()
+        stream = CacheStream.get_cache_stream("stream", max_length=1000)
+        # Streams don't expire unless asked to
+        self.assertIsNone(stream.timeout)
+        ids = stream.add("1", "2", "3")
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(stream.length(), 3)
+
+        # Each group gets every entry, consumers in a group share them
+        entries = stream.read("group", "consumer1", count=2)
+        self.assertEqual([value for _entry_id, value in entries], [b"1", b"2"])
+        self.assertEqual([entry_id for entry_id, _value in entries], ids[:2])
+        self.assertEqual([value for _entry_id, value in stream.read("group", "consumer2", count=10)], [b"3"])
+        self.assertEqual(len(stream.read("other_group", "consumer1", count=10)), 3)
+        self.assertEqual(stream.read("group", "consumer1", count=10), [])
+        self.assertEqual(stream.pending("group"), 3)
+
+        # Acknowledged entries are no longer pending
+        self.assertEqual(stream.ack("group", *ids[:2]), 2)
+        self.assertEqual(stream.pending("group"), 1)
+
+        # Entries of a dead consumer can be reclaimed once they were idle long enough
+        self.assertEqual(stream.reclaim("group", "consumer1", min_idle_time=10), [])
+        time.sleep(0.2)
+        self.assertEqual(stream.reclaim("group", "consumer1", min_idle_time=0.1), [(ids[2], b"3")])
+        self.assertEqual(stream.ack("group", ids[2]), 1)
+        self.assertEqual(stream.pending("group"), 0)
+
+        # Blocking read waits for entries to arrive
+        start = time.time()
+        self.assertEqual(stream.read("group", "consumer1", block=0.3), [])
+        self.assertGreaterEqual(time.time() - start, 0.3)
+        threading.Timer(0.2, lambda: stream.add("4")).start()
+        self.assertEqual([value for _entry_id, value in stream.read("group", "consumer1", block=2)], [b"4"])
+
+        # Stream length is capped
+        capped_stream = CacheStream.get_cache_stream("capped_stream", timeout=None, max_length=5)
+        capped_stream.add(*range(20))
+        self.assertLess(capped_stream.length(), 20)
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": get_redis_cache_backend_name(),
+                "LOCATION": "redis://127.0.0.1:6379?db=1",
+                "OPTIONS": {
+                    "CLIENT_CLASS": "django_redis.client.DefaultClient",
+                },
+            },
+        }
+    )
+    def test_cache_hash_redis_cache(self):
+        self._test_cache_hash()
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "",
+            }
+        }
+    )
+    def test_cache_hash_loc_mem_cache(self):
+        self._test_cache_hash()
+
+    def _test_cache_hash(self):
+        caches["default"].clear()
+        cache_hash = CacheHash.get_cache_hash("hash", timeout=10)
+        self.assertEqual(cache_hash.get_all(), {})
+        cache_hash.incr({"count:a": 1, "time:a": 10})
+        cache_hash.incr({"count:a": 2, "count:b": 1})
+        self.assertEqual(cache_hash.get_all(), {"count:a": 3, "time:a": 10, "count:b": 1})
+        CacheHash.get_cache_hash("hash2", timeout=10).incr({"count:c": 5})
+        self.assertEqual(
+            CacheHash.get_all_many(["hash", "hash2", "missing"]),
+            {"hash": {"count:a": 3, "time:a": 10, "count:b": 1}, "hash2": {"count:c": 5}},
+        )
@@ -0,0 +1,480 @@
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+
+from io import StringIO
+from unittest import mock
+
+import celery
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.core.handlers.exception import convert_exception_to_response
+from django.core.management import call_command
+from django.test import override_settings, RequestFactory, SimpleTestCase, TestCase
+
+from django_project_base.caching import BufferedCacheCounter
+from django_project_base.caching.local_cache import LocalCache
+from django_project_base.profiling import request_log
+from django_project_base.profiling.latency_histogram import LatencyHistogram
+from django_project_base.profiling.memory_profiler import MemoryProfiler
+from django_project_base.profiling.metrics import get_metrics
+from django_project_base.profiling.middleware import ProfileRequest
+from django_project_base.profiling.performance_celery_task_class import ENQUEUED_AT_HEADER, PerformanceCeleryTask
+from django_project_base.profiling.request_log import DROPPED_COUNTER_KEY, get_request_log_files, RequestLogWriter
+from django_project_base.profiling.request_ring import read_request_ring, RequestRing
+from django_project_base.profiling.request_stats import RequestStats
+from django_project_base.profiling.sql_collector import fingerprint_sql, SqlCollector
+from django_project_base.profiling.stack_sampler import StackSampler
+from django_project_base.profiling.views import app_debug_latency_view, app_metrics_view
+
+User = get_user_model()
+
+
+def transform_path(path: str, info: dict) -> str:
+    """PROFILER_PATH_TRANSFORM that doesn't use params"""
+    return path
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "",
+        }
+    }
+)
+class ProfilerTestBase(SimpleTestCase):
+    """Profiler tests use their own cache, request log files and buffered profiler data"""
+
+    def setUp(self):
+        super().setUp()
+        caches["default"].clear()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        for name, file_name in (("REQUEST_LOG_FILE", "wsgi_performance.txt"), ("REQUEST_LOG_LOCK_FILE", "lock")):
+            patcher = mock.patch.object(request_log, name, os.path.join(self.tmp_dir.name, file_name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp_dir.cleanup)
+        self._reset_profiler_state()
+
+    def tearDown(self):
+        self._reset_profiler_state()
+        super().tearDown()
+
+    @staticmethod
+    def _reset_profiler_state():
+        # Data buffered by other tests must not be flushed into this one's cache or log files
+        with RequestStats._lock:
+            RequestStats._pending = {}
+            RequestStats._kinds = {}
+        with RequestLogWriter._instance_lock:
+            RequestLogWriter._instance = None
+
+    @staticmethod
+    def _read_records():
+        records = []
+        for file_name in get_request_log_files():
+            with open(file_name) as f:
+                records.extend(json.loads(line) for line in f)
+        return records
+
+
+class TestRequestLog(ProfilerTestBase):
+    def test_batched_write(self):
+        writer = RequestLogWriter(buffer_size=100, flush_interval=100000)
+        for i in range(10):
+            writer.write(dict(duration=i))
+        # Nothing is written by the request itself
+        self.assertEqual(get_request_log_files(), [])
+        writer.flush()
+        self.assertEqual([r["duration"] for r in self._read_records()], list(range(10)))
+
+    def test_dropped_records(self):
+        writer = RequestLogWriter(buffer_size=5, flush_interval=100000)
+        for i in range(8):
+            writer.write(dict(duration=i))
+        self.assertEqual(writer.dropped, 3)
+        writer.flush()
+        BufferedCacheCounter.flush()
+        self.assertEqual([r["duration"] for r in self._read_records()], list(range(5)))
+        self.assertEqual(caches["default"].get(DROPPED_COUNTER_KEY), 3)
+        self.assertEqual(writer.dropped, 0)
+
+    def test_rotation(self):
+        writer = RequestLogWriter(buffer_size=100, flush_interval=100000)
+        with mock.patch.object(request_log, "MAX_DATA_LOGGING_FILE_SIZE", 50):
+            for i in range(10):
+                writer.write(dict(duration=i, path_info="rest/some-path"))
+                writer.flush()
+        files = get_request_log_files()
+        self.assertEqual([int(f.split(".")[-1]) for f in files], [1, 2, 3])
+        # Rotated files hold the newest records in order
+        self.assertEqual([r["duration"] for r in self._read_records()], [7, 8, 9])
+
+    def test_request_ring(self):
+        ring_file = os.path.join(self.tmp_dir.name, "wsgi_performance.ring")
+        now = time.time()
+        records = [
+            dict(
+                timestamp=now - 20 + i,
+                duration=i * 10,
+                user_time=i,
+                sys_time=1,
+                pid=123,
+                path_info="rest/path%d" % (i % 3),
+                code=200 if i % 2 else 500,
+                method="GET" if i % 2 else "POST",
+            )
+            for i in range(20)
+        ]
+        with RequestRing(ring_file, capacity=8, writable=True) as ring:
+            ring.append(records[:5])
+            self.assertEqual([rec.duration for rec in ring.iter_records()], [0, 10, 20, 30, 40])
+            for rec in records[5:]:
+                ring.append([rec])
+            self.assertEqual(ring.count, 20)
+
+        # Only the last 8 records are kept, readers get them oldest first
+        read = list(read_request_ring(ring_file))
+        self.assertEqual([rec.duration for rec in read], [i * 10 for i in range(12, 20)])
+        self.assertEqual(read[0].path_info, "rest/path0")
+        self.assertEqual((read[0].method, read[0].code, read[1].method, read[1].code), ("POST", 500, "GET", 200))
+        self.assertEqual((read[0].user_time, read[0].sys_time, read[0].pid), (12, 1, 123))
+        self.assertEqual(len(list(read_request_ring(ring_file, since=now - 3))), 3)
+        self.assertEqual(list(read_request_ring(os.path.join(self.tmp_dir.name, "missing"))), [])
+
+        # Ring with different layout is replaced by a new file: processes that have the old one mapped can still use it
+        with RequestRing(ring_file) as old_ring:
+            inode = os.stat(ring_file).st_ino
+            with RequestRing(ring_file, capacity=4, writable=True) as ring:
+                self.assertEqual((ring.count, ring.capacity), (0, 4))
+                ring.append(records[:1])
+            self.assertNotEqual(os.stat(ring_file).st_ino, inode)
+            self.assertEqual(len(list(old_ring.iter_raw())), 8)
+        self.assertEqual([rec.path_info for rec in read_request_ring(ring_file)], ["rest/path0"])
+        # No temporary files are left behind
+        self.assertEqual(len(os.listdir(self.tmp_dir.name)), 2)
+
+    def test_binary_request_log(self):
+        ring_file = os.path.join(self.tmp_dir.name, "wsgi_performance.ring")
+        with self.settings(PROFILER_REQUEST_LOG_FORMAT="binary", PROFILER_REQUEST_RING_FILE=ring_file):
+            writer = RequestLogWriter(buffer_size=100, flush_interval=100000)
+            for i in range(3):
+                writer.write(dict(timestamp=time.time(), duration=i, pid=1, path_info="rest/path", code=200))
+            writer.flush()
+            self.assertEqual([rec.duration for rec in read_request_ring()], [0, 1, 2])
+        self.assertEqual(get_request_log_files(), [])
+
+    def test_analyze_profiler_log(self):
+        hour = 1700000000 // 3600 * 3600
+        writer = RequestLogWriter(buffer_size=1000, flush_interval=100000)
+        for i in range(40):
+            # rest/slow gets 10 times slower in the second hour, rest/fast stays the same
+            writer.write(dict(timestamp=hour + i % 2 * 3600 + i, duration=10, path_info="rest/fast", code=200))
+            writer.write(
+                dict(timestamp=hour + i % 2 * 3600 + i, duration=10 + i % 2 * 90, path_info="rest/slow", code=500)
+            )
+        writer.flush()
+        with open(get_request_log_files()[-1], "a") as f:
+            f.write('{"timestamp": 1')
+
+        out = StringIO()
+        # A file removed by rotation after the files were listed is skipped
+        with mock.patch(
+            "django_project_base.management.commands.analyze_profiler_log.get_request_log_files",
+            return_value=[request_log.REQUEST_LOG_FILE + ".0"] + get_request_log_files(),
+        ):
+            call_command("analyze_profiler_log", source="json", output_format="json", stdout=out)
+        rows = json.loads(out.getvalue())
+        self.assertEqual(
+            [(r["path"], r["hour"], r["count"], r["errors"]) for r in rows],
+            [
+                ("rest/fast", "2023-11-14 22:00", 20, 0),
+                ("rest/slow", "2023-11-14 22:00", 20, 20),
+                ("rest/fast", "2023-11-14 23:00", 20, 0),
+                ("rest/slow", "2023-11-14 23:00", 20, 20),
+            ],
+        )
+        # Percentiles are upper bounds of histogram buckets
+        self.assertEqual(rows[3]["p50"], LatencyHistogram.bucket_bounds(LatencyHistogram.index(100))[1])
+        self.assertEqual(rows[3]["wall_avg"], 100)
+
+        out = StringIO()
+        call_command(
+            "analyze_profiler_log",
+            source="json",
+            baseline="%d/%d" % (hour, hour + 3600),
+            compare="%d/%d" % (hour + 3600, hour + 7200),
+            stdout=out,
+        )
+        rows = list(csv.DictReader(StringIO(out.getvalue())))
+        self.assertEqual([r["path"] for r in rows], ["rest/slow"])
+        self.assertAlmostEqual(float(rows[0]["p90_ratio"]), 10, delta=0.2)
+
+
+class TestRequestStats(ProfilerTestBase):
+    def test_request_stats(self):
+        now = time.time()
+        RequestStats.add("rest/path", now, 100, 20, 5)
+        RequestStats.add("rest/path", now, 50, 10, 5)
+        # Old requests are only read from minute buckets
+        RequestStats.add("rest/other", now - 1800, 10, 1, 1)
+        RequestStats.add("rest/other", now - 7200, 10, 1, 1)
+        RequestStats.flush()
+        totals = RequestStats.get_last_hour_totals(now)
+        self.assertEqual(set(totals), {"rest/path", "rest/other"})
+        path = totals["rest/path"]
+        self.assertEqual((path.count, path.wall_time, path.user_time, path.sys_time), (2, 150, 30, 10))
+        self.assertEqual(path.cpu_time, 40)
+        self.assertEqual(totals["rest/other"].count, 1)
+        self.assertEqual(
+            path.histogram.percentiles((50, 100)),
+            {50: 50, 100: LatencyHistogram.bucket_bounds(LatencyHistogram.index(100))[1]},
+        )
+        self.assertLess(len(RequestStats.get_last_hour_keys(now)), 130)
+
+    def test_latency_view_access(self):
+        RequestStats.add("rest/path", time.time(), 100, 20, 5)
+        RequestStats.flush()
+        latency_view = convert_exception_to_response(app_debug_latency_view)
+        request = RequestFactory().get("/app-debug/latency/")
+        request.user = AnonymousUser()
+        self.assertEqual(latency_view(request).status_code, 403)
+        request.user = User(username="user")
+        self.assertEqual(latency_view(request).status_code, 403)
+        request.user = User(username="staff", is_staff=True)
+        response = latency_view(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([total["path"] for total in json.loads(response.content)], ["rest/path"])
+
+
+class TestProfileRequest(ProfilerTestBase):
+    def test_profiler_failure(self):
+        # Failing collectors are logged and left out, the function still runs and its response is returned
+        with self.settings(PROFILER_MEMORY_SAMPLING_RATE=1), mock.patch(
+            "django_project_base.profiling.middleware.log_profiler_error"
+        ) as log_profiler_error:
+            request_settings = {"REQUEST_METHOD": "FUNCTION", "PATH_INFO": "failing"}
+            with mock.patch.object(SqlCollector, "__enter__", side_effect=RuntimeError("start")):
+                with ProfileRequest(request_settings, lambda: "done", (), {}) as pr:
+                    self.assertEqual(pr.response, "done")
+            self.assertEqual(log_profiler_error.call_count, 1)
+            with mock.patch.object(SqlCollector, "__exit__", side_effect=RuntimeError("stop")):
+                with ProfileRequest(request_settings, lambda: "done", (), {}) as pr:
+                    self.assertEqual(pr.response, "done")
+            self.assertEqual(log_profiler_error.call_count, 2)
+        RequestStats.flush()
+        self.assertEqual(RequestStats.get_last_hour_totals()["failing"].count, 2)
+
+
+class TestCeleryTaskProfiling(ProfilerTestBase):
+    def test_celery_task_profiling(self):
+        app = celery.Celery("test_profiling", set_as_current=False)
+        formatted = []
+
+        class Param:
+            def __repr__(self):
+                formatted.append(1)
+                return "Param"
+
+        @app.task(base=PerformanceCeleryTask, profiler_params=dict(name="celery/profiled_task"))
+        def profiled_task(param, sleep=0):
+            time.sleep(sleep)
+            return "done"
+
+        with self.settings(
+            PROFILER_LONG_RUNNING_TASK_THRESHOLD=100, PROFILER_PATH_TRANSFORM="tests.test_profiling.transform_path"
+        ):
+            result = profiled_task.apply((Param(),), headers={ENQUEUED_AT_HEADER: time.time() - 2}, retries=2)
+            self.assertEqual(result.get(), "done")
+            # Fast runs don't format their arguments, path transform gets them lazily
+            self.assertEqual(formatted, [])
+            profiled_task.apply((Param(),), dict(sleep=0.15))
+            self.assertEqual(formatted, [1])
+        RequestLogWriter.get_writer().flush()
+        records = [r for r in self._read_records() if r["path_info"] == "celery/profiled_task"]
+        self.assertEqual(len(records), 2)
+        self.assertGreaterEqual(records[0]["queue_wait"], 2000)
+        self.assertEqual(records[0]["retries"], 2)
+        self.assertNotIn("queue_wait", records[1])
+
+        RequestStats.flush()
+        total = RequestStats.get_last_hour_totals()["celery/profiled_task"]
+        self.assertEqual((total.count, total.queued, total.retries), (2, 1, 1))
+        self.assertGreaterEqual(total.queue_wait, 2000)
+
+
+class TestMetrics(ProfilerTestBase):
+    def test_metrics(self):
+        now = time.time()
+        RequestStats.add("rest/path", now, 20, 5, 1, query_count=3)
+        RequestStats.add("rest/path", now, 700, 5, 1, query_count=3)
+        RequestStats.add("tasks.send", now, 40, 30, 0, kind="function")
+        local_cache = LocalCache.get_local_cache("metrics_test")
+        local_cache.set("a", 1)
+        local_cache.get("a")
+        local_cache.get("b")
+        RequestStats.flush()
+        metrics = get_metrics()
+        self.assertTrue(metrics.endswith("# EOF\n"))
+        for line in (
+            'django_project_base_runs_total{kind="request",path="rest/path"} 2',
+            'django_project_base_runs_total{kind="function",path="tasks.send"} 1',
+            'django_project_base_duration_milliseconds_bucket{kind="request",path="rest/path",le="25.0"} 1',
+            'django_project_base_duration_milliseconds_bucket{kind="request",path="rest/path",le="500.0"} 1',
+            'django_project_base_duration_milliseconds_bucket{kind="request",path="rest/path",le="1000.0"} 2',
+            'django_project_base_duration_milliseconds_bucket{kind="request",path="rest/path",le="+Inf"} 2',
+            'django_project_base_duration_milliseconds_sum{kind="request",path="rest/path"} 720',
+            'django_project_base_db_queries_total{kind="request",path="rest/path"} 6',
+            'django_project_base_cpu_user_milliseconds_total{kind="function",path="tasks.send"} 30',
+            'django_project_base_local_cache_hits_total{cache="metrics_test"} 1',
+            'django_project_base_local_cache_hit_ratio{cache="metrics_test"} 0.5000',
+        ):
+            self.assertIn(line, metrics.splitlines())
+
+    def test_metrics_view_access(self):
+        # Rejected scrapes get 403, not a server error
+        metrics_view = convert_exception_to_response(app_metrics_view)
+        request = RequestFactory().get("/app-debug/metrics/")
+        request.user = AnonymousUser()
+        self.assertEqual(metrics_view(request).status_code, 403)
+        request.user = User(username="user")
+        self.assertEqual(metrics_view(request).status_code, 403)
+        request.user = User(username="staff", is_staff=True)
+        self.assertEqual(metrics_view(request).status_code, 200)
+
+        with self.settings(PROFILER_METRICS_TOKEN="secret"):
+            self.assertEqual(metrics_view(request).status_code, 403)
+            request = RequestFactory().get("/app-debug/metrics/", HTTP_AUTHORIZATION="Bearer secret")
+            self.assertEqual(metrics_view(request).status_code, 200)
+
+
+class TestLatencyHistogram(SimpleTestCase):
+    def test_latency_histogram(self):
+        # Bucket indexes are contiguous and every value falls into its own bucket
+        previous = -1
+        for value in range(100000):
+            index = LatencyHistogram.index(value)
+            self.assertIn(index, (previous, previous + 1))
+            low, high = LatencyHistogram.bucket_bounds(index)
+            self.assertTrue(low <= value <= high)
+            self.assertLessEqual(high - low, max(value * 0.032, 0))
+            previous = index
+
+        histogram = LatencyHistogram()
+        for value in range(1, 1001):
+            histogram.record(value)
+        other = LatencyHistogram()
+        other.record(100000, 10)
+        histogram.merge(other)
+        self.assertEqual(histogram.total, 1010)
+        percentiles = histogram.percentiles()
+        for percentile, expected in ((50, 505), (90, 909)):
+            self.assertAlmostEqual(percentiles[percentile], expected, delta=expected * 0.032)
+        self.assertGreaterEqual(percentiles[99.9], 100000)
+        self.assertEqual(LatencyHistogram().percentile(50), 0)
+
+
+class TestStackSampler(ProfilerTestBase):
+    @staticmethod
+    def _busy_function(duration):
+        end = time.time() + duration
+        while time.time() < end:
+            pass
+        return "done"
+
+    def test_stack_sampler(self):
+        self.assertTrue(StackSampler.start(hz=200))
+        self.assertFalse(StackSampler.start())
+        self._busy_function(0.2)
+        stacks = StackSampler.stop()
+        self.assertGreater(sum(stacks.values()), 10)
+        self.assertTrue(any(stack.endswith("TestStackSampler._busy_function") for stack in stacks))
+        self.assertEqual(StackSampler.stop(), {})
+
+    def test_sampled_slow_request(self):
+        def profile(sampling_rate):
+            with self.settings(PROFILER_SAMPLING_RATE=sampling_rate, PROFILER_LONG_RUNNING_TASK_THRESHOLD=100):
+                with ProfileRequest(
+                    {"REQUEST_METHOD": "FUNCTION", "PATH_INFO": "busy_function"}, self._busy_function, (0.2,), {}
+                ) as pr:
+                    self.assertEqual(pr.response, "done")
+            return [
+                data
+                for data in (caches["default"].get("long_running_cmds_data%d" % ptr) for ptr in range(50))
+                if data and data["PATH_INFO"] == "busy_function"
+            ]
+
+        self.assertNotIn("stacks", profile(0)[0])
+        caches["default"].clear()
+        stacks = profile(1)[0]["stacks"]
+        self.assertTrue(any("TestStackSampler._busy_function " in stack for stack in stacks))
+
+
+class TestMemoryProfiler(ProfilerTestBase):
+    def test_memory_profiling(self):
+        def allocate():
+            # Response is still referenced when the request ends, so its lines show up as top allocating ones
+            return [bytearray(1000) for _i in range(1000)]
+
+        with self.settings(PROFILER_MEMORY_SAMPLING_RATE=1):
+            with ProfileRequest({"REQUEST_METHOD": "FUNCTION", "PATH_INFO": "allocate"}, allocate, (), {}) as pr:
+                self.assertEqual(len(pr.response), 1000)
+        RequestStats.flush()
+        total = RequestStats.get_last_hour_totals()["allocate"]
+        self.assertEqual(total.memory_samples, 1)
+        self.assertGreater(total.memory_peak, 1000000)
+        self.assertTrue(any("test_profiling.py@" in line for line in total.memory_lines))
+
+    def test_memory_profiler_start_snapshot(self):
+        outer = MemoryProfiler()
+        self.assertTrue(outer.start())
+        # Allocated before the inner request starts: neither in its peak nor in its top lines
+        held = [bytearray(1000) for _i in range(2000)]
+        freed = bytearray(5000000)
+        del freed
+        inner = MemoryProfiler()
+        self.assertTrue(inner.start())
+        allocated = [bytearray(100) for _i in range(1000)]
+        peak, top_lines = inner.stop()
+        outer.stop()
+        self.assertEqual(len(held) + len(allocated), 3000)
+        self.assertTrue(top_lines)
+        self.assertTrue(all(size < 1000000 for _line, size in top_lines))
+        if sys.version_info >= (3, 9):
+            self.assertLess(peak, 5000000)
+
+
+class TestSqlCollector(TestCase):
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint_sql("SELECT  a FROM t WHERE b = 'x''y' AND c = 12 AND d IN (%s, %s,%s) AND e = -1.5e3"),
+            "SELECT a FROM t WHERE b = ? AND c = ? AND d IN (...) AND e = ?",
+        )
+        self.assertEqual(fingerprint_sql('SELECT "t1"."a" FROM "t1"'), 'SELECT "t1"."a" FROM "t1"')
+
+    def test_n_plus_one(self):
+        users = [User.objects.create(username="user%d" % i) for i in range(6)]
+        with SqlCollector() as collector:
+            for user in users:
+                User.objects.filter(pk=user.pk).exists()
+            User.objects.count()
+        self.assertEqual(collector.count, 7)
+        self.assertEqual(len(collector.queries), 2)
+        self.assertEqual(len(collector.n_plus_one), 1)
+        summary = {query["count"]: query for query in collector.get_summary()}
+        self.assertTrue(summary[6]["n_plus_one"])
+        self.assertFalse(summary[1]["n_plus_one"])
+        # Call site is the test, not django internals
+        self.assertIn("test_profiling.py", summary[6]["call_sites"][0][0])
+        self.assertEqual(summary[6]["call_sites"][0][1], 6)
+
+        # Wrapper is removed on exit
+        with self.assertNumQueries(1):
+            User.objects.count()
+        self.assertEqual(collector.count, 7)
@@ -0,0 +1,143 @@
+import logging
+import os
+
+from unittest import mock
+
+from django.db import connection, NotSupportedError
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+
+from django_project_base.base import UrlVarsMiddleware
+from django_project_base.caching.local_cache import LocalCache
+from django_project_base.profiling.sql_collector import fingerprint_sql, SqlCollector
+from django_project_base.query_tracker.base import StackTraceCursorWrapper
+from django_project_base.query_tracker.explain import EXPLAIN_CACHE_NAME, get_plan
+from django_project_base.query_tracker.summary import QuerySummary
+
+LOGGER_NAME = "test_query_tracker"
+
+
+class TestQueryTracker(TestCase):
+    def _get_tracker(self, **kwargs) -> StackTraceCursorWrapper:
+        cursor = connection.cursor().cursor
+        self.assertIsInstance(cursor, StackTraceCursorWrapper)
+        return StackTraceCursorWrapper(
+            LOGGER_NAME,
+            logging.INFO,
+            ("site-packages", os.path.join("django_project_base", "query_tracker")),
+            cursor.cursor,
+            connection,
+            **kwargs,
+        )
+
+    def test_disabled_logger(self):
+        tracker = self._get_tracker()
+        logging.getLogger(LOGGER_NAME).setLevel(logging.WARNING)
+        self.addCleanup(logging.getLogger(LOGGER_NAME).setLevel, logging.NOTSET)
+        with mock.patch("django_project_base.query_tracker.base.get_stack_frames") as get_stack_frames:
+            tracker.execute("SELECT 1")
+        get_stack_frames.assert_not_called()
+
+    def test_call_site_and_slow_query_stack(self):
+        tracker = self._get_tracker(slow_query_threshold=10000)
+        with self.assertLogs(LOGGER_NAME, level=logging.INFO) as logs:
+            tracker.execute("SELECT %s", ("a",))
+        self.assertEqual(len(logs.records), 1)
+        message = logs.records[0].getMessage()
+        # Fast query: only the call site is logged
+        self.assertEqual(message.count('  File "'), 1)
+        self.assertIn("in test_call_site_and_slow_query_stack", message)
+        self.assertIn('tracker.execute("SELECT %s", ("a",))', message)
+        self.assertIn("SELECT 'a'", message)
+
+        tracker.slow_query_threshold = 0
+        with self.assertLogs(LOGGER_NAME, level=logging.INFO) as logs:
+            tracker.execute("SELECT 1")
+        self.assertGreater(logs.records[0].getMessage().count('  File "'), 1)
+
+    def test_sample_rate(self):
+        tracker = self._get_tracker(sample_rate=0.5)
+        with mock.patch("random.random", side_effect=[0.9, 0.1]):
+            with self.assertLogs(LOGGER_NAME, level=logging.INFO) as logs:
+                tracker.execute("SELECT 1")
+                tracker.execute("SELECT 2")
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn("SELECT 2", logs.records[0].getMessage())
+
+    def test_executemany(self):
+        tracker = self._get_tracker()
+        tracker.execute("CREATE TEMPORARY TABLE tracker_test (value integer)")
+        with self.assertLogs(LOGGER_NAME, level=logging.INFO) as logs:
+            tracker.executemany("INSERT INTO tracker_test (value) VALUES (%s)", [(1,), (2,)])
+        message = logs.records[0].getMessage()
+        self.assertIn("in test_executemany", message)
+        # Configured filter applies: no frames from query_tracker
+        self.assertNotIn(os.path.join("query_tracker", "base.py"), message)
+        self.assertRegex(message, r"sql \d+\.\d\dms INSERT INTO tracker_test")
+
+    def test_summary(self):
+        tracker = self._get_tracker(summary=True)
+        with self.assertLogs(LOGGER_NAME, level=logging.INFO) as logs:
+            with QuerySummary("manage_command_test"):
+                for i in range(3):
+                    tracker.execute("SELECT %s", (i,))
+                tracker.execute("SELECT 'other'")
+                self.assertEqual(logs.records, [])
+        self.assertEqual(len(logs.records), 1)
+        data = logs.records[0].query_summary
+        self.assertEqual((data["name"], data["count"]), ("manage_command_test", 4))
+        self.assertEqual([(d["sql"], d["count"]) for d in data["duplicates"]], [("SELECT %s", 3)])
+        self.assertEqual(len(data["slowest"]), 4)
+        self.assertIn("test_summary", data["slowest"][0]["call_site"])
+        self.assertIn("sql summary manage_command_test 4 queries", logs.records[0].getMessage())
+
+    def test_request_summary(self):
+        tracker = self._get_tracker(summary=True)
+
+        def get_response(request):
+            tracker.execute("SELECT 1")
+            tracker.execute("SELECT 1")
+            return HttpResponse()
+
+        with self.assertLogs(LOGGER_NAME, level=logging.INFO) as logs:
+            UrlVarsMiddleware(get_response)(RequestFactory().get("/rest/some-path"))
+        self.assertEqual(len(logs.records), 1)
+        data = logs.records[0].query_summary
+        self.assertEqual((data["name"], data["count"], data["duplicates"][0]["count"]), ("/rest/some-path", 2, 2))
+
+    def test_explain(self):
+        LocalCache.get_local_cache(EXPLAIN_CACHE_NAME).clear()
+        tracker = self._get_tracker(explain_threshold=0)
+        with self.assertLogs(LOGGER_NAME, level=logging.INFO) as logs:
+            tracker.execute("SELECT id FROM auth_user WHERE username = %s", ("a",))
+            tracker.execute("SELECT id FROM auth_user WHERE username = %s", ("b",))
+        plan = get_plan(fingerprint_sql("SELECT id FROM auth_user WHERE username = %s"))
+        self.assertIn("auth_user", plan)
+        self.assertIn("plan " + plan, logs.records[0].getMessage())
+        # Explained once per fingerprint within TTL
+        self.assertEqual(LocalCache.get_local_cache(EXPLAIN_CACHE_NAME).stats()["hits"], 2)
+
+        # Statements with side effects are not explained
+        tracker.execute("CREATE TEMPORARY TABLE tracker_test (value integer)")
+        tracker.execute("INSERT INTO tracker_test (value) VALUES (%s)", (1,))
+        self.assertIsNone(get_plan(fingerprint_sql("INSERT INTO tracker_test (value) VALUES (%s)")))
+        sql = "WITH new (value) AS (SELECT 2) INSERT INTO tracker_test SELECT value FROM new"
+        tracker.execute(sql)
+        self.assertIsNone(get_plan(fingerprint_sql(sql)))
+
+        # Plans are attached to queries of slow requests shown on app-debug page
+        with SqlCollector() as collector, connection.cursor() as cursor:
+            cursor.cursor.explain_threshold = 0
+            cursor.execute("SELECT id FROM auth_user WHERE email = %s", ("a",))
+        self.assertIn("auth_user", collector.get_summary()[0]["plan"])
+
+    def test_explain_not_supported(self):
+        LocalCache.get_local_cache(EXPLAIN_CACHE_NAME).clear()
+        tracker = self._get_tracker(explain_threshold=0)
+        with mock.patch.object(connection.ops, "explain_query_prefix", side_effect=NotSupportedError("no EXPLAIN")):
+            with self.assertLogs("django_project_base.query_tracker.explain", level=logging.WARNING) as logs:
+                tracker.execute("SELECT id FROM auth_user WHERE username = %s", ("a",))
+        self.assertIn("no EXPLAIN", logs.records[0].getMessage())
+        self.assertIn("EXPLAIN failed", get_plan(fingerprint_sql("SELECT id FROM auth_user WHERE username = %s")))
+        # Transaction of the test is still usable
+        tracker.execute("SELECT 1")
@@ -0,0 +1,171 @@
+import pickle
+import threading
+import time
+import uuid
+
+from django.core.cache import caches
+from django.test import override_settings, TestCase
+
+from django_project_base.caching.codec import ModelCacheCodec
+from django_project_base.caching.local_cache import LocalCache
+from django_project_base.notifications.models import DjangoProjectBaseNotification
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "",
+        }
+    }
+)
+class TestQuerySetWithCache(TestCase):
+    def setUp(self):
+        super().setUp()
+        caches["default"].clear()
+        LocalCache.clear_all()
+
+    @staticmethod
+    def _create_notification(**kwargs):
+        return DjangoProjectBaseNotification.objects.create(
+            content_entity_context="", recipients_original_payload="", **kwargs
+        )
+
+    def test_generation_invalidation(self):
+        objects = DjangoProjectBaseNotification.objects
+        notification = self._create_notification(project_slug="one")
+        self.assertEqual(len(objects.list(project_slug="one")), 1)
+        self.assertEqual(objects.get(pk=notification.pk).project_slug, "one")
+
+        # Query is not executed again while nothing has changed
+        with self.assertNumQueries(0):
+            self.assertEqual(len(objects.list(project_slug="one")), 1)
+            self.assertEqual(objects.get(pk=notification.pk).project_slug, "one")
+
+        # create invalidates all cached data of the model
+        self._create_notification(project_slug="one")
+        self.assertEqual(len(objects.list(project_slug="one")), 2)
+
+        # update invalidates all cached data of the model
+        objects.filter(pk=notification.pk).update(project_slug="two")
+        self.assertEqual(len(objects.list(project_slug="one")), 1)
+        self.assertEqual(objects.get(pk=notification.pk).project_slug, "two")
+
+        # save / delete invalidate the cache through invalidate_cache
+        notification.delete()
+        self.assertEqual(len(objects.list(project_slug="two")), 0)
+
+        # Deprecated cache_delete_pattern invalidates all cached data of the model too
+        with self.assertWarns(DeprecationWarning), self.assertNumQueries(1):
+            objects.cache_delete_pattern("djangoprojectbasenotification*")
+            self.assertEqual(len(objects.list(project_slug="two")), 0)
+
+    def test_local_cache(self):
+        objects = DjangoProjectBaseNotification.objects
+        self._create_notification(project_slug="one")
+        self.assertEqual(len(objects.list(project_slug="one")), 1)
+        local_cache = objects.all().local_cache
+        hits = local_cache.hits
+
+        # Second read is served from process memory, without touching the shared cache
+        with self.assertNumQueries(0):
+            self.assertEqual(len(objects.list(project_slug="one")), 1)
+        self.assertEqual(local_cache.hits, hits + 1)
+
+        # Every hit gets its own instances: changing one doesn't change what others get
+        first = objects.list(project_slug="one")
+        first[0].project_slug = "changed"
+        self.assertEqual(objects.list(project_slug="one")[0].project_slug, "one")
+
+        # Invalidation in this process is seen by the local tier immediately
+        self._create_notification(project_slug="one")
+        self.assertEqual(len(objects.list(project_slug="one")), 2)
+
+        # LRU evicts least recently used entries
+        lru = LocalCache("test", max_size=2, timeout=5)
+        for i in range(3):
+            lru.set(i, i)
+        self.assertIsNone(lru.get(0))
+        self.assertEqual(lru.get(2), 2)
+        self.assertEqual(lru.evictions, 1)
+        self.assertEqual(lru.stats()["hit_ratio"], 0.5)
+
+    def test_stampede_protection(self):
+        objects = DjangoProjectBaseNotification.objects.all()
+        self.assertTrue(objects.cache_stampede_protection)
+        ck = objects.get_cache_key("stampede")
+        computed = []
+
+        def _compute():
+            computed.append(1)
+            time.sleep(0.3)
+            return len(computed)
+
+        # Concurrent misses compute the value only once
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(objects.cache_get_or_compute(ck, _compute)))
+                   for _i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [1] * 5)
+        self.assertEqual(len(computed), 1)
+
+        # Expired entry is served stale while another worker holds the recompute lock
+        protected_ck = objects.get_protected_cache_key(ck)
+        caches["default"].set(protected_ck, objects.cache_codec.encode((1, time.time() - 1, 0.3)))
+        LocalCache.clear_all()
+        caches["default"].add("%s__lock" % protected_ck, 1)
+        self.assertEqual(objects.cache_get_or_compute(ck, _compute), 1)
+        self.assertEqual(len(computed), 1)
+        caches["default"].delete("%s__lock" % protected_ck)
+        self.assertEqual(objects.cache_get_or_compute(ck, _compute), 2)
+
+        # Values of other shapes (e.g. a plain value stored before protection was enabled) are misses
+        caches["default"].set(protected_ck, objects.cache_codec.encode((3, "x")))
+        LocalCache.clear_all()
+        self.assertEqual(objects.cache_get_or_compute(ck, _compute), 3)
+        self.assertEqual(len(computed), 3)
+
+    def test_in_bulk(self):
+        objects = DjangoProjectBaseNotification.objects
+        pks = [self._create_notification(project_slug=str(i)).pk for i in range(5)]
+
+        # One query loads all misses, later loads are served from cache
+        with self.assertNumQueries(1):
+            self.assertEqual(set(objects.in_bulk(pks[:3])), set(pks[:3]))
+        with self.assertNumQueries(1):
+            loaded = objects.in_bulk(pks)
+        self.assertEqual([loaded[pk].project_slug for pk in pks], [str(i) for i in range(5)])
+        with self.assertNumQueries(0):
+            self.assertEqual(set(objects.in_bulk(pks)), set(pks))
+            # entries are shared with get(pk=...)
+            self.assertEqual(objects.get(pk=pks[0]).project_slug, "0")
+            self.assertEqual(objects.get(id=str(pks[1])).project_slug, "1")
+
+        # Nonexistent pks are not returned
+        with self.assertNumQueries(1):
+            self.assertEqual(set(objects.in_bulk(pks + [uuid.uuid4()])), set(pks))
+
+        # Filtered querysets are not served from cache
+        self.assertEqual(objects.filter(project_slug="0").in_bulk(pks), {pks[0]: loaded[pks[0]]})
+
+    def test_model_cache_codec(self):
+        codec = ModelCacheCodec(compress_threshold=100)
+        notifications = [self._create_notification(project_slug=str(i)) for i in range(3)]
+        notifications[0].message  # noqa: B018 - fills related objects cache, which must not be stored
+
+        encoded = codec.encode((notifications, notifications[0], {"key": None}))
+        self.assertLess(len(encoded), len(pickle.dumps(notifications)))
+        decoded_list, decoded_item, decoded_dict = codec.decode(encoded)
+        self.assertEqual([item.pk for item in decoded_list], [item.pk for item in notifications])
+        self.assertEqual([item.project_slug for item in decoded_list], ["0", "1", "2"])
+        self.assertEqual(decoded_item.pk, notifications[0].pk)
+        self.assertFalse(decoded_item._state.adding)
+        self.assertEqual(decoded_item._state.fields_cache, {})
+        self.assertEqual(decoded_dict, {"key": None})
+
+        # Values not encoded by codec are treated as cache misses
+        self.assertIsNone(codec.decode(notifications))
+        self.assertIsNone(codec.decode(None))
@@ -6,6 +6,7 @@ from django.test import override_settings, SimpleTestCase
 
 from django_project_base.caching import CacheCounter
 from django_project_base.serialization import CacheLock, NoTimeoutCheck, ObjectLockTimeout
+from tests.test_caching import get_redis_cache_backend_name
 
 
 class TestSerialization(SimpleTestCase):
@@ -141,3 +142,58 @@ class TestSerialization(SimpleTestCase):
 
         expect_processed += 1
         _check_counters()
+
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': '',
+        }
+    })
+    def test_serialization_lock_ownership_loc_mem_cache(self):
+        self._test_lock_ownership()
+
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': get_redis_cache_backend_name(),
+            'LOCATION': 'redis://127.0.0.1:6379?db=1',
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            },
+        }
+    })
+    def test_serialization_lock_ownership_redis_cache(self):
+        self._test_lock_ownership()
+
+    def _test_lock_ownership(self):
+        caches["default"].clear()
+
+        def _try_lock(silence):
+            with CacheLock("Owned", timeout=-1, silence_object_lock_timeout=silence) as cl:
+                if silence:
+                    cl()
+                return True
+
+        with CacheLock("Owned"):
+            # Lock is held, so other users skip the with block
+            self.assertIsNone(_try_lock(True))
+            # Exiting without timeout check must not release somebody else's lock
+            with self.assertRaises(NoTimeoutCheck):
+                _try_lock(False)
+            self.assertIsNone(_try_lock(True))
+        self.assertTrue(_try_lock(True))
+
+        # Waiter is woken up by release and does not wait for the whole timeout
+        times = dict()
+
+        def _wait_for_lock():
+            with CacheLock("Owned", timeout=5) as cl:
+                cl()
+                times["acquired"] = time.time()
+
+        with CacheLock("Owned"):
+            waiter = threading.Thread(target=_wait_for_lock)
+            waiter.start()
+            time.sleep(.3)
+            times["released"] = time.time()
+        waiter.join()
+        self.assertLess(times["acquired"] - times["released"], 1)